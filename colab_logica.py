@@ -18,6 +18,7 @@
 
 from decimal import Decimal
 import getpass
+import itertools
 import json
 import re
 
@@ -37,6 +38,7 @@ from IPython.core.magic import register_cell_magic
 from IPython.display import display
 
 import os
+import threading
 
 import pandas
 
@@ -69,6 +71,9 @@ PROJECT = None
 # TODO: Should this be renamed to PSQL_ENGINE, PSQL_CONNECTION?
 DB_ENGINE = None
 DB_CONNECTION = None
+# Function opening a new connection to the database of DB_CONNECTION, used
+# to build tables concurrently. See SetDbConnection.
+DB_CONNECT = None
 
 USER_AUTHENTICATED = False
 
@@ -78,6 +83,15 @@ SHOW_FULL_QUERY = True
 
 PREAMBLE = None
 
+# Number of tables Concertina may build at the same time, None to build them
+# one by one. See SetMaxConcurrency.
+MAX_CONCURRENCY = None
+
+# Whether results are read in chunks of RESULT_CHUNK_SIZE rows as they are
+# iterated, instead of being loaded at once. See SetStreamResults.
+STREAM_RESULTS = False
+RESULT_CHUNK_SIZE = psql_logica.FETCH_BATCH_SIZE
+
 if hasattr(concertina_lib, 'graphviz'):
   DISPLAY_MODE = 'colab'
 else:
@@ -85,6 +99,10 @@ else:
 
 DEFAULT_ENGINE = 'bigquery'
 
+# Types inferred in previous cells are reused for predicates whose rules and
+# dependencies did not change.
+infer.process_cache = infer.InferenceCache()
+
 
 def SetPreamble(preamble):
   global PREAMBLE
@@ -94,13 +112,46 @@ def SetProject(project):
   global PROJECT
   PROJECT = project
 
-def SetDbConnection(connection):
+def SetMaxConcurrency(max_concurrency):
+  """Sets how many tables may be built at the same time.
+
+  See concertina_lib.Concertina. On PostgreSQL each concurrent query runs on
+  its own connection, so the connection must have been opened with
+  ConnectToPostgres or set with a connect function. SQLite databases of
+  cells live in a single connection, so they are built one table at a time.
+  """
+  concertina_lib.CheckMaxConcurrency(max_concurrency)
+  global MAX_CONCURRENCY
+  MAX_CONCURRENCY = max_concurrency
+
+def SetStreamResults(stream_results, chunk_size=None):
+  """Makes variables of predicates iterators over DataFrame chunks.
+
+  Only the first chunk is fetched to be displayed, so large results are
+  held in memory one chunk at a time. PostgreSQL connections are in
+  autocommit mode, so the server computes the whole result before the
+  first chunk and keeps it until the iterator is exhausted or dropped,
+  see psql_logica.PostgresQuery.
+  """
+  global STREAM_RESULTS
+  global RESULT_CHUNK_SIZE
+  STREAM_RESULTS = stream_results
+  RESULT_CHUNK_SIZE = chunk_size or RESULT_CHUNK_SIZE
+
+def SetDbConnection(connection, connect=None):
+  """Sets connection to PostgreSQL.
+
+  Connect is a function opening more connections to the same database, it
+  is needed to build tables concurrently.
+  """
   global DB_CONNECTION
+  global DB_CONNECT
   DB_CONNECTION = connection
+  DB_CONNECT = connect
 
 def ConnectToPostgres(mode='interactive'):
-  connection = psql_logica.ConnectToPostgres(mode)
-  SetDbConnection(connection)
+  connect = psql_logica.PostgresConnector(mode)
+  SetDbConnection(connect(), connect)
   global DEFAULT_ENGINE
   DEFAULT_ENGINE = 'psql'
 
@@ -158,27 +209,28 @@ def ParseList(line):
   return predicates
 
 
-def RunSQL(sql, engine, connection=None, is_final=False):
+def RunSQL(sql, engine, connection=None, is_final=False, stream=False):
   if engine == 'bigquery':
     client = bigquery.Client(project=PROJECT)
-    return client.query(sql).to_dataframe()
+    df = client.query(sql).to_dataframe()
+    return iter([df]) if stream else df
   elif engine == 'psql':
     if is_final:
-      cursor = psql_logica.PostgresExecute(sql, connection)
-      rows = cursor.fetchall()
-      df = pandas.DataFrame(
-        rows, columns=[d[0] for d in cursor.description])
-      df = df.applymap(psql_logica.DigestPsqlType)
-      return df
+      cursor = psql_logica.PostgresQuery(sql, connection, RESULT_CHUNK_SIZE)
+      if stream:
+        return psql_logica.ResultStream(cursor, RESULT_CHUNK_SIZE).DataFrames()
+      return psql_logica.FetchDataFrame(cursor, RESULT_CHUNK_SIZE)
     else:
       psql_logica.PostgresExecute(sql, connection)
   elif engine == 'sqlite':
     try:
       if is_final:
         # For final predicates this SQL is always a single statement.
+        if stream:
+          return pandas.read_sql(sql, connection, chunksize=RESULT_CHUNK_SIZE)
         return pandas.read_sql(sql, connection)
       else:
-        connection.executescript(sql)
+        sqlite3_logica.ExecuteScript(connection, sql)
     except Exception as e:
       print("\n--- SQL ---")
       print(sql)
@@ -204,14 +256,22 @@ class SqliteRunner(object):
     self.connection = sqlite3_logica.SqliteConnect()
   
   # TODO: Sqlite runner should not be accepting an engine.
-  def __call__(self, sql, engine, is_final):
-    return RunSQL(sql, engine, self.connection, is_final)
+  def __call__(self, sql, engine, is_final, stream=False):
+    return RunSQL(sql, engine, self.connection, is_final, stream)
 
 
 class PostgresRunner(object):
-  def __init__(self):
+  """Runs queries on DB_CONNECTION, or concurrently on pooled connections.
+
+  Connections of the pool are opened with DB_CONNECT as concurrent queries
+  need them and are reused by later queries of the runner.
+  """
+  def __init__(self, concurrent=False):
     global DB_CONNECTION
     global DB_ENGINE
+    self.concurrent = concurrent
+    self.idle_connections = []
+    self.lock = threading.Lock()
     if not DB_CONNECTION:
       try:
         ConnectToLocalPostgres()  
@@ -229,9 +289,23 @@ class PostgresRunner(object):
         return
       PostgresJumpStart()
     self.connection = DB_CONNECTION
-  
-  def  __call__(self, sql, engine, is_final):
-    return RunSQL(sql, engine, self.connection, is_final)
+    if concurrent and not DB_CONNECT:
+      raise Exception(
+          'Building tables concurrently needs a connection per query. '
+          'Please connect with ConnectToPostgres or pass connect function '
+          'to SetDbConnection.')
+
+  def  __call__(self, sql, engine, is_final, stream=False):
+    if not self.concurrent:
+      return RunSQL(sql, engine, self.connection, is_final, stream)
+    with self.lock:
+      connection = (self.idle_connections.pop() if self.idle_connections
+                    else DB_CONNECT())
+    try:
+      return RunSQL(sql, engine, connection, is_final, stream)
+    finally:
+      with self.lock:
+        self.idle_connections.append(connection)
 
 
 def ShowError(error_text):
@@ -309,10 +383,13 @@ def Logica(line, cell, run_query):
                 color.Warn(predicate + '_sql'))
 
   with bar.output_to(logs_idx):
+    max_concurrency = MAX_CONCURRENCY
     if engine == 'sqlite':
+      # Queries share the connection holding the database of the cell.
+      max_concurrency = None
       sql_runner = SqliteRunner()
     elif engine == 'psql':
-      sql_runner = PostgresRunner()
+      sql_runner = PostgresRunner(concurrent=max_concurrency is not None)
     elif engine == 'bigquery':
       EnsureAuthenticatedUser()
       sql_runner = RunSQL
@@ -322,17 +399,31 @@ def Logica(line, cell, run_query):
     try:                  
       result_map = concertina_lib.ExecuteLogicaProgram(
         executions, sql_runner=sql_runner, sql_engine=engine,
-        display_mode=DISPLAY_MODE)
+        display_mode=DISPLAY_MODE, max_concurrency=max_concurrency,
+        stream_final=STREAM_RESULTS)
     except infer.TypeErrorCaughtException as e:
       e.ShowMessage()
       return
 
   for idx, predicate in enumerate(predicates):
     t = result_map[predicate]
-    ip.push({predicate: t})
+    if STREAM_RESULTS:
+      first_chunk = next(t, None)
+      chunks = [first_chunk] if first_chunk is not None else []
+      ip.push({predicate: itertools.chain(chunks, t)})
+    else:
+      ip.push({predicate: t})
     with bar.output_to(idx):
       with sub_bars[idx].output_to(1): 
-        if run_query:
+        if run_query and STREAM_RESULTS:
+          print(
+              color.Format(
+                  'The following is the first chunk of the table. '
+                  'Iterator over its chunks is stored at {warning}%s{end} '
+                  'variable.' %
+                  predicate))
+          display(first_chunk)
+        elif run_query:
           print(
               color.Format(
                   'The following table is stored at {warning}%s{end} '
@@ -346,14 +437,15 @@ def Logica(line, cell, run_query):
 
 def ConnectToLocalPostgres():
   import psycopg2
-  connection = psycopg2.connect(host='localhost', database='logica', user='logica', password='logica')
-  connection.autocommit = True
+  def Connect():
+    connection = psycopg2.connect(host='localhost', database='logica', user='logica', password='logica')
+    connection.autocommit = True
+    return connection
 
+  SetDbConnection(Connect(), Connect)
   print('Connected.')
   global DEFAULT_ENGINE
-  global DB_CONNECTION
   DEFAULT_ENGINE = 'psql'
-  DB_CONNECTION = connection
 
 
 def PostgresJumpStart():
@@ -0,0 +1,248 @@
+#!/usr/bin/python
+#
+# Copyright 2023 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Asyncio execution of Concertina workflows.
+
+Actions of the workflow run as coroutines, so that one process can drive
+many Logica pipelines at once without a thread per pipeline. SQL runners
+are coroutine functions called as the blocking ones:
+  result = await sql_runner(sql, engine, is_final=is_final)
+
+AsyncpgRunner runs PostgreSQL queries with asyncpg. ThreadRunner adapts a
+blocking runner, e.g. for SQLite or BigQuery, by running it on threads.
+
+Example:
+  runner = concertina_async.ThreadRunner(
+      run_in_terminal.SqlRunner('sqlite'))
+  result = await concertina_async.ExecuteLogicaProgram(
+      [program.execution], runner, 'sqlite', timeout=60)
+"""
+
+import asyncio
+import functools
+import json
+from decimal import Decimal
+
+if '.' not in __package__:
+  from common import concertina_lib
+  from common import psql_logica
+else:
+  from ..common import concertina_lib
+  from ..common import psql_logica
+
+
+class ThreadRunner(object):
+  """Runs a blocking SQL runner on threads of an executor.
+
+  A thread can not be stopped, so when a query is cancelled interrupt is
+  called to abort it, e.g. interrupt method of the SQLite connection of the
+  runner. Runner must be thread safe if queries run concurrently.
+  """
+
+  def __init__(self, sql_runner, executor=None, interrupt=None):
+    self.sql_runner = sql_runner
+    self.executor = executor
+    self.interrupt = interrupt
+
+  async def __call__(self, sql, engine, is_final):
+    loop = asyncio.get_running_loop()
+    try:
+      return await loop.run_in_executor(
+          self.executor,
+          functools.partial(self.sql_runner, sql, engine, is_final=is_final))
+    except asyncio.CancelledError:
+      if self.interrupt:
+        self.interrupt()
+      raise
+
+
+async def InitAsyncpgConnection(connection):
+  """Decodes JSON values as psycopg2 does, use as init of asyncpg pool."""
+  for json_type in ['json', 'jsonb']:
+    await connection.set_type_codec(json_type, encoder=json.dumps,
+                                    decoder=json.loads, schema='pg_catalog')
+
+
+def DigestAsyncpgType(x):
+  """Converts value read by asyncpg as DigestPsqlType does for psycopg2."""
+  if isinstance(x, Decimal):
+    return psql_logica.DigestNumeric(x)
+  if isinstance(x, list):
+    return [DigestAsyncpgType(v) for v in x]
+  if hasattr(x, 'items') and not isinstance(x, dict):
+    # Record of a composite type.
+    return {k: DigestAsyncpgType(v) for k, v in x.items()}
+  return x
+
+
+class AsyncpgRunner(object):
+  """Runs PostgreSQL queries with asyncpg on connections of a pool.
+
+  Pool is created by asyncpg.create_pool, preferably with
+  init=InitAsyncpgConnection. Final queries are single statements, prepared
+  to learn their columns, and return header and rows. Other SQL may be a
+  script. Cancelling a query cancels it on the server.
+  """
+
+  def __init__(self, pool):
+    self.pool = pool
+
+  async def __call__(self, sql, engine, is_final):
+    async with self.pool.acquire() as connection:
+      if not is_final:
+        await connection.execute(sql)
+        return None
+      statement = await connection.prepare(sql)
+      attributes = statement.get_attributes()
+      decoders = [
+          DigestAsyncpgType if d is psql_logica.DigestPsqlType else d
+          for d in psql_logica.ColumnDecoders(
+              [(a.name, a.type.oid) for a in attributes])]
+      rows = await statement.fetch()
+      return [a.name for a in attributes], [
+          [decoder(v) if decoder else v for decoder, v in zip(decoders, row)]
+          for row in rows]
+
+
+class AsyncConcertinaQueryEngine(object):
+  """Runs query actions with a coroutine SQL runner.
+
+  Queries of an engine run under its semaphore, which bounds how many of
+  them run at once. Semaphores may be shared by workflows, so that
+  pipelines driven by a process do not overload a database together.
+  """
+
+  def __init__(self, final_predicates, sql_runner, semaphores,
+               action_timeout=None):
+    self.final_predicates = final_predicates
+    self.final_result = {}
+    self.sql_runner = sql_runner
+    self.semaphores = semaphores
+    self.action_timeout = action_timeout
+
+  async def Query(self, sql, engine, is_final):
+    return await asyncio.wait_for(
+        self.sql_runner(sql, engine, is_final=is_final), self.action_timeout)
+
+  async def Run(self, action):
+    """Runs the action, returns whether a layer of recursion converged."""
+    if action['launcher'] != 'query':
+      return False
+    predicate = action['predicate']
+    engine = action['engine']
+    is_final = predicate in self.final_predicates
+    async with self.semaphores[engine]:
+      if is_final:
+        # Final query runs on its own, as a single prepared statement.
+        if action['preamble']:
+          await self.Query(action['preamble'], engine, is_final=False)
+        self.final_result[predicate] = await self.Query(
+            action['query'], engine, is_final=True)
+      else:
+        await self.Query(action['sql'], engine, is_final=False)
+      if 'fixpoint' in action:
+        check = await self.Query(action['fixpoint']['check_sql'], engine,
+                                 is_final=True)
+        return bool(concertina_lib.FirstValue(check))
+    return False
+
+
+async def RunWorkflow(config, engine):
+  """Runs each action of the config once the actions it requires are done.
+
+  When an action fails, actions depending on it fail without running, the
+  rest of the workflow completes and the first error is raised. Cancelling
+  the workflow cancels running actions.
+  """
+  action = {a['name']: a for a in config}
+  skipped = set()
+  tasks = {}
+
+  async def RunAction(name):
+    await asyncio.gather(*(tasks[r] for r in action[name]['requires']))
+    if name in skipped:
+      return
+    if await engine.Run(action[name].get('action', {})):
+      # Layers after the converged one are skipped, the last one copies it.
+      fixpoint = action[name]['action']['fixpoint']
+      skipped.update(fixpoint['skip'])
+      last = action[fixpoint['last']]
+      last['action'] = concertina_lib.CopyingConvergedLayer(last['action'],
+                                                           fixpoint)
+
+  for name in action:
+    tasks[name] = asyncio.ensure_future(RunAction(name))
+  results = await asyncio.gather(*tasks.values(), return_exceptions=True)
+  for result in results:
+    if isinstance(result, BaseException):
+      raise result
+
+
+def EngineSemaphores(config, max_concurrency, semaphores=None):
+  """Adds semaphores of engines of the config that semaphores lack.
+
+  Max_concurrency is a number of queries of an engine that may run at the
+  same time, or a dictionary from engine to such number.
+  """
+  concertina_lib.CheckMaxConcurrency(max_concurrency)
+  semaphores = semaphores if semaphores is not None else {}
+  for a in config:
+    engine = a.get('action', {}).get('engine')
+    if engine and engine not in semaphores:
+      if isinstance(max_concurrency, dict):
+        limit = max_concurrency.get(engine, 1)
+      else:
+        limit = max_concurrency
+      semaphores[engine] = asyncio.Semaphore(limit)
+  return semaphores
+
+
+async def ExecuteLogicaProgram(logica_executions, sql_runner, sql_engine,
+                               max_concurrency=1, semaphores=None,
+                               timeout=None, action_timeout=None):
+  """Runs the workflow of the executions, returning final predicates.
+
+  Args:
+    logica_executions: Executions of the program, as for
+      concertina_lib.ExecuteLogicaProgram.
+    sql_runner: Coroutine function running SQL, e.g. AsyncpgRunner or
+      ThreadRunner.
+    sql_engine: Engine of the program.
+    max_concurrency: Number of queries that may run at the same time, or a
+      dictionary from engine to such number.
+    semaphores: Dictionary from engine to asyncio.Semaphore bounding its
+      queries, shared by workflows. Missing engines are added to it.
+    timeout: Seconds the whole workflow may take.
+    action_timeout: Seconds a single query may take.
+
+  Raises:
+    asyncio.TimeoutError: When the workflow or a query timed out. Running
+      queries are cancelled then.
+  """
+  config, final_predicates, preambles = concertina_lib.LogicaWorkflow(
+      logica_executions, sql_engine)
+  semaphores = EngineSemaphores(config, max_concurrency, semaphores)
+  engine = AsyncConcertinaQueryEngine(final_predicates, sql_runner,
+                                      semaphores, action_timeout)
+
+  async def Execute():
+    for preamble in preambles:
+      if preamble:
+        await engine.Query(preamble, sql_engine, is_final=False)
+    await RunWorkflow(config, engine)
+    return engine.final_result
+
+  return await asyncio.wait_for(Execute(), timeout)
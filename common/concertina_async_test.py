@@ -0,0 +1,183 @@
+#!/usr/bin/python
+#
+# Copyright 2023 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Unitests for concertina_async.py."""
+
+import asyncio
+import collections
+import contextlib
+import time
+import unittest
+from decimal import Decimal
+
+from common import concertina_async
+from common import sqlite3_logica
+from compiler import universe
+from parser_py import parse
+
+
+PROGRAM = '''
+@Engine("sqlite");
+Edge(a: x, b: x + 1) :- x in Range(5);
+@Recursive(Reach, 20, stop_on_fixpoint: true);
+Reach(x) distinct :- x == 0;
+Reach(y) distinct :- Reach(x), Edge(a: x, b: y);
+Total() += x :- Reach(x);
+Count() += 1 :- Reach(x);
+'''
+
+
+class SqliteRunner(object):
+  """Blocking runner, recording the queries it runs."""
+
+  def __init__(self, delay=0):
+    self.connection = sqlite3_logica.SqliteConnect()
+    self.delay = delay
+    self.queries = []
+
+  def __call__(self, sql, engine, is_final):
+    self.queries.append(sql)
+    time.sleep(self.delay)
+    if is_final:
+      cursor = self.connection.execute(sql)
+      return [d[0] for d in cursor.description], cursor.fetchall()
+    sqlite3_logica.ExecuteScript(self.connection, sql)
+
+
+UDF_PROGRAM = '''
+@Engine("psql");
+@CompileAsUdf(Double);
+Double(x) = 2 * x;
+Test(y: Double(x)) :- x in [1, 2];
+'''
+
+
+# Record of a composite type, as asyncpg returns it.
+Record = collections.UserDict
+Attribute = collections.namedtuple('Attribute', ['name', 'type'])
+Type = collections.namedtuple('Type', ['oid'])
+
+
+class Statement(object):
+  """Prepared statement of asyncpg, returning fixed rows."""
+
+  def __init__(self, attributes, rows):
+    self.attributes = attributes
+    self.rows = rows
+
+  def get_attributes(self):
+    return self.attributes
+
+  async def fetch(self):
+    return self.rows
+
+
+class Connection(object):
+  """Connection of asyncpg, recording the SQL it is given."""
+
+  def __init__(self, statement):
+    self.statement = statement
+    self.executed = []
+    self.prepared = []
+
+  async def execute(self, sql):
+    self.executed.append(sql)
+
+  async def prepare(self, sql):
+    self.prepared.append(sql)
+    return self.statement
+
+
+class Pool(object):
+  """Pool of asyncpg, with a single connection."""
+
+  def __init__(self, connection):
+    self.connection = connection
+
+  @contextlib.asynccontextmanager
+  async def acquire(self):
+    yield self.connection
+
+
+class AsyncpgRunnerTest(unittest.TestCase):
+  def test_Execute(self):
+    statement = Statement(
+        [Attribute('y', Type(1700)), Attribute('r', Type(16384))],
+        [(Decimal(2), Record(a=Decimal('0.5'))), (Decimal(4), None)])
+    connection = Connection(statement)
+    program = universe.LogicaProgram(parse.ParseFile(UDF_PROGRAM)['rule'])
+    program.FormattedPredicateSql('Test')
+    result = asyncio.run(concertina_async.ExecuteLogicaProgram(
+        [program.execution], concertina_async.AsyncpgRunner(Pool(connection)),
+        'psql'))
+    self.assertEqual(result, {'Test': (['y', 'r'],
+                                       [[2, {'a': 0.5}], [4, None]])})
+    self.assertIsInstance(result['Test'][1][0][1]['a'], float)
+    # Preamble defining the function is not a part of the prepared query.
+    [query] = connection.prepared
+    self.assertNotIn('CREATE', query)
+    self.assertTrue(any(sql.startswith('CREATE TEMP FUNCTION Double')
+                        for sql in connection.executed))
+
+
+class EngineSemaphoresTest(unittest.TestCase):
+  def test_InvalidLimit(self):
+    config = [{'name': 'a', 'requires': [], 'action': {'engine': 'psql'}}]
+    for limit in [0, {'psql': 0}]:
+      with self.assertRaises(ValueError):
+        concertina_async.EngineSemaphores(config, limit)
+
+
+class ExecuteLogicaProgramTest(unittest.TestCase):
+  def Executions(self, predicates):
+    program = universe.LogicaProgram(parse.ParseFile(PROGRAM)['rule'])
+    result = []
+    for p in predicates:
+      program.FormattedPredicateSql(p)
+      result.append(program.execution)
+    return result
+
+  def test_Execute(self):
+    runner = SqliteRunner()
+    result = asyncio.run(concertina_async.ExecuteLogicaProgram(
+        self.Executions(['Total', 'Count']),
+        concertina_async.ThreadRunner(runner), 'sqlite', max_concurrency=2))
+    self.assertEqual(result, {'Total': (['logica_value'], [(15,)]),
+                              'Count': (['logica_value'], [(6,)])})
+    # Layers after the fixpoint are not computed.
+    self.assertFalse(any('Reach_r10' in q for q in runner.queries))
+
+  def test_RecursivePredicateIsFinal(self):
+    runner = SqliteRunner()
+    result = asyncio.run(concertina_async.ExecuteLogicaProgram(
+        self.Executions(['Reach']),
+        concertina_async.ThreadRunner(runner), 'sqlite'))
+    header, rows = result['Reach']
+    self.assertEqual(sorted(rows), [(x,) for x in range(6)])
+    self.assertFalse(any('Reach_r10' in q for q in runner.queries))
+
+  def test_Timeout(self):
+    interrupted = []
+    runner = concertina_async.ThreadRunner(
+        SqliteRunner(delay=0.3), interrupt=lambda: interrupted.append(True))
+    with self.assertRaises(asyncio.TimeoutError):
+      asyncio.run(concertina_async.ExecuteLogicaProgram(
+          self.Executions(['Total']), runner, 'sqlite', timeout=0.1))
+    self.assertEqual(interrupted, [True])
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -1,5 +1,7 @@
 """Concertina: small Python Workflow execution handler."""
 
+import collections
+import concurrent.futures
 import datetime
 
 try:
@@ -22,33 +24,100 @@ if '.' not in __package__:
 else:
   from ..common import graph_art
 
+def CheckMaxConcurrency(max_concurrency):
+  """Checks that limits of concurrency allow to run actions."""
+  if max_concurrency is None:
+    return
+  limits = (max_concurrency.values() if isinstance(max_concurrency, dict)
+            else [max_concurrency])
+  for limit in limits:
+    if not isinstance(limit, int) or limit < 1:
+      raise ValueError(
+          'Concurrency limit must be a positive integer, got: %r' % (limit,))
+
+
 class ConcertinaQueryEngine(object):
   def __init__(self, final_predicates, sql_runner,
-               print_running_predicate=True):
+               print_running_predicate=True, concurrent=False,
+               stream_final=False):
     self.final_predicates = final_predicates
     self.final_result = {}
     self.sql_runner = sql_runner
     self.print_running_predicate = print_running_predicate
+    # When actions run concurrently the predicate is printed once it is done,
+    # so that lines of different actions do not mix.
+    self.concurrent = concurrent
+    # Whether results of final predicates are requested from sql_runner as
+    # streams, which are read after the workflow is complete.
+    self.stream_final = stream_final
 
   def Run(self, action):
     assert action['launcher'] in ('query', 'none')
     if action['launcher'] == 'query':
       predicate = action['predicate']
-      if self.print_running_predicate:
+      if self.print_running_predicate and not self.concurrent:
         print('Running predicate:', predicate, end='')
       start = datetime.datetime.now()
-      result = self.sql_runner(action['sql'], action['engine'],
-                               is_final=(predicate in self.final_predicates))
+      if predicate in self.final_predicates:
+        # Final query runs on its own, e.g. in a server-side cursor.
+        if action['preamble']:
+          self.sql_runner(action['preamble'], action['engine'],
+                          is_final=False)
+        if self.stream_final:
+          result = self.sql_runner(action['query'], action['engine'],
+                                   is_final=True, stream=True)
+        else:
+          result = self.sql_runner(action['query'], action['engine'],
+                                   is_final=True)
+      else:
+        result = self.sql_runner(action['sql'], action['engine'],
+                                 is_final=False)
       end = datetime.datetime.now()
       if self.print_running_predicate:
-        print(' (%d ms)' % int((end - start).total_seconds() * 1000))
+        elapsed = ' (%d ms)' % int((end - start).total_seconds() * 1000)
+        if self.concurrent:
+          print('Ran predicate:', predicate + elapsed)
+        else:
+          print(elapsed)
       if predicate in self.final_predicates:
         self.final_result[predicate] = result
+      if 'fixpoint' in action:
+        return self.Converged(action)
+
+  def Converged(self, action):
+    """Whether layer of a recursion built by the action equals previous one."""
+    result = self.sql_runner(action['fixpoint']['check_sql'],
+                             action['engine'], is_final=True)
+    converged = bool(FirstValue(result))
+    if converged and self.print_running_predicate:
+      print('Fixpoint reached at predicate:', action['predicate'])
+    return converged
+
+
+def CopyingConvergedLayer(action, fixpoint):
+  """Action of the last layer of a recursion that converged earlier.
+
+  The table of the last layer copies the converged layer. A final predicate
+  runs its query instead of the sql, so it copies the layer that the query
+  reads first.
+  """
+  if 'query' in action:
+    return dict(action, preamble=fixpoint['copy_sql'])
+  return dict(action, sql=fixpoint['copy_sql'])
+
+
+def FirstValue(result):
+  """First value of a result, a DataFrame or a header with rows."""
+  if hasattr(result, 'iloc'):
+    return result.iloc[0, 0]
+  _, rows = result
+  return rows[0][0]
 
 
 class ConcertinaDryRunEngine(object):
   def Run(self, action):
     print(action)
+    return False
 
 
 class Concertina(object):
@@ -74,7 +143,19 @@ class Concertina(object):
         assert False, "Could not schedule: %s" % self.config
     return result
       
-  def __init__(self, config, engine, display_mode='colab'):
+  def __init__(self, config, engine, display_mode='colab',
+               max_concurrency=None):
+    """Initializes the workflow.
+
+    Args:
+      config: List of actions.
+      engine: Engine running actions.
+      display_mode: How to display the workflow.
+      max_concurrency: None to run actions one at a time. Otherwise a number
+        of actions that may run at the same time, or a dictionary from
+        engine of the action to such number. Engine must be thread safe to
+        run actions concurrently.
+    """
     self.config = config
     self.action = {a["name"]: a for a in self.config}
     self.actions_to_run = self.SortActions()
@@ -83,6 +164,11 @@ class Concertina(object):
     self.all_actions = {a["name"] for a in self.config}
     self.complete_actions = set()
     self.running_actions = set()
+    self.failed_actions = set()
+    self.cancelled_actions = set()
+    self.skipped_actions = set()
+    CheckMaxConcurrency(max_concurrency)
+    self.max_concurrency = max_concurrency
     assert display_mode in ('colab', 'terminal', 'colab-text'), (
       'Unrecognized display mode: %s' % display_mode)
     self.display_mode = display_mode
@@ -95,18 +181,117 @@ class Concertina(object):
     del self.actions_to_run[0]
     self.running_actions |= {one_action}
     self.UpdateDisplay()
-    self.engine.Run(self.action[one_action].get('action', {}))
+    converged = self.engine.Run(self.action[one_action].get('action', {}))
     self.running_actions -= {one_action}
     self.complete_actions |= {one_action}
+    if converged:
+      self.SkipToFixpoint(one_action)
     self.UpdateDisplay()
 
+  def SkipToFixpoint(self, a):
+    """Skips layers of recursion after converged layer a.
+
+    Skipped layers count as complete and the last layer copies layer a
+    instead of being computed.
+    """
+    fixpoint = self.action[a]['action']['fixpoint']
+    skipped = set(fixpoint['skip']) & set(self.actions_to_run)
+    self.actions_to_run = [b for b in self.actions_to_run
+                           if b not in skipped]
+    self.complete_actions |= skipped
+    self.skipped_actions |= skipped
+    last = self.action[fixpoint['last']]
+    last['action'] = CopyingConvergedLayer(last['action'], fixpoint)
+
   def Run(self):
-    while self.actions_to_run:
-      self.RunOneAction()
+    if self.max_concurrency is None:
+      while self.actions_to_run:
+        self.RunOneAction()
+    else:
+      self.RunConcurrently()
+
+  def ActionEngine(self, a):
+    return self.action[a].get('action', {}).get('engine')
+
+  def ConcurrencyOf(self, engine):
+    """How many actions of the engine may run at the same time."""
+    if isinstance(self.max_concurrency, dict):
+      return self.max_concurrency.get(engine, 1)
+    return self.max_concurrency
+
+  def Dependents(self, a):
+    """Actions that transitively require the action."""
+    result = set()
+    queue = collections.deque([a])
+    while queue:
+      b = queue.popleft()
+      for c in self.all_actions:
+        if b in self.action[c]['requires'] and c not in result:
+          result.add(c)
+          queue.append(c)
+    return result
+
+  def ReadyActions(self, running_per_engine):
+    """Actions with complete requirements that engines have capacity for."""
+    result = []
+    for a in self.actions_to_run:
+      engine = self.ActionEngine(a)
+      if (set(self.action[a]['requires']) <= self.complete_actions and
+          running_per_engine[engine] < self.ConcurrencyOf(engine)):
+        running_per_engine[engine] += 1
+        result.append(a)
+    return result
+
+  def RunConcurrently(self):
+    """Runs each action on a thread pool once its requirements are complete.
+
+    When an action fails, actions depending on it are cancelled, the rest of
+    the workflow completes and the first error is raised.
+    """
+    engines = {self.ActionEngine(a) for a in self.all_actions}
+    num_workers = max(1, sum(self.ConcurrencyOf(e) for e in engines))
+    running = {}
+    running_per_engine = collections.Counter()
+    error = None
+    self.UpdateDisplay()
+    with concurrent.futures.ThreadPoolExecutor(num_workers) as pool:
+      while True:
+        for a in self.ReadyActions(running_per_engine):
+          self.actions_to_run.remove(a)
+          self.running_actions |= {a}
+          future = pool.submit(self.engine.Run,
+                               self.action[a].get('action', {}))
+          running[future] = a
+        self.UpdateDisplay()
+        if not running:
+          break
+        done, _ = concurrent.futures.wait(
+            running, return_when=concurrent.futures.FIRST_COMPLETED)
+        for future in done:
+          a = running.pop(future)
+          running_per_engine[self.ActionEngine(a)] -= 1
+          self.running_actions -= {a}
+          if future.exception() is None:
+            self.complete_actions |= {a}
+            if future.result():
+              self.SkipToFixpoint(a)
+            continue
+          self.failed_actions |= {a}
+          error = error or future.exception()
+          cancelled = self.Dependents(a) & set(self.actions_to_run)
+          self.cancelled_actions |= cancelled
+          self.actions_to_run = [b for b in self.actions_to_run
+                                 if b not in cancelled]
+    if error:
+      raise error
 
   def ActionColor(self, a):
     if self.action[a].get('type') == 'data':
       return 'lightskyblue1'
+    if a in self.failed_actions:
+      return 'tomato'
+    if a in self.skipped_actions:
+      return 'honeydew'
     if a in self.complete_actions:
       return 'darkolivegreen1'
     if a in self.running_actions:
@@ -223,10 +408,11 @@ def RenamePredicate(table_to_export_map, dependency_edges,
   return new_table_to_export_map, new_dependency_edges, new_data_dependency_edges
 
 
-def ExecuteLogicaProgram(logica_executions, sql_runner, sql_engine,
-                         display_mode='colab'):
+def LogicaWorkflow(logica_executions, sql_engine):
+  """Concertina config, final predicates and preambles of the executions."""
   def ConcertinaConfig(table_to_export_map, dependency_edges,
-                       data_dependency_edges, final_predicates):
+                       data_dependency_edges, final_predicates,
+                       fixpoint_layers, final_queries):
     depends_on = {}
     for source, target in dependency_edges | data_dependency_edges:
       depends_on[target] = depends_on.get(target, set()) | {source}
@@ -257,11 +443,21 @@ def ExecuteLogicaProgram(logica_executions, sql_runner, sql_engine,
               'sql': sql
           }
       })
+      if t in fixpoint_layers:
+        result[-1]['action']['fixpoint'] = fixpoint_layers[t]
+      if t in final_queries:
+        result[-1]['action']['preamble'], result[-1]['action']['query'] = (
+            final_queries[t])
     return result
 
   table_to_export_map = {}
   dependency_edges = set()
   data_dependency_edges = set()
+  fixpoint_layers = {}
+  # Maps final predicate to its preamble and query, which are run
+  # separately. BigQuery temporary functions exist only within the script
+  # defining them, so there they stay in the query.
+  final_queries = {}
   final_predicates = {e.main_predicate for e in logica_executions}
   
   for e in logica_executions:
@@ -277,6 +473,15 @@ def ExecuteLogicaProgram(logica_executions, sql_runner, sql_engine,
 
     for k, v in p_table_to_export_map.items():
       table_to_export_map[k] = e.PredicateSpecificPreamble(e.main_predicate) + v
+    preamble = e.PredicateSpecificPreamble(e.main_predicate)
+    query = p_table_to_export_map[e.main_predicate]
+    final_queries[e.main_predicate] = (
+        ('', preamble + query) if sql_engine == 'bigquery' else
+        (preamble, query))
+    for k, v in e.fixpoint_layers.items():
+      fixpoint_layers[k] = dict(
+          v, copy_sql=(e.PredicateSpecificPreamble(e.main_predicate) +
+                       v['copy_sql']))
 
     for a, b in p_dependency_edges:
       dependency_edges.add((a, b))
@@ -286,22 +491,43 @@ def ExecuteLogicaProgram(logica_executions, sql_runner, sql_engine,
   config = ConcertinaConfig(table_to_export_map,
                             dependency_edges,
                             data_dependency_edges,
-                            final_predicates)
+                            final_predicates,
+                            fixpoint_layers,
+                            final_queries)
  
-  engine = ConcertinaQueryEngine(
-      final_predicates=final_predicates, sql_runner=sql_runner,
-      print_running_predicate=(display_mode != 'terminal'))
-
   preambles = set(e.preamble for e in logica_executions)
   # Due to change of types from predicate to predicate preables are not
   # consistent. However we expect preambles to be idempotent.
   # So we simply run all of them.
   # assert len(preambles) == 1, 'Inconsistent preambles: %s' % preambles
   # [preamble] = list(preambles)
+  return config, final_predicates, preambles
+
+
+def ExecuteLogicaProgram(logica_executions, sql_runner, sql_engine,
+                         display_mode='colab', max_concurrency=None,
+                         stream_final=False):
+  """Runs the workflow of the executions, returning final predicates.
+
+  With max_concurrency independent tables are built at the same time, see
+  Concertina. sql_runner must be thread safe then.
+  With stream_final results of final predicates are what sql_runner returns
+  for them when called with stream=True, e.g. iterators over rows, so that
+  large results are read as they are consumed.
+  """
+  config, final_predicates, preambles = LogicaWorkflow(logica_executions,
+                                                       sql_engine)
+  engine = ConcertinaQueryEngine(
+      final_predicates=final_predicates, sql_runner=sql_runner,
+      print_running_predicate=(display_mode != 'terminal'),
+      concurrent=(max_concurrency is not None),
+      stream_final=stream_final)
+
   for preamble in preambles:
     if preamble:
       sql_runner(preamble, sql_engine, is_final=False)
 
-  concertina = Concertina(config, engine, display_mode=display_mode)
+  concertina = Concertina(config, engine, display_mode=display_mode,
+                          max_concurrency=max_concurrency)
   concertina.Run()
   return engine.final_result
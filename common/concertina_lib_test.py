@@ -0,0 +1,133 @@
+#!/usr/bin/python
+#
+# Copyright 2023 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Unitests for concertina_lib.py."""
+
+import unittest
+
+from common import concertina_lib
+from common import sqlite3_logica
+from compiler import universe
+from parser_py import parse
+
+
+UDF_PROGRAM = '''
+@Engine("%s");
+@CompileAsUdf(Double);
+Double(x) = 2 * x;
+Test(y: Double(x)) :- x in [1, 2];
+'''
+
+
+FIXPOINT_PROGRAM = '''
+@Engine("sqlite");
+Edge(a: x, b: x + 1) :- x in Range(5);
+@Recursive(Reach, 20, stop_on_fixpoint: true);
+@OrderBy(Reach, "col0");
+Reach(x) distinct :- x == 0;
+Reach(y) distinct :- Reach(x), Edge(a: x, b: y);
+Total() += x :- Reach(x);
+'''
+
+
+class SqliteRunner(object):
+  """Runner of SQLite queries, recording the queries it runs."""
+
+  def __init__(self):
+    self.connection = sqlite3_logica.SqliteConnect()
+    self.queries = []
+
+  def __call__(self, sql, engine, is_final):
+    self.queries.append(sql)
+    if is_final:
+      cursor = self.connection.execute(sql)
+      return [d[0] for d in cursor.description], cursor.fetchall()
+    sqlite3_logica.ExecuteScript(self.connection, sql)
+
+
+class RecordingRunner(object):
+  """Runner recording the SQL it is given and whether it is final."""
+
+  def __init__(self):
+    self.calls = []
+
+  def __call__(self, sql, engine, is_final, stream=False):
+    self.calls.append((sql, is_final))
+    return 'result'
+
+
+class CheckMaxConcurrencyTest(unittest.TestCase):
+  def test_ValidLimits(self):
+    for limit in [None, 1, 4, {'sqlite': 1, 'psql': 8}]:
+      concertina_lib.CheckMaxConcurrency(limit)
+
+  def test_InvalidLimits(self):
+    for limit in [0, -1, 1.5, {'psql': 0}]:
+      with self.assertRaises(ValueError):
+        concertina_lib.CheckMaxConcurrency(limit)
+    config = [{'name': 'a', 'type': 'data', 'requires': [], 'action': {}}]
+    with self.assertRaises(ValueError):
+      concertina_lib.Concertina(config, concertina_lib.ConcertinaDryRunEngine(),
+                                display_mode='terminal', max_concurrency=0)
+
+
+
+class ExecuteLogicaProgramTest(unittest.TestCase):
+  def Run(self, engine):
+    program = universe.LogicaProgram(
+        parse.ParseFile(UDF_PROGRAM % engine)['rule'])
+    program.FormattedPredicateSql('Test')
+    runner = RecordingRunner()
+    result = concertina_lib.ExecuteLogicaProgram(
+        [program.execution], runner, engine, display_mode='terminal')
+    self.assertEqual(result, {'Test': 'result'})
+    return [(sql.startswith('CREATE TEMP FUNCTION'), is_final)
+            for sql, is_final in runner.calls if 'Double' in sql]
+
+  def test_FinalQueryRunsWithoutPreamble(self):
+    # E.g. PostgreSQL declares a cursor for the query alone.
+    self.assertEqual(self.Run('psql'), [(True, False), (False, True)])
+
+  def test_BigQueryFinalQueryKeepsTemporaryFunctions(self):
+    self.assertEqual(self.Run('bigquery'), [(True, True)])
+
+
+class StopOnFixpointTest(unittest.TestCase):
+  def Run(self, predicate, max_concurrency=None):
+    program = universe.LogicaProgram(
+        parse.ParseFile(FIXPOINT_PROGRAM)['rule'])
+    program.FormattedPredicateSql(predicate)
+    runner = SqliteRunner()
+    result = concertina_lib.ExecuteLogicaProgram(
+        [program.execution], runner, 'sqlite', display_mode='terminal',
+        max_concurrency=max_concurrency)
+    # Layers after the fixpoint are not computed.
+    self.assertFalse(any('Reach_r10' in q for q in runner.queries))
+    return result[predicate]
+
+  def test_Dependent(self):
+    for max_concurrency in [None, 2]:
+      self.assertEqual(self.Run('Total', max_concurrency),
+                       (['logica_value'], [(15,)]))
+
+  def test_RecursivePredicateIsFinal(self):
+    for max_concurrency in [None, 2]:
+      self.assertEqual(self.Run('Reach', max_concurrency),
+                       (['col0'], [(x,) for x in range(6)]))
+
+
+if __name__ == '__main__':
+  unittest.main()
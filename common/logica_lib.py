@@ -21,12 +21,16 @@ import subprocess
 import sys
 
 if '.' not in __package__:
+  from common import program_cache
+  from common import sqlite3_ingest
   from common import sqlite3_logica
   from compiler import functors
   from compiler import rule_translate
   from compiler import universe
   from parser_py import parse
 else:
+  from ..common import program_cache
+  from ..common import sqlite3_ingest
   from ..common import sqlite3_logica
   from ..compiler import functors
   from ..compiler import rule_translate
@@ -39,9 +43,14 @@ def ParseOrExit(filename, import_root=None):
   with open(filename) as f:
     program_text = f.read()
 
+  cache = program_cache.GetCache()
   try:
-    parsed_rules = parse.ParseFile(program_text,
-                                   import_root=import_root)['rule']
+    if cache:
+      parsed_rules = cache.ParseFile(program_text,
+                                     import_root=import_root)['rule']
+    else:
+      parsed_rules = parse.ParseFile(program_text,
+                                     import_root=import_root)['rule']
   except parse.ParsingException as parsing_exception:
     parsing_exception.ShowMessage()
     sys.exit(1)
@@ -65,8 +74,11 @@ def GetProgramOrExit(filename, user_flags=None, import_root=None):
 
 def RunQuery(sql,
              settings=None,
-             output_format='pretty', engine='bigquery'):
-  """Run a SQL query on BigQuery."""
+             output_format='pretty', engine='bigquery', database=None):
+  """Run a SQL query on BigQuery.
+
+  For SQLite the query runs on a pooled connection to database, if given.
+  """
   settings = settings or {}
   if engine == 'bigquery':
     p = subprocess.Popen(['bq', 'query',
@@ -75,7 +87,7 @@ def RunQuery(sql,
                          stdin=subprocess.PIPE, stdout=subprocess.PIPE)
   elif engine == 'sqlite':
     # TODO: Make multi-statement scripts work.
-    return sqlite3_logica.RunSQL(sql)
+    return sqlite3_logica.RunSQL(sql, database=database)
   elif engine == 'psql':
     p = subprocess.Popen(['psql', '--quiet'],
                          stdin=subprocess.PIPE, stdout=subprocess.PIPE)
@@ -104,7 +116,7 @@ def RunQuery(sql,
 
 def RunPredicate(filename, predicate,
                  output_format='pretty', user_flags=None,
-                 import_root=None):
+                 import_root=None, database=None):
   """Run a predicate on BigQuery."""
   p = GetProgramOrExit(filename, user_flags=user_flags,
                        import_root=import_root)
@@ -115,15 +127,31 @@ def RunPredicate(filename, predicate,
     settings = p.annotations.annotations['@Engine'][engine]
   else:
     settings = {}
+  if engine == 'sqlite':
+    # Grounded tables are created by separate statements.
+    statements_to_execute = (
+        [p.execution.preamble] + p.execution.defines_and_exports +
+        [p.execution.main_predicate_sql])
+    return sqlite3_logica.RunSqlScript(statements_to_execute,
+                                       'artistictable', database=database)
   return RunQuery(sql, settings,
                   output_format, engine=engine)
 
 
-def RunQueryPandas(sql, engine, connection=None):
-  """Running SQL query on the engine, returning Pandas dataframe."""
+def RunQueryPandas(sql, engine, connection=None, database=None):
+  """Running SQL query on the engine, returning Pandas dataframe.
+
+  Without a connection SQLite queries run on a fresh connection, or on a
+  pooled connection to the database if it is given, so that grounded and
+  attached tables persist between calls with the same database.
+  """
   import pandas
   if connection is None and engine == 'sqlite':
-    connection = sqlite3_logica.SqliteConnect()
+    if database is None:
+      connection = sqlite3_logica.SqliteConnect()
+    else:
+      with sqlite3_logica.connection_pool.Connection(database) as connection:
+        return RunQueryPandas(sql, engine, connection=connection)
   if connection is None:
     assert False, 'Connection is required for engines other than SQLite.'
   if engine == 'bigquery':
@@ -133,7 +161,8 @@ def RunQueryPandas(sql, engine, connection=None):
   elif engine == 'sqlite':
     statements = parse.SplitRaw(sql, ';')[:-1]
     if len(statements) > 1:
-      connection.executescript(';\n'.join(statements[:-1]))
+      sqlite3_logica.ExecuteScript(connection,
+                                   ';\n'.join(statements[:-1]))
     return pandas.read_sql(statements[-1], connection)
   else:
     raise Exception('Logica only supports BigQuery, PostgreSQL and SQLite '
@@ -141,9 +170,28 @@ def RunQueryPandas(sql, engine, connection=None):
 
 
 def RunPredicateToPandas(filename, predicate,
-                         user_flags=None, import_root=None, connection=None):
+                         user_flags=None, import_root=None, connection=None,
+                         database=None):
   p = GetProgramOrExit(filename, user_flags=user_flags,
                        import_root=import_root)
   sql = p.FormattedPredicateSql(predicate)
   engine = p.annotations.Engine()
-  return RunQueryPandas(sql, engine, connection=connection)
+  return RunQueryPandas(sql, engine, connection=connection,
+                        database=database)
+
+
+def IngestToPredicate(filename, predicate, path, user_flags=None,
+                      import_root=None, database=None, **kwargs):
+  """Loads CSV, JSONL or Parquet file into the table of the predicate.
+
+  If database is given the table is loaded on a pooled connection to it,
+  where RunPredicate and RunPredicateToPandas called with the same database
+  find it. Returns number of rows loaded.
+  """
+  p = GetProgramOrExit(filename, user_flags=user_flags,
+                       import_root=import_root)
+  if database is None:
+    return sqlite3_ingest.IngestPredicate(p, predicate, path, **kwargs)
+  with sqlite3_logica.connection_pool.Connection(database) as connection:
+    return sqlite3_ingest.IngestPredicate(p, predicate, path,
+                                          connection=connection, **kwargs)
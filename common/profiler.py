@@ -0,0 +1,150 @@
+#!/usr/bin/python
+#
+# Copyright 2023 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Profiling of Logica compilation phases.
+
+Phases of compilation are wrapped into Phase context. When a profile is
+active, each phase records its wall time and the change of the number of
+live memory blocks, overall and per predicate. The latter counts blocks the
+phase kept, not allocations it made, so temporaries freed within the phase
+are not seen. Profile tracing allocations with tracemalloc also records the
+peak of memory the phase allocated on top of what was live when it started,
+which includes the temporaries, at the cost of slower compilation.
+Measurements of a phase include the phases nested in it, e.g. compiling a
+grounded table within AsSql.
+
+Example:
+  with profiler.Profiling() as profile:
+    program = universe.LogicaProgram(rules)
+    program.FormattedPredicateSql('Test')
+  print(profile.AsJson())
+"""
+
+import collections
+import contextlib
+import json
+import sys
+import time
+import tracemalloc
+
+# Profile collecting the measurements, None when profiling is off.
+active_profile = None
+
+
+class Profile(object):
+  """Accumulated measurements of compilation phases."""
+
+  def __init__(self, trace_allocations=False):
+    self.start = time.perf_counter()
+    self.trace_allocations = trace_allocations
+    # Maps phase and predicate (None for whole program) to measurements.
+    self.measurements = collections.OrderedDict()
+    # Peaks of traced memory of the running phases, innermost last.
+    self.peaks = []
+
+  def Record(self, phase, predicate, seconds, net_blocks, peak_bytes=None):
+    key = (phase, predicate)
+    if key not in self.measurements:
+      self.measurements[key] = {'calls': 0, 'seconds': 0.0,
+                                'net_blocks': 0}
+      if self.trace_allocations:
+        self.measurements[key]['max_peak_bytes'] = 0
+    m = self.measurements[key]
+    m['calls'] += 1
+    m['seconds'] += seconds
+    m['net_blocks'] += net_blocks
+    if peak_bytes is not None:
+      m['max_peak_bytes'] = max(m['max_peak_bytes'], peak_bytes)
+
+  def StartPeak(self):
+    """Starts measuring peak of traced memory, returns current memory."""
+    current, peak = tracemalloc.get_traced_memory()
+    if self.peaks:
+      self.peaks[-1] = max(self.peaks[-1], peak)
+    tracemalloc.reset_peak()
+    self.peaks.append(current)
+    return current
+
+  def StopPeak(self):
+    """Returns peak of traced memory since the matching StartPeak."""
+    peak = max(self.peaks.pop(), tracemalloc.get_traced_memory()[1])
+    if self.peaks:
+      self.peaks[-1] = max(self.peaks[-1], peak)
+    return peak
+
+  def AsDict(self):
+    """Report with totals per phase and a breakdown per predicate."""
+    phases = collections.OrderedDict()
+    predicates = collections.OrderedDict()
+    for (phase, predicate), m in self.measurements.items():
+      total = phases.setdefault(phase, {'calls': 0, 'seconds': 0.0,
+                                        'net_blocks': 0})
+      for k in ['calls', 'seconds', 'net_blocks']:
+        total[k] += m[k]
+      if 'max_peak_bytes' in m:
+        total['max_peak_bytes'] = max(total.get('max_peak_bytes', 0),
+                                      m['max_peak_bytes'])
+      if predicate is not None:
+        predicates.setdefault(predicate, collections.OrderedDict())[
+            phase] = dict(m)
+    return {'total_seconds': time.perf_counter() - self.start,
+            'phases': phases,
+            'predicates': predicates}
+
+  def AsJson(self):
+    return json.dumps(self.AsDict(), indent=2)
+
+
+@contextlib.contextmanager
+def Phase(name, predicate=None):
+  """Measures the enclosed code as the phase, if profiling is on."""
+  profile = active_profile
+  if profile is None:
+    yield
+    return
+  start = time.perf_counter()
+  blocks = sys.getallocatedblocks()
+  if profile.trace_allocations:
+    start_bytes = profile.StartPeak()
+  try:
+    yield
+  finally:
+    peak_bytes = None
+    if profile.trace_allocations:
+      peak_bytes = profile.StopPeak() - start_bytes
+    profile.Record(name, predicate, time.perf_counter() - start,
+                   sys.getallocatedblocks() - blocks, peak_bytes)
+
+
+@contextlib.contextmanager
+def Profiling(trace_allocations=False):
+  """Makes a new profile active within the context.
+
+  With trace_allocations memory is traced by tracemalloc within the context,
+  to record peak memory of the phases.
+  """
+  global active_profile
+  previous_profile = active_profile
+  active_profile = Profile(trace_allocations)
+  started_tracing = trace_allocations and not tracemalloc.is_tracing()
+  if started_tracing:
+    tracemalloc.start()
+  try:
+    yield active_profile
+  finally:
+    if started_tracing:
+      tracemalloc.stop()
+    active_profile = previous_profile
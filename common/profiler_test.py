@@ -0,0 +1,57 @@
+#!/usr/bin/python
+#
+# Copyright 2023 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Unitests for profiler.py."""
+
+import json
+import unittest
+
+from common import profiler
+from compiler import universe
+from parser_py import parse
+
+
+class ProfilerTest(unittest.TestCase):
+  def test_PhasesAreRecordedPerPredicate(self):
+    with profiler.Profiling() as profile:
+      rules = parse.ParseFile(
+          '@NoInject(Q); Q(x) :- x in [1, 2]; P(y) :- Q(y);')['rule']
+      universe.LogicaProgram(rules).FormattedPredicateSql('P')
+    report = json.loads(profile.AsJson())
+    self.assertIn('MultiBodyAggregation', report['phases'])
+    self.assertEqual(report['phases']['AsSql']['calls'], 2)
+    self.assertEqual(report['predicates']['Q']['AsSql']['calls'], 1)
+    self.assertIsNone(profiler.active_profile)
+
+  def test_TracedAllocationsIncludeFreedMemory(self):
+    with profiler.Profiling(trace_allocations=True) as profile:
+      with profiler.Phase('Outer'):
+        with profiler.Phase('Temporary'):
+          temporary = bytearray(10 ** 6)
+          del temporary
+    phases = profile.AsDict()['phases']
+    for phase in ['Outer', 'Temporary']:
+      self.assertGreater(phases[phase]['max_peak_bytes'], 10 ** 6)
+      self.assertLess(phases[phase]['net_blocks'], 100)
+
+  def test_PhaseIsNoopWithoutProfile(self):
+    with profiler.Phase('Parse'):
+      pass
+    self.assertIsNone(profiler.active_profile)
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,233 @@
+#!/usr/bin/python
+#
+# Copyright 2023 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Persistent cache of parsed and compiled Logica programs.
+
+Cache is enabled by setting LOGICA_CACHE_DIR environment variable to a
+directory. Parsed rules are keyed by the program text and the import root and
+are valid while the transitively imported files are unchanged. Compiled SQL
+is keyed by the parsed program, the user flags and the predicate. The engine
+is defined by the program, so it is covered by the program key.
+
+Least recently used entries are evicted when the cache grows over
+LOGICA_CACHE_SIZE_MB megabytes, 256 by default.
+
+Long-lived processes, such as the server of tools/logica_server.py, set
+process_cache to keep entries in memory instead.
+"""
+
+import collections
+import glob
+import hashlib
+import json
+import os
+import pickle
+import tempfile
+
+if '.' not in __package__:
+  from parser_py import parse
+else:
+  from ..parser_py import parse
+
+
+# Increment when the format of cached entries changes.
+CACHE_VERSION = 2
+
+DEFAULT_SIZE_MB = 256
+
+_compiler_fingerprint = None
+
+# Cache returned by GetCache regardless of the environment, if set.
+process_cache = None
+
+
+def CompilerFiles(root):
+  """Files of the parser and compiler code."""
+  files = []
+  # Modules of common/ that the compiler uses to build programs are listed
+  # on their own.
+  for pattern in ['parser_py/*.py', 'compiler/*.py',
+                  'compiler/dialect_libraries/*.py',
+                  'type_inference/research/*.py',
+                  'common/rule_copy.py', 'common/rule_index.py',
+                  'common/script_markers.py']:
+    files.extend(sorted(glob.glob(os.path.join(root, pattern))))
+  return files
+
+
+def CompilerFingerprint():
+  """Fingerprint of the parser and compiler code, invalidating the cache."""
+  global _compiler_fingerprint
+  if _compiler_fingerprint is None:
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    files = CompilerFiles(root)
+    stats = [(os.path.relpath(f, root), os.path.getsize(f),
+              os.path.getmtime(f)) for f in files]
+    _compiler_fingerprint = Hash([CACHE_VERSION, stats])
+  return _compiler_fingerprint
+
+
+def Hash(value):
+  return hashlib.sha256(
+      json.dumps(value, sort_keys=True).encode()).hexdigest()
+
+
+def FileHash(file_path):
+  with open(file_path, 'rb') as f:
+    return hashlib.sha256(f.read()).hexdigest()
+
+
+class ProgramCache(object):
+  """Directory of pickled cache entries with size based LRU eviction."""
+
+  def __init__(self, directory, max_size_bytes):
+    self.directory = directory
+    self.max_size_bytes = max_size_bytes
+    os.makedirs(directory, exist_ok=True)
+
+  def Key(self, *parts):
+    return Hash([CompilerFingerprint()] + list(parts))
+
+  def EntryPath(self, key):
+    return os.path.join(self.directory, key + '.pickle')
+
+  def Get(self, key):
+    """Returns the cached value or None."""
+    path = self.EntryPath(key)
+    try:
+      with open(path, 'rb') as f:
+        value = pickle.load(f)
+      # Modification time tracks recency of use for eviction.
+      os.utime(path)
+    except (OSError, EOFError, pickle.UnpicklingError):
+      return None
+    return value
+
+  def Put(self, key, value):
+    """Stores the value, writing atomically, and evicts old entries."""
+    fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+    try:
+      with os.fdopen(fd, 'wb') as w:
+        pickle.dump(value, w, protocol=pickle.HIGHEST_PROTOCOL)
+      os.replace(tmp_path, self.EntryPath(key))
+    except BaseException:
+      if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+      raise
+    self.Evict()
+
+  def Evict(self):
+    """Removes least recently used entries while the cache is too big."""
+    entries = []
+    for path in glob.glob(os.path.join(self.directory, '*.pickle')):
+      try:
+        stat = os.stat(path)
+      except OSError:
+        continue
+      entries.append((stat.st_mtime, stat.st_size, path))
+    total_size = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+      if total_size <= self.max_size_bytes:
+        break
+      try:
+        os.remove(path)
+      except OSError:
+        pass
+      total_size -= size
+
+  def ParseFile(self, program_text, import_root=None):
+    """Parses the program, reusing rules parsed earlier.
+
+    Returned dictionary is same as of parse.ParseFile, with 'fingerprint'
+    identifying the program together with its imports.
+    """
+    key = self.Key('parse', program_text, import_root)
+    entry = self.Get(key)
+    if entry is not None and self.ImportsUnchanged(entry['imports'],
+                                                   import_root):
+      return entry['parsed']
+    parsed_imports = {}
+    parsed = parse.ParseFile(program_text, import_root=import_root,
+                             parsed_imports=parsed_imports)
+    imports = {}
+    for file_import_str in sorted(parsed_imports):
+      file_path = parse.ImportedFilePath(file_import_str, import_root or '')
+      imports[file_import_str] = (file_path, FileHash(file_path))
+    parsed['fingerprint'] = Hash([key, sorted(imports.items())])
+    self.Put(key, {'imports': imports, 'parsed': parsed})
+    return parsed
+
+  def ImportsUnchanged(self, imports, import_root):
+    try:
+      for file_import_str, (file_path, file_hash) in imports.items():
+        if (parse.ImportedFilePath(file_import_str,
+                                   import_root or '') != file_path or
+            FileHash(file_path) != file_hash):
+          return False
+    except (parse.ParsingException, OSError):
+      return False
+    return True
+
+  def CompiledPredicate(self, parsed, user_flags, predicate, compile_fn):
+    """Returns compiled predicate, calling compile_fn on a cache miss."""
+    key = self.Key('sql', parsed['fingerprint'], user_flags, predicate)
+    compiled = self.Get(key)
+    if compiled is None:
+      compiled = compile_fn()
+      self.Put(key, compiled)
+    return compiled
+
+
+class MemoryProgramCache(ProgramCache):
+  """Cache keeping pickled entries in memory with size based LRU eviction.
+
+  Entries are stored pickled, so that callers get their own copy of the
+  cached value as with the directory cache.
+  """
+
+  def __init__(self, max_size_bytes):
+    self.max_size_bytes = max_size_bytes
+    self.entries = collections.OrderedDict()
+    self.size = 0
+
+  def Get(self, key):
+    if key not in self.entries:
+      return None
+    self.entries.move_to_end(key)
+    return pickle.loads(self.entries[key])
+
+  def Put(self, key, value):
+    if key in self.entries:
+      self.size -= len(self.entries.pop(key))
+    self.entries[key] = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+    self.size += len(self.entries[key])
+    self.Evict()
+
+  def Evict(self):
+    while self.size > self.max_size_bytes and len(self.entries) > 1:
+      _, value = self.entries.popitem(last=False)
+      self.size -= len(value)
+
+
+def GetCache():
+  """Returns cache configured by the environment, or None if disabled."""
+  if process_cache is not None:
+    return process_cache
+  directory = os.environ.get('LOGICA_CACHE_DIR')
+  if not directory:
+    return None
+  size_mb = float(os.environ.get('LOGICA_CACHE_SIZE_MB', DEFAULT_SIZE_MB))
+  return ProgramCache(directory, int(size_mb * 1024 * 1024))
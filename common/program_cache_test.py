@@ -0,0 +1,103 @@
+#!/usr/bin/python
+#
+# Copyright 2023 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Unitests for program_cache.py."""
+
+import os
+import tempfile
+import unittest
+
+from common import program_cache
+
+
+class ProgramCacheTest(unittest.TestCase):
+  def setUp(self):
+    self.directory = tempfile.TemporaryDirectory()
+    self.root = self.directory.name
+    self.cache = program_cache.ProgramCache(
+        os.path.join(self.root, 'cache'), 10 ** 6)
+
+  def tearDown(self):
+    self.directory.cleanup()
+
+  def WriteImport(self, text):
+    with open(os.path.join(self.root, 'lib.l'), 'w') as w:
+      w.write(text)
+
+  def test_ParseIsReusedUntilImportChanges(self):
+    self.WriteImport('Q(1);')
+    program = 'import lib.Q; P(x) :- Q(x);'
+    parsed = self.cache.ParseFile(program, import_root=self.root)
+    self.assertEqual(parsed, self.cache.ParseFile(program,
+                                                  import_root=self.root))
+
+    self.WriteImport('Q(2);')
+    changed = self.cache.ParseFile(program, import_root=self.root)
+    self.assertNotEqual(parsed['fingerprint'], changed['fingerprint'])
+    self.assertNotEqual(parsed['rule'], changed['rule'])
+
+  def test_CompiledPredicateIsReused(self):
+    parsed = self.cache.ParseFile('P(1);')
+    calls = []
+    def Compile():
+      calls.append(1)
+      return {'formatted_sql': 'SELECT 1;'}
+    for _ in range(2):
+      compiled = self.cache.CompiledPredicate(parsed, {}, 'P', Compile)
+    self.assertEqual(compiled, {'formatted_sql': 'SELECT 1;'})
+    self.assertEqual(len(calls), 1)
+    self.cache.CompiledPredicate(parsed, {'flag': 'x'}, 'P', Compile)
+    self.assertEqual(len(calls), 2)
+
+  def test_EvictionRemovesLeastRecentlyUsed(self):
+    cache = program_cache.ProgramCache(os.path.join(self.root, 'small'), 250)
+    cache.Put('a', 'x' * 100)
+    os.utime(cache.EntryPath('a'), (1, 1))
+    cache.Put('b', 'y' * 100)
+    cache.Put('c', 'z' * 100)
+    self.assertIsNone(cache.Get('a'))
+    self.assertEqual(cache.Get('c'), 'z' * 100)
+
+
+class MemoryProgramCacheTest(unittest.TestCase):
+  def test_EntriesAreCopiedAndEvicted(self):
+    cache = program_cache.MemoryProgramCache(200)
+    value = {'rule': [1]}
+    cache.Put('a', value)
+    value['rule'].append(2)
+    self.assertEqual(cache.Get('a'), {'rule': [1]})
+    cache.Get('a')['rule'].append(3)
+    self.assertEqual(cache.Get('a'), {'rule': [1]})
+    cache.Put('b', 'y' * 100)
+    cache.Put('c', 'z' * 100)
+    self.assertIsNone(cache.Get('a'))
+    self.assertIsNone(cache.Get('b'))
+    self.assertEqual(cache.Get('c'), 'z' * 100)
+
+
+class CompilerFilesTest(unittest.TestCase):
+  def test_CommonModulesOfCompiler(self):
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    files = {os.path.relpath(f, root)
+             for f in program_cache.CompilerFiles(root)}
+    self.assertIn(os.path.join('compiler', 'universe.py'), files)
+    self.assertIn(os.path.join('common', 'rule_copy.py'), files)
+    self.assertIn(os.path.join('common', 'rule_index.py'), files)
+    self.assertIn(os.path.join('common', 'script_markers.py'), files)
+
+
+if __name__ == '__main__':
+  unittest.main()
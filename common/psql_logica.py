@@ -18,6 +18,7 @@ import getpass
 import json
 import os
 import re
+import uuid
 from decimal import Decimal
 
 if '.' not in __package__:
@@ -26,17 +27,60 @@ else:
   from ..type_inference.research import infer
 
 
+# Number of rows fetched from the server at once, itersize of server-side
+# cursors.
+FETCH_BATCH_SIZE = 10000
+
+# OIDs of types that psycopg2 returns as ready Python values, e.g. int4,
+# text, float8, timestamp, and arrays of them.
+PLAIN_TYPE_OIDS = {
+    16, 17, 18, 19, 20, 21, 23, 25, 26, 114, 700, 701, 1042, 1043, 1082,
+    1083, 1114, 1184, 1186, 2950, 3802,
+    1000, 1001, 1002, 1003, 1005, 1007, 1009, 1014, 1015, 1016, 1021, 1022,
+    1028, 1115, 1182, 1183, 1185, 199, 3807, 2951}
+NUMERIC_OID = 1700
+NUMERIC_ARRAY_OID = 1231
+
+# Pairs of connection DSN and composite type registered for it. Types are
+# created once per database, so they are registered once.
+registered_composite_types = set()
+
+
 def PostgresExecute(sql, connection):
-  import psycopg2
   import psycopg2.extras
   cursor = connection.cursor()
+  ExecuteOnCursor(sql, cursor, connection)
+  # Make connection aware of the used types.
+  types = re.findall(r'-- Logica type: (\w*)', sql)
+  for t in types:
+    if (t != 'logicarecord893574736' and  # Empty record.
+        (connection.dsn, t) not in registered_composite_types):
+      psycopg2.extras.register_composite(t, cursor, globally=True)
+      registered_composite_types.add((connection.dsn, t))
+  return cursor
+
+
+def PostgresQuery(sql, connection, itersize=FETCH_BATCH_SIZE):
+  """Runs a single query on a server-side cursor, returning the cursor.
+
+  Rows of the result stay on the server until they are fetched, itersize
+  rows at a time, so memory of the client holds a batch at a time.
+  In a transaction rows are computed as they are fetched. A connection in
+  autocommit mode needs the cursor declared WITH HOLD, which computes and
+  stores the whole result on the server before the first row is returned,
+  until the cursor is closed.
+  """
+  cursor = connection.cursor(name='logica_' + uuid.uuid4().hex,
+                             withhold=connection.autocommit)
+  cursor.itersize = itersize
+  ExecuteOnCursor(sql, cursor, connection)
+  return cursor
+
+
+def ExecuteOnCursor(sql, cursor, connection):
+  import psycopg2
   try:
     cursor.execute(sql)
-    # Make connection aware of the used types.
-    types = re.findall(r'-- Logica type: (\w*)', sql)
-    for t in types:
-      if t != 'logicarecord893574736':  # Empty record.
-        psycopg2.extras.register_composite(t, cursor, globally=True)
   except psycopg2.errors.UndefinedTable  as e:
     raise infer.TypeErrorCaughtException(
       infer.ContextualizedError.BuildNiceMessage(
@@ -44,7 +88,6 @@ def PostgresExecute(sql, connection):
   except psycopg2.Error as e:
     connection.rollback()
     raise e
-  return cursor
 
 
 def DigestPsqlType(x):
@@ -72,7 +115,121 @@ def PsqlTypeAsList(a):
   return list(map(DigestPsqlType, a))
 
 
-def ConnectToPostgres(mode):
+def DigestNumeric(x):
+  if x is None:
+    return None
+  if x.as_integer_ratio()[1] == 1:
+    return int(x)
+  return float(x)
+
+
+def DigestNumericList(a):
+  if not a:
+    return a
+  return [DigestNumeric(x) if isinstance(x, Decimal) else DigestPsqlType(x)
+          for x in a]
+
+
+def ColumnDecoders(description):
+  """Decoders of the columns of a result, None for values ready as is.
+
+  Decoder is chosen by the type OID of the column, so that values of plain
+  types are not inspected one by one.
+  """
+  result = []
+  for column in description:
+    type_code = column[1]
+    if type_code in PLAIN_TYPE_OIDS:
+      result.append(None)
+    elif type_code == NUMERIC_OID:
+      result.append(DigestNumeric)
+    elif type_code == NUMERIC_ARRAY_OID:
+      result.append(DigestNumericList)
+    else:
+      result.append(DigestPsqlType)
+  return result
+
+
+class ResultStream(object):
+  """Decoded result of a cursor, fetched in batches.
+
+  Server-side cursors describe the result only after the first fetch, so
+  the first batch is fetched on creation. Batches may be iterated once,
+  the cursor is closed after the last one, or when the stream or its
+  iterator is dropped before that.
+  """
+
+  def __init__(self, cursor, batch_size=FETCH_BATCH_SIZE):
+    self.cursor = cursor
+    self.batch_size = batch_size
+    self.first_batch = cursor.fetchmany(batch_size)
+    self.header = [d[0] for d in cursor.description]
+    self.decoders = ColumnDecoders(cursor.description)
+
+  def ColumnBatches(self):
+    """Yields decoded columns of each batch."""
+    batch, self.first_batch = self.first_batch, None
+    try:
+      while batch:
+        yield [list(map(decoder, values)) if decoder else list(values)
+               for decoder, values in zip(self.decoders, zip(*batch))]
+        batch = self.cursor.fetchmany(self.batch_size)
+    finally:
+      self.Close()
+
+  def Close(self):
+    """Closes the cursor, releasing the result held by the server."""
+    if self.cursor is None:
+      return
+    cursor, self.cursor = self.cursor, None
+    if not cursor.closed and not cursor.connection.closed:
+      cursor.close()
+
+  def __del__(self):
+    self.Close()
+
+  def Rows(self):
+    """Yields decoded rows."""
+    for columns in self.ColumnBatches():
+      for row in zip(*columns):
+        yield list(row)
+
+  def DataFrames(self):
+    """Yields a pandas DataFrame per batch."""
+    for columns in self.ColumnBatches():
+      yield ColumnsDataFrame(self.header, columns)
+
+
+def ColumnsDataFrame(header, columns):
+  import pandas
+  df = pandas.DataFrame(dict(enumerate(columns)), columns=range(len(header)))
+  df.columns = header
+  return df
+
+
+def FetchColumns(cursor, batch_size=FETCH_BATCH_SIZE):
+  """Fetches result of the cursor as a header and a list of columns."""
+  stream = ResultStream(cursor, batch_size)
+  columns = [[] for _ in stream.header]
+  for batch in stream.ColumnBatches():
+    for column, values in zip(columns, batch):
+      column.extend(values)
+  return stream.header, columns
+
+
+def FetchRows(cursor, batch_size=FETCH_BATCH_SIZE):
+  """Fetches result of the cursor as a header and a list of rows."""
+  stream = ResultStream(cursor, batch_size)
+  return stream.header, list(stream.Rows())
+
+
+def FetchDataFrame(cursor, batch_size=FETCH_BATCH_SIZE):
+  """Fetches result of the cursor as a pandas DataFrame, column by column."""
+  return ColumnsDataFrame(*FetchColumns(cursor, batch_size))
+
+
+def PostgresConnector(mode):
+  """Returns function opening a new connection, asking for parameters once."""
   import psycopg2
   if mode == 'interactive':
     print('Please enter PostgreSQL URL, or config in JSON format with fields host, database, user and password.')
@@ -84,11 +241,16 @@ def ConnectToPostgres(mode):
         'in LOGICA_PSQL_CONNECTION.')
   else:
     assert False, 'Unknown mode:' + mode
-  if connection_str.startswith('postgres'):
-    connection = psycopg2.connect(connection_str)
-  else:
-    connection_json = json.loads(connection_str)
-    connection = psycopg2.connect(**connection_json)
+  def Connect():
+    if connection_str.startswith('postgres'):
+      connection = psycopg2.connect(connection_str)
+    else:
+      connection_json = json.loads(connection_str)
+      connection = psycopg2.connect(**connection_json)
+    connection.autocommit = True
+    return connection
+  return Connect
 
-  connection.autocommit = True
-  return connection
\ No newline at end of file
+
+def ConnectToPostgres(mode):
+  return PostgresConnector(mode)()
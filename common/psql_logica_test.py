@@ -0,0 +1,96 @@
+#!/usr/bin/python
+#
+# Copyright 2023 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Unitests for psql_logica.py."""
+
+import collections
+import unittest
+from decimal import Decimal
+
+from common import psql_logica
+
+
+class Connection(object):
+  closed = False
+
+
+class Cursor(object):
+  """Cursor holding a result, as returned by psycopg2."""
+
+  def __init__(self, description, rows):
+    self.description = description
+    self.rows = rows
+    self.closed = False
+    self.connection = Connection()
+
+  def fetchmany(self, size):
+    result, self.rows = self.rows[:size], self.rows[size:]
+    return result
+
+  def close(self):
+    self.closed = True
+
+
+class DecodingTest(unittest.TestCase):
+  def test_FetchRows(self):
+    Record = collections.namedtuple('Record', ['a', 'b'])
+    description = [('n', 23), ('x', 1700), ('l', 1231), ('r', 16384)]
+    rows = [(1, Decimal('2'), [Decimal('1.5'), None], Record(Decimal(3), 's')),
+            (2, None, [], None),
+            (3, Decimal('0.5'), None, Record(1, [Decimal('4')]))]
+    self.assertEqual(
+        [d is None for d in psql_logica.ColumnDecoders(description)],
+        [True, False, False, False])
+    header, decoded = psql_logica.FetchRows(Cursor(description, rows),
+                                            batch_size=2)
+    self.assertEqual(header, ['n', 'x', 'l', 'r'])
+    self.assertEqual(decoded,
+                     [[1, 2, [1.5, None], {'a': 3, 'b': 's'}],
+                      [2, None, [], None],
+                      [3, 0.5, None, {'a': 1, 'b': [4]}]])
+    self.assertEqual(decoded,
+                     [list(map(psql_logica.DigestPsqlType, r)) for r in rows])
+
+  def test_FetchColumnsOfEmptyResult(self):
+    self.assertEqual(psql_logica.FetchColumns(Cursor([('n', 23)], [])),
+                     (['n'], [[]]))
+
+  def test_ResultStream(self):
+    cursor = Cursor([('n', 23), ('x', 1700)],
+                    [(i, Decimal(i)) for i in range(5)])
+    stream = psql_logica.ResultStream(cursor, batch_size=2)
+    self.assertEqual(stream.header, ['n', 'x'])
+    rows = stream.Rows()
+    self.assertEqual([next(rows), next(rows), next(rows)],
+                     [[0, 0], [1, 1], [2, 2]])
+    self.assertFalse(cursor.closed)
+    self.assertEqual(list(rows), [[3, 3], [4, 4]])
+    self.assertTrue(cursor.closed)
+
+  def test_DroppedStreamClosesCursor(self):
+    for rows_read in [0, 1]:
+      cursor = Cursor([('n', 23)], [(i,) for i in range(5)])
+      stream = psql_logica.ResultStream(cursor, batch_size=2)
+      rows = stream.Rows()
+      for _ in range(rows_read):
+        next(rows)
+      self.assertFalse(cursor.closed)
+      del stream, rows
+      self.assertTrue(cursor.closed)
+
+
+if __name__ == '__main__':
+  unittest.main()
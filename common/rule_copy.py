@@ -0,0 +1,58 @@
+#!/usr/bin/python
+#
+# Copyright 2023 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Fast copying of parsed rules.
+
+Rules are trees of dictionaries and lists with strings, numbers and booleans
+as leaves. Strings, including HeritageAwareString, are never modified, so
+they are shared with the copy rather than copied, as copy.deepcopy does for
+str subclasses.
+"""
+
+import copy
+
+
+def Copy(x, memo=None):
+  """Returns deep copy of the rule structure x.
+
+  Same as with copy.deepcopy, an object that occurs in x multiple times,
+  e.g. a type shared by occurrences of a variable, is copied once and the
+  copy is shared.
+  """
+  t = type(x)
+  if t is str or t is int or t is bool or x is None:
+    return x
+  if memo is None:
+    memo = {}
+  else:
+    result = memo.get(id(x))
+    if result is not None:
+      return result
+  if t is dict:
+    result = {}
+    memo[id(x)] = result
+    for k, v in x.items():
+      result[k] = Copy(v, memo)
+    return result
+  if t is list:
+    result = []
+    memo[id(x)] = result
+    for v in x:
+      result.append(Copy(v, memo))
+    return result
+  if isinstance(x, (str, int, float)):
+    return x
+  return copy.deepcopy(x, memo)
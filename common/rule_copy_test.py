@@ -0,0 +1,46 @@
+#!/usr/bin/python
+#
+# Copyright 2023 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Unitests for rule_copy.py."""
+
+import copy
+import unittest
+
+from common import rule_copy
+from parser_py import parse
+
+
+class RuleCopyTest(unittest.TestCase):
+  def test_CopyIsEqualAndIndependent(self):
+    rules = parse.ParseFile('P(x, y: [1, 2.5]) :- Q(x), x > 0 | R(x);')['rule']
+    result = rule_copy.Copy(rules)
+    self.assertEqual(result, rules)
+    self.assertEqual(result, copy.deepcopy(rules))
+    result[0]['head']['predicate_name'] = 'Z'
+    self.assertEqual(rules[0]['head']['predicate_name'], 'P')
+
+  def test_SharedObjectsStayShared(self):
+    the_type = {'the_type': 'Num'}
+    rule = {'a': {'type': the_type}, 'b': [{'type': the_type}], 'c': {1, 2}}
+    result = rule_copy.Copy(rule)
+    self.assertIsNot(result['a']['type'], the_type)
+    self.assertIs(result['a']['type'], result['b'][0]['type'])
+    self.assertEqual(result['c'], {1, 2})
+    self.assertIsNot(result['c'], rule['c'])
+
+
+if __name__ == '__main__':
+  unittest.main()
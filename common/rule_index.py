@@ -0,0 +1,61 @@
+#!/usr/bin/python
+#
+# Copyright 2023 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Index of dictionary nodes of parsed rules.
+
+Compiler passes mostly act on nodes having a particular key, e.g. all
+'unification' nodes or all 'predicate_name' nodes. NodeIndex walks a rule
+once and lets each pass iterate over a flat list of the nodes it needs,
+instead of walking the whole tree again.
+"""
+
+
+def DictNodes(x, skip_keys=()):
+  """Returns dictionaries of x in the order of a depth first walk.
+
+  Parent goes before its children, children go in the order of keys.
+  Values of skip_keys are not entered.
+  """
+  result = []
+  stack = [x]
+  while stack:
+    node = stack.pop()
+    if isinstance(node, dict):
+      result.append(node)
+      children = [v for k, v in node.items()
+                  if k not in skip_keys and isinstance(v, (dict, list))]
+      stack.extend(reversed(children))
+    elif isinstance(node, list):
+      stack.extend(reversed(node))
+  return result
+
+
+class NodeIndex(object):
+  """Dictionary nodes of a rule, grouped by keys on demand.
+
+  Index stays valid while passes only change values of the nodes. Passes
+  adding keys to nodes, e.g. types, should check the keys on all nodes.
+  """
+
+  def __init__(self, x, skip_keys=()):
+    self.nodes = DictNodes(x, skip_keys)
+    self.nodes_with_key = {}
+
+  def With(self, key):
+    """Returns nodes having the key, in the order of the walk."""
+    if key not in self.nodes_with_key:
+      self.nodes_with_key[key] = [n for n in self.nodes if key in n]
+    return self.nodes_with_key[key]
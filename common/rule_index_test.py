@@ -0,0 +1,58 @@
+#!/usr/bin/python
+#
+# Copyright 2023 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Unitests for rule_index.py."""
+
+import unittest
+
+from common import rule_index
+from parser_py import parse
+
+
+def RecursiveWalk(x, skip_keys, result):
+  if isinstance(x, list):
+    for v in x:
+      RecursiveWalk(v, skip_keys, result)
+  if isinstance(x, dict):
+    result.append(x)
+    for k in x:
+      if k not in skip_keys:
+        RecursiveWalk(x[k], skip_keys, result)
+  return result
+
+
+class NodeIndexTest(unittest.TestCase):
+  def setUp(self):
+    self.rule = parse.ParseFile(
+        'P(x, y: [z]) :- Q(x, z), z = x + 1, y = (combine Sum= a :- R(a));')['rule'][0]
+
+  def test_NodesAreInOrderOfWalk(self):
+    for skip_keys in [(), ('combine',)]:
+      nodes = rule_index.DictNodes(self.rule, skip_keys)
+      expected = RecursiveWalk(self.rule, skip_keys, [])
+      self.assertEqual([id(n) for n in nodes], [id(n) for n in expected])
+
+  def test_With(self):
+    index = rule_index.NodeIndex(self.rule, ('combine',))
+    self.assertEqual([n['predicate_name'] for n in index.With('predicate_name')],
+                     ['P', 'Q', '=', '+', '='])
+    self.assertIs(index.With('variable'), index.With('variable'))
+    self.assertNotIn(
+        'a', [n['variable']['var_name'] for n in index.With('variable')])
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,32 @@
+#!/usr/bin/python
+#
+# Copyright 2023 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Headers of scripts that the compiler writes for the SQLite runner.
+
+Scripts starting with a header are not executed as they are, the runner in
+common/sqlite3_logica.py reads the JSON that follows the header to decide
+how to execute them.
+"""
+
+# Header of a script grounding a table incrementally, written by
+# compiler/universe.py. Runner decides whether to execute the script based
+# on the header.
+INCREMENTAL_GROUND_MARKER = '-- Logica incremental ground: '
+
+# Header of a script computing a recursion iteratively, written by
+# compiler/universe.py. Script initializes the tables, header holds the
+# round that is repeated while the delta table is not empty.
+ITERATIVE_RECURSION_MARKER = '-- Logica iterative recursion: '
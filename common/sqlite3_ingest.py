@@ -0,0 +1,330 @@
+#!/usr/bin/python
+#
+# Copyright 2023 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Bulk loading of CSV, JSONL and Parquet files into SQLite tables.
+
+Column types are inferred from a sample of the file. Rows are inserted with
+executemany in large transactions into a temporary table, which replaces the
+table in one transaction at the end, so a failed load leaves the table as it
+was. Indexes are built after the load.
+
+Example:
+  connection = sqlite3_logica.SqliteConnect('warehouse.db')
+  sqlite3_ingest.IngestFile(connection, 'Sales', 'sales.csv',
+                            index_columns=['customer_id'])
+"""
+
+import csv
+import itertools
+import json
+import os
+
+if '.' not in __package__:
+  from common import sqlite3_logica
+else:
+  from ..common import sqlite3_logica
+
+
+# Number of rows inserted per transaction.
+BATCH_SIZE = 100000
+# Number of rows used to infer column types.
+SAMPLE_SIZE = 1000
+
+FORMATS = {'.csv': 'csv', '.jsonl': 'jsonl', '.json': 'jsonl',
+           '.ndjson': 'jsonl', '.parquet': 'parquet'}
+
+
+class IngestError(Exception):
+  """Error of loading a file into a table."""
+
+
+def FileFormat(path):
+  _, extension = os.path.splitext(path)
+  if extension.lower() not in FORMATS:
+    raise IngestError(
+        'Can not recognize format of %s. Supported extensions: %s.' % (
+            path, ', '.join(sorted(FORMATS))))
+  return FORMATS[extension.lower()]
+
+
+def SqliteType(value):
+  """Column type of a value read from a typed format."""
+  if isinstance(value, bool) or isinstance(value, int):
+    return 'INTEGER'
+  if isinstance(value, float):
+    return 'REAL'
+  return 'TEXT'
+
+
+def CsvValueType(value):
+  """Column type of a CSV cell, None for empty cells."""
+  if value == '':
+    return None
+  try:
+    int(value)
+    return 'INTEGER'
+  except ValueError:
+    pass
+  try:
+    float(value)
+    return 'REAL'
+  except ValueError:
+    return 'TEXT'
+
+
+def CommonType(types):
+  """Narrowest type holding values of all the types."""
+  types = set(types) - {None}
+  if not types:
+    return 'TEXT'
+  if types == {'INTEGER'}:
+    return 'INTEGER'
+  if types <= {'INTEGER', 'REAL'}:
+    return 'REAL'
+  return 'TEXT'
+
+
+def Storable(value):
+  """Value that SQLite can store, composite values become JSON."""
+  if value is None or isinstance(value, (int, float, str, bytes)):
+    return value
+  if isinstance(value, (dict, list, tuple)):
+    return json.dumps(value)
+  return str(value)
+
+
+class CsvSource(object):
+  """Rows of a CSV file with header."""
+
+  def __init__(self, path):
+    self.file = open(path, newline='')
+    reader = csv.reader(self.file)
+    try:
+      self.columns = next(reader)
+    except StopIteration:
+      raise IngestError('File %s is empty.' % path)
+    rows = self.Checked(path, reader)
+    sample = list(itertools.islice(rows, SAMPLE_SIZE))
+    self.types = [CommonType(CsvValueType(row[i]) for row in sample)
+                  for i in range(len(self.columns))]
+    self.rows = itertools.chain(sample, rows)
+
+  def Checked(self, path, reader):
+    """Rows of the reader, checked to have a value for each column."""
+    for row in reader:
+      if not row:
+        continue
+      if len(row) != len(self.columns):
+        raise IngestError(
+            'Line %d of %s has %d values, while the header has %d '
+            'columns.' % (reader.line_num, path, len(row), len(self.columns)))
+      yield row
+
+  def Placeholders(self):
+    # Type affinity of the column converts numeric text, so cells are
+    # inserted as they are read, except for empty numeric cells.
+    return ['?' if t == 'TEXT' else "NULLIF(?, '')" for t in self.types]
+
+  def Close(self):
+    self.file.close()
+
+
+class JsonlSource(object):
+  """Rows of a file with a JSON object per line.
+
+  Columns are the keys of the sample, a later record with another key is
+  an error, rather than losing its value.
+  """
+
+  def __init__(self, path):
+    self.path = path
+    self.file = open(path)
+    records = (json.loads(line) for line in self.file if line.strip())
+    sample = list(itertools.islice(records, SAMPLE_SIZE))
+    if not sample:
+      raise IngestError('File %s is empty.' % path)
+    self.columns = list(dict.fromkeys(k for r in sample for k in r))
+    self.types = [CommonType(SqliteType(r[c]) for r in sample
+                             if r.get(c) is not None)
+                  for c in self.columns]
+    self.rows = (tuple(Storable(r.get(c)) for c in self.columns)
+                 for r in itertools.chain(sample, self.Checked(records)))
+
+  def Checked(self, records):
+    """Records after the sample, checked to have only known keys."""
+    known = set(self.columns)
+    for i, r in enumerate(records):
+      if not known.issuperset(r):
+        raise IngestError(
+            'Record %d of %s has keys %s that are not in the first %d '
+            'records, which define the columns.' % (
+                SAMPLE_SIZE + i + 1, self.path,
+                ', '.join(sorted(set(r) - known)), SAMPLE_SIZE))
+      yield r
+
+  def Placeholders(self):
+    return ['?'] * len(self.columns)
+
+  def Close(self):
+    self.file.close()
+
+
+class ParquetSource(object):
+  """Rows of a Parquet file, read with pyarrow."""
+
+  def __init__(self, path):
+    try:
+      import pyarrow
+      from pyarrow import parquet
+    except ImportError:
+      raise IngestError('Loading Parquet files requires pyarrow.')
+    self.file = parquet.ParquetFile(path)
+    schema = self.file.schema_arrow
+    self.columns = schema.names
+    def ArrowType(t):
+      if pyarrow.types.is_integer(t) or pyarrow.types.is_boolean(t):
+        return 'INTEGER'
+      if pyarrow.types.is_floating(t):
+        return 'REAL'
+      return 'TEXT'
+    self.types = [ArrowType(f.type) for f in schema]
+    self.rows = (tuple(map(Storable, row))
+                 for batch in self.file.iter_batches(batch_size=BATCH_SIZE)
+                 for row in zip(*(c.to_pylist() for c in batch.columns)))
+
+  def Placeholders(self):
+    return ['?'] * len(self.columns)
+
+  def Close(self):
+    self.file.close()
+
+
+SOURCES = {'csv': CsvSource, 'jsonl': JsonlSource, 'parquet': ParquetSource}
+
+
+def Quote(name):
+  return '"%s"' % name.replace('"', '""')
+
+
+def SplitTableName(table_name):
+  """Returns schema prefix, e.g. 'db.', and name of the table."""
+  if '.' in table_name:
+    schema, name = table_name.split('.', 1)
+    return schema + '.', name
+  return '', table_name
+
+
+def IngestFile(connection, table_name, path, file_format=None,
+               index_columns=None, batch_size=BATCH_SIZE):
+  """Replaces table with the rows of the file, returns number of rows.
+
+  The table is replaced in one transaction once the file is loaded, if the
+  load fails the table is left unchanged.
+
+  Args:
+    connection: SQLite connection, with the database of the table attached.
+    table_name: Table to create, possibly prefixed by the database.
+    path: File to load.
+    file_format: One of 'csv', 'jsonl' or 'parquet', by default inferred
+      from the file extension.
+    index_columns: Columns to index after the load, a list of columns
+      makes a composite index.
+    batch_size: Number of rows inserted per transaction.
+  """
+  source = SOURCES[file_format or FileFormat(path)](path)
+  try:
+    indexes = [c if isinstance(c, list) else [c]
+               for c in index_columns or []]
+    missing = {c for columns in indexes for c in columns} - set(
+        source.columns)
+    if missing:
+      raise IngestError('Columns %s to index are not in %s.' % (
+          ', '.join(sorted(missing)), path))
+    schema, name = SplitTableName(table_name)
+    if schema and sqlite3_logica.AttachedDatabases(connection).get(
+        schema[:-1]):
+      for pragma in sqlite3_logica.FILE_PRAGMAS:
+        connection.execute(pragma.replace('PRAGMA ', 'PRAGMA ' + schema))
+    # Rows are loaded into a temporary table, so that the table is replaced
+    # only once all of them are read.
+    temporary_name = table_name + '__ingest'
+    connection.execute('DROP TABLE IF EXISTS %s' % temporary_name)
+    connection.execute('CREATE TABLE %s (%s)' % (
+        temporary_name,
+        ', '.join('%s %s' % (Quote(c), t)
+                  for c, t in zip(source.columns, source.types))))
+    insert = 'INSERT INTO %s VALUES (%s)' % (
+        temporary_name, ', '.join(source.Placeholders()))
+    num_rows = 0
+    while True:
+      batch = list(itertools.islice(source.rows, batch_size))
+      if not batch:
+        break
+      connection.executemany(insert, batch)
+      connection.commit()
+      num_rows += len(batch)
+    connection.execute('BEGIN')
+    connection.execute('DROP TABLE IF EXISTS %s' % table_name)
+    connection.execute('ALTER TABLE %s RENAME TO %s' % (temporary_name, name))
+    for columns in indexes:
+      connection.execute('CREATE INDEX %s%s ON %s (%s)' % (
+          schema, Quote('_'.join([name] + columns + ['index'])), name,
+          ', '.join(map(Quote, columns))))
+    connection.commit()
+  except:
+    connection.rollback()
+    connection.execute('DROP TABLE IF EXISTS %s' % temporary_name)
+    connection.commit()
+    raise
+  finally:
+    source.Close()
+  return num_rows
+
+
+def IngestPredicate(program, predicate, path, connection=None, **kwargs):
+  """Loads the file into the table grounding the predicate.
+
+  Program is a universe.LogicaProgram, the predicate must be annotated with
+  @Ground. Indexes requested by @Index are built, unless index_columns are
+  given. Without a connection a new one is made and databases of the
+  program are attached to it, so the table must be in a database file.
+  Returns number of rows loaded.
+  """
+  annotations = program.annotations
+  if annotations.Engine() != 'sqlite':
+    raise IngestError('Ingestion is supported only for SQLite engine.')
+  ground = annotations.Ground(predicate)
+  if not ground:
+    raise IngestError('Predicate %s must be annotated with @Ground to be '
+                      'ingested.' % predicate)
+  if kwargs.get('index_columns') is None:
+    kwargs['index_columns'] = annotations.Indexes(predicate)[0]
+  schema, _ = SplitTableName(ground.table_name)
+  if connection is None:
+    database = annotations.AttachedDatabases().get(schema[:-1], ':memory:')
+    if database == ':memory:':
+      raise IngestError(
+          'Table %s is in memory, attach a database file with '
+          '@AttachDatabase to ingest it.' % ground.table_name)
+    connection = sqlite3_logica.SqliteConnect()
+    try:
+      connection.executescript(annotations.AttachDatabaseStatements())
+      return IngestFile(connection, ground.table_name, path, **kwargs)
+    finally:
+      connection.close()
+  sqlite3_logica.ExecuteScript(connection,
+                               annotations.AttachDatabaseStatements())
+  return IngestFile(connection, ground.table_name, path, **kwargs)
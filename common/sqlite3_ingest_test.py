@@ -0,0 +1,117 @@
+#!/usr/bin/python
+#
+# Copyright 2023 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Unitests for sqlite3_ingest.py."""
+
+import os
+import tempfile
+import unittest
+
+from common import sqlite3_ingest
+from common import sqlite3_logica
+from compiler import universe
+from parser_py import parse
+
+
+class IngestTest(unittest.TestCase):
+  def setUp(self):
+    self.directory = tempfile.TemporaryDirectory()
+    self.connection = sqlite3_logica.SqliteConnect()
+
+  def tearDown(self):
+    self.connection.close()
+    self.directory.cleanup()
+
+  def WriteFile(self, name, text):
+    path = os.path.join(self.directory.name, name)
+    with open(path, 'w') as w:
+      w.write(text)
+    return path
+
+  def Select(self, sql):
+    return self.connection.execute(sql).fetchall()
+
+  def test_Csv(self):
+    path = self.WriteFile('t.csv', 'a,b,c\n1,1.5,x\n,2,\n')
+    self.assertEqual(
+        sqlite3_ingest.IngestFile(self.connection, 't', path, batch_size=1,
+                                  index_columns=['a']), 2)
+    self.assertEqual(self.Select('SELECT * FROM t'),
+                     [(1, 1.5, 'x'), (None, 2.0, '')])
+    self.assertEqual(self.Select('PRAGMA index_list(t)')[0][1], 't_a_index')
+
+  def test_Jsonl(self):
+    path = self.WriteFile('t.jsonl',
+                          '{"a": 1, "b": [1, 2]}\n\n{"a": 2.5, "c": "x"}\n')
+    sqlite3_ingest.IngestFile(self.connection, 't', path)
+    self.assertEqual(
+        [(r[1], r[2]) for r in self.Select('PRAGMA table_info(t)')],
+        [('a', 'REAL'), ('b', 'TEXT'), ('c', 'TEXT')])
+    self.assertEqual(self.Select('SELECT * FROM t'),
+                     [(1.0, '[1, 2]', None), (2.5, None, 'x')])
+
+  def test_JsonlKeyAfterSample(self):
+    path = self.WriteFile('t.jsonl', '{"a": 1}\n' * 3 + '{"a": 2, "d": 1}\n')
+    saved_sample_size = sqlite3_ingest.SAMPLE_SIZE
+    sqlite3_ingest.SAMPLE_SIZE = 2
+    try:
+      with self.assertRaisesRegex(sqlite3_ingest.IngestError, 'Record 4 .* d'):
+        sqlite3_ingest.IngestFile(self.connection, 't', path)
+    finally:
+      sqlite3_ingest.SAMPLE_SIZE = saved_sample_size
+
+  def test_FailedLoadKeepsTable(self):
+    self.connection.execute('CREATE TABLE t (a INTEGER)')
+    self.connection.execute('INSERT INTO t VALUES (42)')
+    self.connection.commit()
+    path = self.WriteFile('t.jsonl', '{"a": 1}\n' * 4 + '{"a": 2, "d": 1}\n')
+    saved_sample_size = sqlite3_ingest.SAMPLE_SIZE
+    sqlite3_ingest.SAMPLE_SIZE = 2
+    try:
+      with self.assertRaises(sqlite3_ingest.IngestError):
+        sqlite3_ingest.IngestFile(self.connection, 't', path, batch_size=1)
+    finally:
+      sqlite3_ingest.SAMPLE_SIZE = saved_sample_size
+    self.assertEqual(self.Select('SELECT * FROM t'), [(42,)])
+    self.assertEqual(
+        self.Select("SELECT name FROM sqlite_master WHERE type = 'table'"),
+        [('t',)])
+
+  def test_CsvRaggedRow(self):
+    path = self.WriteFile('t.csv', 'a,b\n1,2\n3\n')
+    with self.assertRaisesRegex(sqlite3_ingest.IngestError,
+                                'Line 3 .* 1 values, .* 2 columns'):
+      sqlite3_ingest.IngestFile(self.connection, 't', path)
+
+  def test_Predicate(self):
+    database = os.path.join(self.directory.name, 'db.sqlite')
+    path = self.WriteFile('t.csv', 'x\n1\n2\n')
+    program = universe.LogicaProgram(parse.ParseFile(
+        '@Engine("sqlite"); @AttachDatabase("db", "%s"); '
+        '@Ground(T, "db.T"); @Ground(M); '
+        'S() += x :- T(x:);' % database)['rule'])
+    self.assertEqual(sqlite3_ingest.IngestPredicate(program, 'T', path), 2)
+    self.assertEqual(sqlite3_logica.RunSqlScript(
+        [program.annotations.Preamble(), 'SELECT SUM(x) AS s FROM db.T'], 'csv'),
+                     's\r\n3\r\n')
+    with self.assertRaises(sqlite3_ingest.IngestError):
+      sqlite3_ingest.IngestPredicate(program, 'M', path)
+    with self.assertRaises(sqlite3_ingest.IngestError):
+      sqlite3_ingest.IngestPredicate(program, 'S', path)
+
+
+if __name__ == '__main__':
+  unittest.main()
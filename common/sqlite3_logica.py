@@ -1,20 +1,27 @@
 """Provides connection to SQLite extended with UDFs needed by Logica."""
 
+import collections
+import contextlib
 import csv
+import functools
 import hashlib
 import io
 import math
+import os
 import sys
 import sqlite3
 import heapq
 import json
 import re
+import threading
 
 
 if '.' not in __package__:
   from common import intelligence
+  from common import script_markers
 else:
   from ..common import intelligence
+  from ..common import script_markers
 
 
 def DeFactoType(value):
@@ -30,6 +37,33 @@ def LoadJson(s):
     print('Failed to parse JSON object: %s' % s, file=sys.stderr)
     raise e
 
+
+# Lists are passed to the functions as JSON strings. Often the same list is
+# passed on every row, e.g. a constant list in a membership test, so parsing
+# and pure list functions are memoized.
+LIST_CACHE_SIZE = 128
+
+
+@functools.lru_cache(maxsize=LIST_CACHE_SIZE)
+def ParsedList(a_list):
+  """Parses JSON list into a tuple, so that it is safe to share."""
+  result = LoadJson(a_list)
+  if isinstance(result, list):
+    return tuple(result)
+  return result
+
+
+@functools.lru_cache(maxsize=LIST_CACHE_SIZE)
+def ListMembership(a_list):
+  """Returns a set of the list elements, if they are hashable."""
+  elements = ParsedList(a_list)
+  if isinstance(elements, tuple):
+    try:
+      return frozenset(elements)
+    except TypeError:
+      pass
+  return elements
+
 class ArgMin:
   """ArgMin user defined aggregate function."""
   def __init__(self):
@@ -106,12 +140,13 @@ class ArrayConcatAgg:
   def step(self, a):
     if a is None:
       return
-    self.result.extend(LoadJson(a))
+    self.result.extend(ParsedList(a))
   
   def finalize(self):
     return json.dumps(self.result)
   
 
+@functools.lru_cache(maxsize=LIST_CACHE_SIZE)
 def ArrayConcat(a, b):
   if a is None or b is None:
     return None
@@ -119,7 +154,7 @@ def ArrayConcat(a, b):
     print('Bad first concatenation argument:', a, b)
   if not isinstance(b, str):
     print('Bad second concatenation argument:', a, b)
-  return json.dumps(LoadJson(a) + LoadJson(b))
+  return json.dumps(ParsedList(a) + ParsedList(b))
 
 
 def PrintToConsole(message):
@@ -128,8 +163,9 @@ def PrintToConsole(message):
   return 1
 
 
+@functools.lru_cache(maxsize=LIST_CACHE_SIZE)
 def Join(array, separator):
-  return separator.join(map(str, LoadJson(array)))
+  return separator.join(map(str, ParsedList(array)))
 
 
 def ReadFile(filename):
@@ -176,11 +212,12 @@ def Csv(header, rows):
     writer.writerow(row)
   return stringio.getvalue()
 
+@functools.lru_cache(maxsize=LIST_CACHE_SIZE)
 def SortList(input_list_json):
-  return json.dumps(list(sorted(LoadJson(input_list_json))))
+  return json.dumps(list(sorted(ParsedList(input_list_json))))
 
 def InList(item, a_list):
-  return item in LoadJson(a_list)
+  return item in ListMembership(a_list)
 
 def AssembleRecord(field_value_list):
   field_value_list = LoadJson(field_value_list)
@@ -205,8 +242,24 @@ def UserError(error_text):
 def Fingerprint(s):
   return int(hashlib.md5(str(s).encode()).hexdigest()[:16], 16) - (1 << 63)
 
-def SqliteConnect():
-  con = sqlite3.connect(':memory:')
+# PRAGMAs applied to new connections. Journal and memory mapping settings
+# only matter for databases stored in files.
+PRAGMAS = [
+    'PRAGMA cache_size = -262144',  # 256 MB.
+    'PRAGMA temp_store = MEMORY',
+]
+FILE_PRAGMAS = [
+    'PRAGMA journal_mode = WAL',
+    'PRAGMA synchronous = NORMAL',
+    'PRAGMA mmap_size = 1073741824',  # 1 GB.
+]
+
+
+def SqliteConnect(database=':memory:'):
+  """Returns connection to the database with Logica UDFs registered."""
+  con = sqlite3.connect(database, check_same_thread=False)
+  for pragma in PRAGMAS + (FILE_PRAGMAS if database != ':memory:' else []):
+    con.execute(pragma)
   con.create_aggregate('ArgMin', 3, ArgMin)
   con.create_aggregate('ArgMax', 3, ArgMax)
   con.create_aggregate('DistinctListAgg', 1, DistinctListAgg)
@@ -241,43 +294,260 @@ def SqliteConnect():
   return con
 
 
-def RunSqlScript(statements, output_format):
-  """Runs a sequence of statements, returning result of final."""
-  assert statements, 'RunSqlScript requires non-empty statements list.'
-  connect = SqliteConnect()
-  cursor = connect.cursor()
+@contextlib.contextmanager
+def Committed(connection):
+  """Commits work done on the connection in the context, or rolls it back."""
+  try:
+    yield connection
+    connection.commit()
+  except BaseException:
+    connection.rollback()
+    raise
+
+
+class ConnectionPool(object):
+  """Pool of connections with Logica UDFs registered, per database.
+
+  Connection is handed to one user at a time and returned to the pool
+  after use, keeping its data, including attached databases, for the next
+  user of the same database. Each connection to ':memory:' is a separate
+  database, so the pool keeps a single one, which users take in turns.
+  """
+
+  def __init__(self, max_idle=4):
+    self.max_idle = max_idle
+    self.lock = threading.Lock()
+    self.idle = collections.defaultdict(list)
+    # Reentrant, so that a user of the memory database may nest its use.
+    self.memory_lock = threading.RLock()
+    self.memory_connection = None
+
+  def Key(self, database):
+    if database == ':memory:':
+      return database
+    return os.path.abspath(database)
+
+  @contextlib.contextmanager
+  def Connection(self, database=':memory:'):
+    """Context of a pooled connection, committed at the end."""
+    if database == ':memory:':
+      with self.memory_lock:
+        if self.memory_connection is None:
+          self.memory_connection = SqliteConnect()
+        with Committed(self.memory_connection) as connection:
+          yield connection
+      return
+    key = self.Key(database)
+    with self.lock:
+      connection = self.idle[key].pop() if self.idle[key] else None
+    if connection is None:
+      connection = SqliteConnect(database)
+    try:
+      with Committed(connection):
+        yield connection
+    finally:
+      with self.lock:
+        if len(self.idle[key]) < self.max_idle:
+          self.idle[key].append(connection)
+          connection = None
+      if connection is not None:
+        connection.close()
+
+  def CloseAll(self):
+    with self.memory_lock:
+      if self.memory_connection is not None:
+        self.memory_connection.close()
+        self.memory_connection = None
+    with self.lock:
+      idle, self.idle = self.idle, collections.defaultdict(list)
+    for connections in idle.values():
+      for connection in connections:
+        connection.close()
+
+
+# Pool used by library calls that are given a database.
+connection_pool = ConnectionPool()
+
+
+ATTACH_STATEMENT = re.compile(r"^ATTACH DATABASE '(.*)' AS (\w+);$",
+                              re.MULTILINE)
+
+
+def AttachedDatabases(connection):
+  """Returns map of attached database name to its file, '' for memory."""
+  return {name: file for _, name, file in
+          connection.execute('PRAGMA database_list').fetchall()}
+
+
+def WithoutRepeatedAttachments(connection, script):
+  """Removes attachments done earlier on a reused connection."""
+  if 'ATTACH DATABASE' not in script:
+    return script
+  attached = AttachedDatabases(connection)
+  def Replace(match):
+    file, name = match.group(1), match.group(2)
+    if name not in attached:
+      return match.group(0)
+    if attached[name] == ('' if file == ':memory:' else
+                          os.path.abspath(file)):
+      return ''
+    return 'DETACH DATABASE %s;\n%s' % (name, match.group(0))
+  return ATTACH_STATEMENT.sub(Replace, script)
+
+
+def ExecuteScript(connection, script):
+  """Executes script, skipping incremental grounding of unchanged tables."""
+  script = WithoutRepeatedAttachments(connection, script)
+  if script.startswith(script_markers.ITERATIVE_RECURSION_MARKER):
+    ExecuteIterativeRecursion(connection, script)
+    return
+  if not script.startswith(script_markers.INCREMENTAL_GROUND_MARKER):
+    connection.executescript(script)
+    return
+  header, script = script.split('\n', 1)
+  ground = json.loads(header[len(script_markers.INCREMENTAL_GROUND_MARKER):])
+  fingerprint_table = ground['fingerprint_table']
+  connection.execute(
+      'CREATE TABLE IF NOT EXISTS %s '
+      '(table_name TEXT PRIMARY KEY, fingerprint TEXT)' % fingerprint_table)
+  (fingerprint,), = connection.execute(
+      'SELECT ' + ground['fingerprint']).fetchall()
+  for table in ground.get('checksum_tables', []):
+    fingerprint += '/' + TableChecksum(connection, table)
+  stored = connection.execute(
+      'SELECT fingerprint FROM %s WHERE table_name = ?' % fingerprint_table,
+      [ground['table']]).fetchall()
+  if stored == [(fingerprint,)] and TableExists(connection, ground['table']):
+    return
+  connection.executescript(script)
+  connection.execute(
+      'INSERT OR REPLACE INTO %s VALUES (?, ?)' % fingerprint_table,
+      [ground['table'], fingerprint])
+  connection.commit()
+
+
+def ExecuteIterativeRecursion(connection, script):
+  """Executes rounds of the recursion until its delta is empty."""
+  header, script = script.split('\n', 1)
+  recursion = json.loads(header[len(script_markers.ITERATIVE_RECURSION_MARKER):])
+  connection.executescript(script)
+  rounds = 0
+  while (recursion['rounds'] < 0 or rounds < recursion['rounds']) and (
+      connection.execute(
+          'SELECT 1 FROM %s LIMIT 1' % recursion['delta']).fetchall()):
+    connection.executescript(recursion['round'])
+    rounds += 1
+  connection.executescript(recursion['finish'])
+
+
+def TableChecksum(connection, table):
+  """Hash of the rows of the table, in the order they are stored."""
+  checksum = hashlib.sha256()
+  cursor = connection.execute('SELECT * FROM %s' % table)
+  while True:
+    rows = cursor.fetchmany(STREAM_BATCH_SIZE)
+    if not rows:
+      break
+    checksum.update(repr(rows).encode())
+  return checksum.hexdigest()
+
+
+def TableExists(connection, table_name):
+  try:
+    connection.execute('SELECT 1 FROM %s LIMIT 0' % table_name)
+  except sqlite3.OperationalError:
+    return False
+  return True
+
+
+@contextlib.contextmanager
+def ScriptConnection(database):
+  """Fresh connection if database is None, pooled connection otherwise."""
+  if database is None:
+    connection = SqliteConnect()
+    try:
+      yield connection
+    finally:
+      connection.close()
+  else:
+    with connection_pool.Connection(database) as connection:
+      yield connection
 
-  for s in statements[:-1]:
-    cursor.executescript(s)
-  cursor.execute(statements[-1])
-  rows = cursor.fetchall()
-  header = [d[0] for d in cursor.description]
 
-  connect.close()
+def FormatRows(header, rows, output_format):
   if output_format == 'artistictable':
-    result = ArtisticTable(header, rows)
-  elif output_format == 'csv': 
-    result = Csv(header, rows)
-  else:
-    assert False, 'Bad output format: %s' % output_format
-  return result
+    return ArtisticTable(header, rows)
+  if output_format == 'csv':
+    return Csv(header, rows)
+  assert False, 'Bad output format: %s' % output_format
+
 
+def RunSqlScript(statements, output_format, database=None):
+  """Runs a sequence of statements, returning result of final.
 
-def RunSQL(sql, output_format='artistictable'):
+  If database is given, statements run on a pooled connection to it, so
+  tables and attachments persist between calls.
+  """
+  assert statements, 'RunSqlScript requires non-empty statements list.'
+  with ScriptConnection(database) as connect:
+    cursor = connect.cursor()
+    for s in statements[:-1]:
+      ExecuteScript(connect, s)
+    cursor.execute(statements[-1])
+    rows = cursor.fetchall()
+    header = [d[0] for d in cursor.description]
+  return FormatRows(header, rows, output_format)
+
+
+# Number of rows fetched at a time when streaming results.
+STREAM_BATCH_SIZE = 10000
+
+
+def RowsWriter(header, output_format, output):
+  """Returns function writing a batch of rows to output."""
+  if output_format == 'csv':
+    writer = csv.writer(output)
+    writer.writerow(header)
+    return writer.writerows
+  if output_format == 'jsonl':
+    def WriteJsonl(rows):
+      output.write(''.join(json.dumps(dict(zip(header, row)),
+                                      default=str) + '\n'
+                           for row in rows))
+    return WriteJsonl
+  assert False, 'Bad streaming output format: %s' % output_format
+
+
+def StreamSqlScript(statements, output_format, output,
+                    batch_size=STREAM_BATCH_SIZE, database=None):
+  """Runs a sequence of statements, writing rows of final to output.
+
+  Rows are fetched and written in batches, so memory use doesn't grow with
+  the size of the result.
+  """
+  assert statements, 'StreamSqlScript requires non-empty statements list.'
+  with ScriptConnection(database) as connect:
+    cursor = connect.cursor()
+    for s in statements[:-1]:
+      ExecuteScript(connect, s)
+    cursor.execute(statements[-1])
+    header = [d[0] for d in cursor.description]
+    write_rows = RowsWriter(header, output_format, output)
+    while True:
+      rows = cursor.fetchmany(batch_size)
+      if not rows:
+        break
+      write_rows(rows)
+
+
+def RunSQL(sql, output_format='artistictable', database=None):
   """Running SQL with artistictable or csv output."""
-  connect = SqliteConnect()
-  cursor = connect.cursor()
-  cursor.execute(sql)
-  rows = cursor.fetchall()
-  header = [d[0] for d in cursor.description]
-  connect.close()
-  if output_format == 'artistictable':
-    result = ArtisticTable(header, rows)
-  elif output_format == 'csv':
-    result = Csv(header, rows)
-  else:
-    assert False, 'Bad output format: %s' % output_format
-  return result
+  with ScriptConnection(database) as connect:
+    cursor = connect.cursor()
+    cursor.execute(sql)
+    rows = cursor.fetchall()
+    header = [d[0] for d in cursor.description]
+  return FormatRows(header, rows, output_format)
 
 if __name__ == '__main__':
   c = SqliteConnect()
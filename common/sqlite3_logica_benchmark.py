@@ -0,0 +1,68 @@
+#!/usr/bin/python
+#
+# Copyright 2023 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Benchmark of list functions of sqlite3_logica.py.
+
+Prints per row cost of list functions for lists of various sizes, with the
+same list passed on each row, as in membership tests against a constant list.
+
+Usage: python -m common.sqlite3_logica_benchmark
+"""
+
+import json
+import time
+
+from common import sqlite3_logica
+
+
+LIST_SIZES = [10, 1000, 100000]
+
+QUERIES = [
+    ('IN_LIST', 'SELECT SUM(IN_LIST(x, :list)) FROM numbers'),
+    ('JOIN_STRINGS',
+     'SELECT SUM(LENGTH(JOIN_STRINGS(:list, \',\'))) FROM numbers'),
+    ('SortList', 'SELECT SUM(LENGTH(SortList(:list))) FROM numbers'),
+    ('ARRAY_CONCAT',
+     'SELECT SUM(LENGTH(ARRAY_CONCAT(:list, :list))) FROM numbers'),
+    ('ARRAY_CONCAT_AGG', 'SELECT LENGTH(ARRAY_CONCAT_AGG(:list)) FROM numbers'),
+]
+
+
+def NumRows(list_size):
+  return max(20, 10 ** 6 // list_size)
+
+
+def RunBenchmark():
+  connection = sqlite3_logica.SqliteConnect()
+  print('%-18s %10s %8s %14s' % ('function', 'list size', 'rows',
+                                 'us per row'))
+  for list_size in LIST_SIZES:
+    num_rows = NumRows(list_size)
+    connection.executescript('DROP TABLE IF EXISTS numbers;'
+                             'CREATE TABLE numbers (x INTEGER);')
+    connection.executemany('INSERT INTO numbers VALUES (?)',
+                           [(i,) for i in range(num_rows)])
+    a_list = json.dumps(list(reversed(range(list_size))))
+    for name, query in QUERIES:
+      start = time.perf_counter()
+      connection.execute(query, {'list': a_list}).fetchall()
+      elapsed = time.perf_counter() - start
+      print('%-18s %10d %8d %14.2f' % (name, list_size, num_rows,
+                                       elapsed / num_rows * 1e6))
+
+
+if __name__ == '__main__':
+  RunBenchmark()
@@ -0,0 +1,209 @@
+#!/usr/bin/python
+#
+# Copyright 2023 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Unitests for sqlite3_logica.py."""
+
+import io
+import json
+import os
+import tempfile
+import threading
+import unittest
+
+from common import script_markers
+from common import sqlite3_logica
+from compiler import universe
+from parser_py import parse
+
+
+class ExecuteScriptTest(unittest.TestCase):
+  def setUp(self):
+    self.connection = sqlite3_logica.SqliteConnect()
+    self.connection.executescript(
+        'CREATE TABLE events (x); INSERT INTO events VALUES (1), (2);')
+    header = json.dumps({
+        'table': 'total',
+        'fingerprint_table': 'logica_ground_fingerprints',
+        'fingerprint': "(SELECT CAST(COUNT(*) AS TEXT) FROM events)",
+        'checksum_tables': ['events']})
+    self.script = (
+        script_markers.INCREMENTAL_GROUND_MARKER + header + '\n' +
+        'DROP TABLE IF EXISTS total;\n'
+        'CREATE TABLE total AS SELECT SUM(x) AS s FROM events;')
+
+  def Total(self):
+    return self.connection.execute('SELECT s FROM total').fetchall()
+
+  def test_UnchangedTableIsSkipped(self):
+    sqlite3_logica.ExecuteScript(self.connection, self.script)
+    self.assertEqual(self.Total(), [(3,)])
+    self.connection.execute('UPDATE total SET s = 0')
+    sqlite3_logica.ExecuteScript(self.connection, self.script)
+    self.assertEqual(self.Total(), [(0,)])
+
+  def test_ChangedTableIsRebuilt(self):
+    sqlite3_logica.ExecuteScript(self.connection, self.script)
+    self.connection.execute('INSERT INTO events VALUES (10)')
+    sqlite3_logica.ExecuteScript(self.connection, self.script)
+    self.assertEqual(self.Total(), [(13,)])
+    self.connection.execute('DROP TABLE total')
+    sqlite3_logica.ExecuteScript(self.connection, self.script)
+    self.assertEqual(self.Total(), [(13,)])
+
+  def test_UpdatedTableIsRebuilt(self):
+    sqlite3_logica.ExecuteScript(self.connection, self.script)
+    self.connection.execute('UPDATE events SET x = 5 WHERE x = 2')
+    sqlite3_logica.ExecuteScript(self.connection, self.script)
+    self.assertEqual(self.Total(), [(6,)])
+
+
+class IncrementalGroundTest(unittest.TestCase):
+  PROGRAM = '''
+  @Engine("sqlite");
+  @Ground(Total, incremental: true%s);
+  Total() += x :- Events(x:);
+  Test(t) :- t == Total();
+  '''
+
+  def Run(self, checksum):
+    program = universe.LogicaProgram(parse.ParseFile(
+        self.PROGRAM % (', checksum: true' if checksum else ''))['rule'])
+    program.FormattedPredicateSql('Test')
+    connection = sqlite3_logica.SqliteConnect()
+    sqlite3_logica.ExecuteScript(connection, program.execution.preamble)
+    connection.executescript(
+        'CREATE TABLE Events (x); INSERT INTO Events VALUES (1), (2);')
+    def Total():
+      sqlite3_logica.ExecuteScript(
+          connection, program.execution.table_to_export_map['Total'])
+      return connection.execute(
+          'SELECT logica_value FROM logica_test.Total').fetchall()
+    self.assertEqual(Total(), [(3,)])
+    connection.execute('INSERT INTO Events VALUES (10)')
+    self.assertEqual(Total(), [(13,)])
+    connection.execute('UPDATE Events SET x = 5 WHERE x = 2')
+    return Total()
+
+  def test_AppendedRowsAreNoticed(self):
+    # Without a version column rows updated in place are not noticed.
+    self.assertEqual(self.Run(checksum=False), [(13,)])
+
+  def test_Checksum(self):
+    self.assertEqual(self.Run(checksum=True), [(16,)])
+
+
+class ListFunctionsTest(unittest.TestCase):
+  def test_InList(self):
+    for _ in range(2):
+      self.assertTrue(sqlite3_logica.InList(2, '[1, 2, 3]'))
+      self.assertFalse(sqlite3_logica.InList(4, '[1, 2, 3]'))
+    self.assertTrue(sqlite3_logica.InList([1], '[[1], [2]]'))
+    self.assertFalse(sqlite3_logica.InList('a', '["ab"]'))
+
+  def test_ListsAreNotShared(self):
+    self.assertEqual(sqlite3_logica.ArrayConcat('[1]', '[2]'), '[1, 2]')
+    aggregation = sqlite3_logica.ArrayConcatAgg()
+    aggregation.step('[1]')
+    aggregation.step('[1]')
+    self.assertEqual(aggregation.finalize(), '[1, 1]')
+    self.assertEqual(sqlite3_logica.ParsedList('[1]'), (1,))
+    self.assertEqual(sqlite3_logica.SortList('[3, 1, 2]'), '[1, 2, 3]')
+    self.assertEqual(sqlite3_logica.Join('[1, "a"]', '-'), '1-a')
+
+
+class StreamSqlScriptTest(unittest.TestCase):
+  def Stream(self, output_format):
+    output = io.StringIO()
+    sqlite3_logica.StreamSqlScript(
+        ['CREATE TABLE t AS SELECT 1 AS x, \'a,b\' AS y '
+         'UNION ALL SELECT 2, \'c\';',
+         'SELECT * FROM t ORDER BY x'],
+        output_format, output, batch_size=1)
+    return output.getvalue()
+
+  def test_Csv(self):
+    self.assertEqual(self.Stream('csv'), 'x,y\r\n1,"a,b"\r\n2,c\r\n')
+
+  def test_Jsonl(self):
+    self.assertEqual(self.Stream('jsonl'),
+                     '{"x": 1, "y": "a,b"}\n{"x": 2, "y": "c"}\n')
+
+
+class ConnectionPoolTest(unittest.TestCase):
+  def setUp(self):
+    self.directory = tempfile.TemporaryDirectory()
+    self.pool = sqlite3_logica.ConnectionPool()
+
+  def tearDown(self):
+    self.pool.CloseAll()
+    self.directory.cleanup()
+
+  def test_ConnectionIsReused(self):
+    with self.pool.Connection() as connection:
+      connection.execute('CREATE TABLE t AS SELECT 1 AS x')
+    with self.pool.Connection() as reused:
+      self.assertIs(reused, connection)
+      self.assertEqual(reused.execute('SELECT x FROM t').fetchall(), [(1,)])
+      with self.pool.Connection() as nested:
+        self.assertIs(nested, reused)
+
+  def test_MemoryDatabaseIsShared(self):
+    def CreateTable(name):
+      with self.pool.Connection() as connection:
+        connection.execute('CREATE TABLE %s AS SELECT 1 AS x' % name)
+    threads = [threading.Thread(target=CreateTable, args=('t%d' % i,))
+               for i in range(8)]
+    for t in threads:
+      t.start()
+    for t in threads:
+      t.join()
+    with self.pool.Connection() as connection:
+      self.assertEqual(
+          connection.execute(
+              "SELECT COUNT(*) FROM sqlite_master WHERE type = 'table'"
+          ).fetchall(), [(8,)])
+
+  def test_FileConnectionsAreSeparate(self):
+    database = os.path.join(self.directory.name, 'db.sqlite')
+    with self.pool.Connection(database) as connection:
+      with self.pool.Connection(database) as other:
+        self.assertIsNot(other, connection)
+
+  def test_FileDatabase(self):
+    database = os.path.join(self.directory.name, 'db.sqlite')
+    with self.pool.Connection(database) as connection:
+      self.assertEqual(
+          connection.execute('PRAGMA journal_mode').fetchall(), [('wal',)])
+      connection.execute('CREATE TABLE t AS SELECT Fingerprint(1) AS x')
+    self.pool.CloseAll()
+    with self.pool.Connection(database) as connection:
+      self.assertEqual(connection.execute('SELECT COUNT(*) FROM t').fetchall(),
+                       [(1,)])
+
+  def test_RepeatedAttachmentKeepsData(self):
+    script = ("ATTACH DATABASE ':memory:' AS logica_test;\n"
+              'CREATE TABLE IF NOT EXISTS logica_test.t (x);\n'
+              'INSERT INTO logica_test.t VALUES (1);')
+    with self.pool.Connection() as connection:
+      for _ in range(2):
+        sqlite3_logica.ExecuteScript(connection, script)
+      self.assertEqual(
+          connection.execute('SELECT COUNT(*) FROM logica_test.t').fetchall(),
+          [(2,)])
+
+
+if __name__ == '__main__':
+  unittest.main()
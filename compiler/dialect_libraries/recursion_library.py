@@ -14,7 +14,7 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-def GetRecursionFunctor(depth):
+def GetRecursionFunctor(depth, ground_layers=False):
   """Returns functor that unfolds recursion.
 
   Example:
@@ -23,14 +23,71 @@ def GetRecursionFunctor(depth):
   P_r2 := P_recursive_head(P_recursive: P_r1);
   P_r3 := P_recursive_head(P_recursive: P_r2);
   P := P_r3();
+
+  With ground_layers each of P_r0, ..., P_r3 is annotated with @Ground, so
+  that layers are materialized one by one and execution can stop once a
+  layer equals the previous one.
   """
   result_lines = ['P_r0 := P_recursive_head(P_recursive: nil);']
   for i in range(depth):
       result_lines.append(
           'P_r{1} := P_recursive_head(P_recursive: P_r{0});'.format(i, i + 1))
   result_lines.append('P := P_r{0}();'.format(depth))
+  if ground_layers:
+    for i in range(depth + 1):
+      result_lines.append('@Ground(P_r{0});'.format(i))
   return '\n'.join(result_lines)
 
+def GetIterativeRecursionFunctor(predicate, fields, linear):
+  """Returns functor that prepares semi-naive evaluation of recursion.
+
+  Example:
+  @Ground(P_fixpoint);
+  P_fixpoint := P_recursive_head(P_recursive: nil);
+  P_fixpoint_step := P_recursive_step(P_recursive: P_fixpoint_delta);
+  P(x_0, x_1) :- P_fixpoint(x_0, x_1);
+
+  P_fixpoint is materialized from the base case and then extended in rounds
+  by P_fixpoint_step applied to the rows added by the previous round.
+  P_recursive_step consists of the rules of P_recursive_head that use
+  recursion. If the recursion is not linear the step reads all of
+  P_fixpoint_full instead.
+  """
+  arguments = ', '.join(
+      'x_%d' % f if isinstance(f, int) else '%s: x_%s' % (f, f)
+      for f in fields)
+  result_lines = [
+      '@Ground({0}_fixpoint);',
+      '{0}_fixpoint := {0}_recursive_head({0}_recursive: nil);',
+      '{0}_fixpoint_step := {0}_recursive_step({0}_recursive: {1});',
+      '{0}({2}) :- {0}_fixpoint({2});']
+  step_source = ('{0}_fixpoint_delta' if linear else
+                 '{0}_fixpoint_full').format(predicate)
+  return '\n'.join(result_lines).format(predicate, step_source, arguments)
+
+def GetRecursiveWithFunctor(predicate, fields, distinct):
+  """Returns rules of recursion computed by a recursive WITH.
+
+  Example:
+  @WithRecursive(P, base: P_with_base, step: P_with_step, table: "P_with");
+  P(x_0, x_1) distinct :- P_with_base(x_0, x_1);
+  P(x_0, x_1) distinct :- P_with_step(x_0, x_1);
+
+  P_with_base consists of the rules of P that do not use recursion and
+  P_with_step of the rules that read the table P_with built so far. The
+  rules of P only convey its type, SQL of P is the recursive WITH.
+  """
+  arguments = ', '.join(
+      'x_%d' % f if isinstance(f, int) else '%s: x_%s' % (f, f)
+      for f in fields)
+  distinct = ' distinct' if distinct else ''
+  result_lines = [
+      '@WithRecursive({0}, base: {0}_with_base, step: {0}_with_step, '
+      'table: "{0}_with");',
+      '{0}({1}){2} :- {0}_with_base({1});',
+      '{0}({1}){2} :- {0}_with_step({1});']
+  return '\n'.join(result_lines).format(predicate, arguments, distinct)
+
 def GetRenamingFunctor(member, root):
   """Renaming recursive cover member.
 
@@ -16,9 +16,8 @@
 
 """SQL dialects."""
 
-import copy
-
 if '.' not in __package__:
+  from common import rule_copy
   from compiler.dialect_libraries import bq_library
   from compiler.dialect_libraries import psql_library
   from compiler.dialect_libraries import sqlite_library
@@ -26,6 +25,7 @@ if '.' not in __package__:
   from compiler.dialect_libraries import presto_library
   from compiler.dialect_libraries import databricks_library
 else:
+  from ..common import rule_copy
   from ..compiler.dialect_libraries import bq_library
   from ..compiler.dialect_libraries import psql_library
   from ..compiler.dialect_libraries import sqlite_library
@@ -47,6 +47,10 @@ class Dialect(object):
   def PredicateLiteral(self, predicate_name):
     return "'predicate_name:%s'" % predicate_name
 
+  def IndexStatement(self, table_name, columns):
+    """Statement indexing the table, None if indexes are not supported."""
+    return None
+
 
 class BigQueryDialect(Dialect):
   """BigQuery SQL dialect."""
@@ -141,6 +145,15 @@ class SqLiteDialect(Dialect):
   def GroupBySpecBy(self):
     return 'expr'
 
+  def IndexStatement(self, table_name, columns):
+    # Index is created in the database of the table.
+    database, _, name = table_name.rpartition('.')
+    index_name = '_'.join([name] + columns + ['index'])
+    if database:
+      index_name = database + '.' + index_name
+    return 'CREATE INDEX IF NOT EXISTS %s ON %s (%s);' % (
+        index_name, name, ', '.join(columns))
+
 class PostgreSQL(Dialect):
   """PostgreSQL SQL dialect."""
 
@@ -188,6 +201,13 @@ class PostgreSQL(Dialect):
   def MaybeCascadingDeletionWord(self):
     return ' CASCADE'  # Need to cascade in PSQL.
 
+  def IndexStatement(self, table_name, columns):
+    # Index is created in the schema of the table.
+    index_name = '_'.join([table_name.rpartition('.')[2]] + columns +
+                          ['index'])
+    return 'CREATE INDEX IF NOT EXISTS %s ON %s (%s);' % (
+        index_name, table_name, ', '.join(columns))
+
 
 class Trino(Dialect):
   """Trino analytic engine dialect."""
@@ -271,7 +291,7 @@ def DecorateCombineRule(rule, var):
   # Entangling result of aggregation with a variable that comes from a list
   # unnested inside a combine expression, to make it clear that aggregation
   # must be done in the combine. 
-  rule = copy.deepcopy(rule)
+  rule = rule_copy.Copy(rule)
 
   rule['head']['record']['field_value'][0]['value'][
     'aggregation']['expression']['call'][
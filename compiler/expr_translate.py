@@ -257,6 +257,8 @@ class QL(object):
                       for e in literal['element']])
 
   def ListLiteral(self, literal, element_type_name):
+    if self.convert_to_json:
+      return '[%s]' % self.ListLiteralInternals(literal)
     suffix = ('::' + element_type_name + '[]'
               if self.dialect.Name() == 'PostgreSQL'
               else '')
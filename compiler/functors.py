@@ -35,10 +35,14 @@ import sys
 
 if '.' not in __package__:
   from common import color
+  from common import rule_copy
+  from common import rule_index
   from compiler.dialect_libraries import recursion_library
   from parser_py import parse
 else:
   from ..common import color
+  from ..common import rule_copy
+  from ..common import rule_index
   from ..compiler.dialect_libraries import recursion_library
   from ..parser_py import parse
 
@@ -68,15 +72,10 @@ class FunctorError(Exception):
           file=sys.stderr)
 
 def Walk(x, act):
-  """Walking over a dictionary of lists, modifying and/or collecting info."""
+  """Walking over dictionaries of x, modifying and/or collecting info."""
   r = set()
-  r |= set(act(x))
-  if isinstance(x, list):
-    for v in x:
-      r |= Walk(v, act)
-  if isinstance(x, dict):
-    for k in x:
-      r |= Walk(x[k], act)
+  for node in rule_index.DictNodes(x):
+    r |= set(act(node))
   return r
 
 
@@ -99,31 +98,43 @@ class Functors(object):
 
   def __init__(self, rules):
     self.rules = rules
-    self.extended_rules = copy.deepcopy(rules)
+    self.extended_rules = rule_copy.Copy(rules)
     self.rules_of = parse.DefinedPredicatesRules(rules)
     self.predicates = set(self.rules_of)
     self.direct_args_of = self.BuildDirectArgsOf()
     self.args_of = {}
+    # Maps a predicate to predicates whose cached args_of include it.
+    self.dependents_of = collections.defaultdict(set)
+    # Maps id of a rule of rules_of to the key ordering it among the rules.
+    self.rule_keys = {}
     self.creation_count = 0
     self.cached_calls = {}
+    self.iterative_recursions = {}
+    self.recursive_with_predicates = set()
+    self.fixpoint_recursions = {}
     for p in self.predicates:
       self.ArgsOf(p)
 
-  def CopyOfArgs(self):
-    """Copying args is separated for profiling."""
-    return {k: v for k, v in list(self.args_of.items())}
-
-  def UpdateStructure(self, new_predicate):
-    """Updates rules_of and args_of maps after extebded_rules update."""
-    self.rules_of = parse.DefinedPredicatesRules(self.extended_rules)
-    self.predicates = set(self.rules_of)
-    self.direct_args_of = self.BuildDirectArgsOf()
-    # Resetting args_of, to process the new predicates that were added.
-    copied_args_of = self.CopyOfArgs()
-    for predicate, args in copied_args_of.items():
-      if new_predicate in args or new_predicate == predicate:
-        del self.args_of[predicate]
-    for p in self.predicates:
+  def UpdateStructure(self, new_rules):
+    """Updates rules_of and args_of maps with rules added to extended_rules.
+
+    Only arguments of predicates that the new rules define and of the
+    predicates depending on them are recomputed.
+    """
+    changed = set()
+    for rule in new_rules:
+      name = rule['head']['predicate_name']
+      self.rules_of.setdefault(name, []).append(rule)
+      self.direct_args_of[name] = (
+          self.direct_args_of.get(name, set()) | self.RuleArgs(rule))
+      changed.add(name)
+    self.predicates |= changed
+    affected = set(changed)
+    for predicate in changed:
+      affected |= self.dependents_of.pop(predicate, set())
+    for predicate in affected:
+      self.args_of.pop(predicate, None)
+    for p in sorted(affected):
       self.ArgsOf(p)
 
   def ParseMakeInstruction(self, predicate, instruction):
@@ -150,20 +161,26 @@ class Functors(object):
     """Factored for profiling."""
     return Walk(x, act)
 
-  def BuildDirectArgsOf(self):
-    """Builds a map of direct arguments of a functor."""
+  def RuleArgs(self, rule):
+    """Predicates that the rule uses."""
     def ExtractPredicateName(x):
       if isinstance(x, dict) and 'predicate_name' in x:
         return [x['predicate_name']]
       return []
+    args = set()
+    if 'body' in rule:
+      args |= self.BuildDirectArgsOfWalk(rule['body'], ExtractPredicateName)
+    args |= self.BuildDirectArgsOfWalk(rule['head']['record'],
+                                       ExtractPredicateName)
+    return args
+
+  def BuildDirectArgsOf(self):
+    """Builds a map of direct arguments of a functor."""
     direct_args_of = {}
     for functor, rules in self.rules_of.items():
       args = set()
       for rule in rules:
-        if 'body' in rule:
-          args |= self.BuildDirectArgsOfWalk(rule['body'], ExtractPredicateName)
-        args |= self.BuildDirectArgsOfWalk(rule['head']['record'],
-                                           ExtractPredicateName)
+        args |= self.RuleArgs(rule)
       direct_args_of[functor] = args
     return direct_args_of
 
@@ -180,6 +197,8 @@ class Functors(object):
       if any(a.startswith('building_') for a in built_args):
         return (a for a in built_args if not a.startswith('building_'))
       self.args_of[functor] = built_args
+      for a in built_args:
+        self.dependents_of[a].add(functor)
 
     return self.args_of[functor]
 
@@ -213,8 +232,22 @@ class Functors(object):
 
     return result
 
+  def RuleKey(self, rule):
+    """Key ordering rules deterministically, computed once per rule.
+
+    Rules of rules_of are not modified, so the key stays valid.
+    """
+    key = self.rule_keys.get(id(rule))
+    if key is None:
+      key = str(rule)
+      self.rule_keys[id(rule)] = key
+    return key
+
   def AllRulesOf(self, functor):
-    """Returning all rules relevant to a predicate."""
+    """Returning all rules relevant to a predicate, in a stable order.
+
+    Rules are not copied, callers modifying them should copy them.
+    """
     result = []
     if functor not in self.rules_of:
       return result
@@ -225,7 +258,7 @@ class Functors(object):
                            functor)
       if f in self.rules_of:
         result.extend(self.rules_of[f])
-    return copy.deepcopy(result)
+    return sorted(result, key=self.RuleKey)
 
   def Make(self, predicate, instruction):
     """Make a new predicate according to instruction."""
@@ -234,13 +267,14 @@ class Functors(object):
   def MakeAll(self, predicate_to_instruction):
     """Making all required predicates."""
     # We needs to build them in the order of dependency.
-    needs_building = set(
-        self.ParseMakeInstruction(p, i)[0] for p, i in predicate_to_instruction)
+    parsed_instructions = [
+        (p, i, self.ParseMakeInstruction(p, i))
+        for p, i in sorted(predicate_to_instruction)]
+    needs_building = set(name for _, _, (name, _, _) in parsed_instructions)
     while needs_building:
       something_built = False
-      for (new_predicate, instruction) in sorted(predicate_to_instruction):
-        name, applicant, args_map = self.ParseMakeInstruction(new_predicate,
-                                                              instruction)
+      for (new_predicate, instruction,
+           (name, applicant, args_map)) in parsed_instructions:
         if (new_predicate not in needs_building or
             applicant in needs_building or
             (self.args_of[applicant] & needs_building) or
@@ -277,15 +311,13 @@ class Functors(object):
     """Collecting annotations of predictes."""
     predicates = set(predicates)
     result = []
-    for annotation, rules in self.rules_of.items():
-      if annotation not in ['@Limit', '@OrderBy', '@Ground',
-                            '@NoInject']:
-        continue
-      for rule in rules:
+    for annotation in ['@Limit', '@OrderBy', '@Ground', '@NoInject',
+                       '@WithRecursive']:
+      for rule in self.rules_of.get(annotation, []):
         if rule['head']['record']['field_value'][0]['value']['expression'][
             'literal']['the_predicate']['predicate_name'] in predicates:
           result.append(rule)
-    return copy.deepcopy(result)
+    return rule_copy.Copy(result)
 
   def CallKey(self, functor, args_map):
     """A string representing a call of a functor with arguments."""
@@ -307,9 +339,11 @@ class Functors(object):
     self.creation_count += 1
     rules = self.AllRulesOf(applicant)
     args = set(args_map)
-    rules = [r for r in rules
-             if ((args & self.args_of[r['head']['predicate_name']]) or
-                 r['head']['predicate_name'] == applicant)]
+    # Only rules that are kept are copied, as they are modified below.
+    rules = rule_copy.Copy(
+        [r for r in rules
+         if ((args & self.args_of[r['head']['predicate_name']]) or
+             r['head']['predicate_name'] == applicant)])
     if not rules:
       raise FunctorError(
           'Rules for %s when making %s are not found' % (applicant, name),
@@ -320,7 +354,7 @@ class Functors(object):
     rules_to_update = []
     cache_update = {}
     predicates_to_annotate = set()
-    for r in sorted(rules, key=str):
+    for r in rules:
       rule_predicate_name = r['head']['predicate_name']
       if rule_predicate_name == applicant:
         extended_args_map[rule_predicate_name] = name
@@ -362,52 +396,51 @@ class Functors(object):
       return []
     Walk(rules, ReplacePredicate)
     self.extended_rules.extend(rules)
-    self.UpdateStructure(name)
+    self.UpdateStructure(rules)
 
-  def UnfoldRecursivePredicate(self, predicate, cover, depth, rules):   
-    """Unfolds recurive predicate.""" 
+  def UnfoldRecursivePredicate(self, predicate, cover, depth, rules,
+                               iterative=False, ground_layers=False):
+    """Unfolds recurive predicate."""
     new_predicate_name = predicate + '_recursive'
     new_predicate_head_name = predicate + '_recursive_head'
 
-    def ReplaceRecursivePredicate(x):
-      if isinstance(x, dict) and 'predicate_name' in x:
-        if x['predicate_name'] == predicate:
-          x['predicate_name'] = new_predicate_name
-      return []
-    def ReplaceRecursiveHeadPredicate(x):
-      if isinstance(x, dict) and 'predicate_name' in x:
-        if x['predicate_name'] == predicate:
-          x['predicate_name'] = new_predicate_head_name
-      return []
-    def ReplacerOfCoverMember(member):
-      def Replace(x):
-        if isinstance(x, dict) and 'predicate_name' in x:
-          if x['predicate_name'] == member:
-            x['predicate_name'] = member + '_recursive_head'
-        return []
-      return Replace
+    def Rename(r, renaming):
+      for x in rule_index.NodeIndex(r).With('predicate_name'):
+        x['predicate_name'] = renaming.get(x['predicate_name'],
+                                           x['predicate_name'])
+    cover_renaming = {c: c + '_recursive_head'
+                      for c in cover - {predicate}}
+    body_renaming = {**cover_renaming, predicate: new_predicate_name}
 
     for r in rules:
       if r['head']['predicate_name'] == predicate:
         r['head']['predicate_name'] = new_predicate_head_name
-        Walk(r, ReplaceRecursivePredicate)
-        for c in cover - {predicate}:
-          Walk(r, ReplacerOfCoverMember(c))
+        Rename(r, body_renaming)
       elif r['head']['predicate_name'] in cover:
-        Walk(r, ReplaceRecursivePredicate)
-        for c in cover - {predicate}:
-          Walk(r, ReplacerOfCoverMember(c))
+        Rename(r, body_renaming)
       elif (r['head']['predicate_name'][0] == '@' and
             r['head']['predicate_name'] != '@Make'):
-        Walk(r, ReplaceRecursiveHeadPredicate)
-        for c in cover - {predicate}:
-          Walk(r, ReplacerOfCoverMember(c))        
+        # Iteratively computed predicate keeps its annotations, they apply
+        # to the predicate reading the fixpoint table.
+        if not iterative:
+          Rename(r, {**cover_renaming, predicate: new_predicate_head_name})
+        else:
+          Rename(r, cover_renaming)
       else:
         # This rule simply uses the predicate, keep the name.
         pass
 
-    lib = recursion_library.GetRecursionFunctor(depth)
-    lib = lib.replace('P', predicate)
+    if iterative:
+      fields, linear, step_rules = self.IterativeRecursionStructure(
+          predicate, cover, rules)
+      rules.extend(step_rules)
+      lib = recursion_library.GetIterativeRecursionFunctor(
+          predicate, fields, linear)
+    else:
+      if ground_layers:
+        self.CheckFixpointRecursion(predicate, rules)
+      lib = recursion_library.GetRecursionFunctor(depth, ground_layers)
+      lib = lib.replace('P', predicate)
     lib_rules = parse.ParseFile(lib)['rule']
     rules.extend(lib_rules)
     for c in cover - {predicate}:
@@ -415,13 +448,236 @@ class Functors(object):
       rename_lib_rules = parse.ParseFile(rename_lib)['rule']
       rules.extend(rename_lib_rules)
 
-  def UnfoldRecursions(self, depth_map):
-    """Unfolds all recursions."""
+  def CheckFixpointRecursion(self, predicate, rules):
+    """Checks that layers of the recursion can be compared as sets.
+
+    Layers of a distinct predicate have no repeated rows, so a layer equal
+    to the previous one is detected by counting rows of their difference.
+    """
+    head_name = predicate + '_recursive_head'
+    for r in rules:
+      if (r['head']['predicate_name'] == head_name and
+          'distinct_denoted' not in r):
+        raise FunctorError(
+            'Predicate %s can not stop on fixpoint: it must be distinct.' %
+            color.Warn(predicate), predicate)
+
+  def IterativeRecursionStructure(self, predicate, cover, rules):
+    """Checks that recursion can be evaluated iteratively and builds the step.
+
+    Iterative evaluation only adds rows to the predicate, so the predicate
+    must be distinct and must not aggregate, negate or otherwise combine
+    over the recursive predicates.
+
+    Returns:
+      A triple of the list of fields of the predicate, whether each rule
+      refers to the recursive predicates at most once, i.e. whether each
+      round may only read the rows added by the previous round, and the
+      rules of the step of the recursion. Step omits the rules that do not
+      depend on the recursion, as their rows are added at initialization.
+    """
+    head_name = predicate + '_recursive_head'
+    recursive_names = {predicate + '_recursive'} | {
+        c + '_recursive_head' for c in cover - {predicate}}
+    def Error(message):
+      raise FunctorError(
+          'Predicate %s can not be computed iteratively: %s' % (
+              color.Warn(predicate), message), predicate)
+    def Mentions(x, in_combine):
+      """Counts mentions of recursive predicates, checking combines."""
+      result = 0
+      if isinstance(x, dict):
+        if x.get('predicate_name') in recursive_names:
+          if in_combine:
+            Error('recursive predicate is used in aggregation or negation.')
+          result += 1
+        for k, v in x.items():
+          result += Mentions(v, in_combine or k == 'combine')
+      if isinstance(x, list):
+        for v in x:
+          result += Mentions(v, in_combine)
+      return result
+    def ReplaceHeadWithStep(x):
+      if isinstance(x, dict) and 'predicate_name' in x:
+        if x['predicate_name'].endswith('_recursive_head'):
+          x['predicate_name'] = (
+              x['predicate_name'][:-len('_head')] + '_step')
+      return []
+
+    fields = None
+    linear = True
+    step_rules = []
+    for r in rules:
+      name = r['head']['predicate_name']
+      if name == head_name:
+        if 'distinct_denoted' not in r:
+          Error('it must be distinct.')
+        rule_fields = [fv['field'] for fv in r['head']['record']['field_value']]
+        if any('aggregation' in fv['value']
+               for fv in r['head']['record']['field_value']):
+          Error('it must not aggregate.')
+        if 'logica_value' in rule_fields:
+          Error('it must not have a value.')
+        fields = fields or rule_fields
+      if name == head_name or name in recursive_names:
+        mentions = (Mentions(r.get('body', {}), False) +
+                    Mentions(r['head']['record'], False))
+        if mentions > 1:
+          linear = False
+        if mentions > 0:
+          step_rule = rule_copy.Copy(r)
+          Walk(step_rule, ReplaceHeadWithStep)
+          step_rules.append(step_rule)
+    return fields, linear, step_rules
+
+  def RecursiveWithStructure(self, predicate, cover, depth, rules,
+                             max_steps):
+    """Rewrites linear recursion to be computed by a recursive WITH.
+
+    Recursion is linear if each rule of the predicate refers to the
+    predicate at most once, as a conjunct of the body. Rules referring to
+    the predicate become the step of the recursion, the rest is its base.
+    Unless depth is -1, rows count the steps that derived them in the
+    logica_depth column, so that the result is the same as of the unfolded
+    recursion of that depth.
+
+    Returns whether the rules were rewritten.
+    """
+    own_rules = [r for r in rules if r['head']['predicate_name'] == predicate]
+    distinct = 'distinct_denoted' in own_rules[0]
+    aux = predicate + parse.MultiBodyAggregation.SUFFIX
+    if cover == {predicate, aux}:
+      # Rules of a distinct predicate are moved to the auxiliary predicate,
+      # the predicate makes their rows distinct.
+      if any('aggregation' in fv['value']
+             for r in own_rules for fv in r['head']['record']['field_value']):
+        return False
+      own_rules = [r for r in rules if r['head']['predicate_name'] == aux]
+    elif cover != {predicate}:
+      return False
+    def Mentions(x):
+      return [n for n in rule_index.DictNodes(x)
+              if n.get('predicate_name') == predicate]
+    def RecursiveCall(r):
+      conjuncts = r.get('body', {}).get('conjunction', {}).get('conjunct', [])
+      calls = [c['predicate'] for c in conjuncts
+               if c.get('predicate', {}).get('predicate_name') == predicate]
+      return calls[0] if calls else None
+
+    base_rules = []
+    step_rules = []
+    fields = own_rules[0]['head']['record']['field_value']
+    fields = [fv['field'] for fv in fields]
+    for r in own_rules:
+      field_values = r['head']['record']['field_value']
+      rule_fields = [fv['field'] for fv in field_values]
+      if (any('aggregation' in fv['value'] for fv in field_values) or
+          '*' in rule_fields or 'logica_depth' in rule_fields or
+          sorted(map(str, rule_fields)) != sorted(map(str, fields)) or
+          Mentions(r['head']['record'])):
+        return False
+      mentions = Mentions(r.get('body', {}))
+      if not mentions:
+        base_rules.append(r)
+      elif len(mentions) == 1 and mentions[0] is RecursiveCall(r):
+        step_rules.append(r)
+      else:
+        return False
+    if (not base_rules or not step_rules or len(step_rules) > max_steps or
+        (depth == -1 and not distinct)):
+      return False
+
+    step_depth = base_depth = None
+    if depth != -1:
+      [step_depth] = parse.ParseFile(
+          'D(logica_depth: logica_depth + 1) :- '
+          'D(logica_depth:), logica_depth < %d;' % depth)['rule']
+      [base_depth] = parse.ParseFile('D(logica_depth: 0);')['rule']
+    def Rewrite(r, name, depth_rule):
+      r = rule_copy.Copy(r)
+      r['head']['predicate_name'] = name
+      # Columns of all the terms of the WITH go in the same order.
+      field_values = sorted(r['head']['record']['field_value'],
+                            key=lambda fv: fields.index(fv['field']))
+      if depth != -1:
+        field_values.extend(
+            rule_copy.Copy(depth_rule['head']['record']['field_value']))
+      r['head']['record']['field_value'] = field_values
+      return r
+
+    new_rules = [Rewrite(r, predicate + '_with_base', base_depth)
+                 for r in base_rules]
+    for r in step_rules:
+      r = Rewrite(r, predicate + '_with_step', step_depth)
+      # Recursive SELECT may not aggregate, its rows are made distinct by
+      # UNION.
+      r.pop('distinct_denoted', None)
+      call = RecursiveCall(r)
+      call['predicate_name'] = predicate + '_with'
+      if depth != -1:
+        [depth_call, depth_condition] = rule_copy.Copy(
+            step_depth['body']['conjunction']['conjunct'])
+        call['record']['field_value'].extend(
+            depth_call['predicate']['record']['field_value'])
+        r['body']['conjunction']['conjunct'].append(depth_condition)
+      new_rules.append(r)
+    lib = recursion_library.GetRecursiveWithFunctor(predicate, fields,
+                                                    distinct)
+    rules[:] = [r for r in rules
+                if r['head']['predicate_name'] not in cover]
+    rules.extend(new_rules)
+    rules.extend(parse.ParseFile(lib)['rule'])
+    return True
+
+  def UnfoldRecursions(self, depth_map, iterative_predicates=None,
+                       recursive_with_steps=0, fixpoint_predicates=None,
+                       recursive_with_opt_in=False):
+    """Unfolds all recursions.
+
+    Predicates from iterative_predicates are not unfolded, instead they are
+    prepared for semi-naive evaluation and recorded in iterative_recursions
+    with the maximal number of rounds, -1 for rounds until the fixpoint.
+    Linear recursions with at most recursive_with_steps recursive rules are
+    computed by a recursive WITH, unless annotated with unfold: true, or,
+    if recursive_with_opt_in, only if annotated with with_recursive: true.
+    They are recorded in recursive_with_predicates.
+    Predicates from fixpoint_predicates are unfolded with grounded layers and
+    recorded in fixpoint_recursions with the depth, so that execution can
+    stop once the layers converge.
+    """
+    iterative_predicates = iterative_predicates or set()
+    fixpoint_predicates = fixpoint_predicates or set()
     should_recurse, my_cover = self.RecursiveAnalysis(depth_map)
-    new_rules = copy.deepcopy(self.rules)
+    new_rules = rule_copy.Copy(self.rules)
     for p in should_recurse:
       depth = depth_map.get(p, {}).get('1', 8)
-      self.UnfoldRecursivePredicate(p, my_cover[p], depth, new_rules)
+      iterative = p in iterative_predicates
+      ground_layers = not iterative and p in fixpoint_predicates
+      if iterative and depth < -1:
+        raise FunctorError(
+            'Depth of iterative recursion of %s must be -1, for no limit, '
+            'or a number of rounds.' % color.Warn(p), p)
+      with_recursive = (depth_map.get(p, {}).get('with_recursive')
+                        if recursive_with_opt_in else
+                        not depth_map.get(p, {}).get('unfold'))
+      if (not iterative and not ground_layers and with_recursive and
+          self.RecursiveWithStructure(p, my_cover[p], depth, new_rules,
+                                      recursive_with_steps)):
+        self.recursive_with_predicates.add(p)
+        continue
+      if not iterative and depth < 0:
+        raise FunctorError(
+            'Recursion of %s can not have unbounded depth: it needs a '
+            'distinct linear recursion computed by a recursive WITH, on '
+            'SQLite, or on PostgreSQL with with_recursive: true, or '
+            'iterative: true.' % color.Warn(p), p)
+      self.UnfoldRecursivePredicate(p, my_cover[p], depth, new_rules,
+                                    iterative=iterative,
+                                    ground_layers=ground_layers)
+      if iterative:
+        self.iterative_recursions[p] = depth
+      if ground_layers:
+        self.fixpoint_recursions[p] = depth
     return new_rules
 
   def CountSurvivingRules(self, rules):
@@ -17,15 +17,18 @@
 """Compiler of a single Logica rule to SQL."""
 
 import collections
-import copy
 import string
 import sys
 
 if '.' not in __package__:
   from common import color
+  from common import rule_copy
+  from common import rule_index
   from compiler import expr_translate
 else:
   from ..common import color
+  from ..common import rule_copy
+  from ..common import rule_index
   from ..compiler import expr_translate
 
 xrange = range
@@ -72,7 +75,7 @@ def HeadToSelect(head):
     k = field_value['field']
     v = field_value['value']
     if 'aggregation' in v:
-      select[k] = copy.deepcopy(v['aggregation']['expression'])
+      select[k] = rule_copy.Copy(v['aggregation']['expression'])
       aggregated_vars.append(k)
     else:
       assert 'expression' in v, 'Bad select value: %s' % str(v)
@@ -83,20 +86,13 @@ def HeadToSelect(head):
 
 def AllMentionedVariables(x, dive_in_combines=False):
   """Extracting all variables mentioned in an expression."""
-  r = []
-  if isinstance(x, dict) and 'variable' in x:
-    r.append(x['variable']['var_name'])
-  if isinstance(x, list):
-    for v in x:
-      r.extend(AllMentionedVariables(v, dive_in_combines))
-  if isinstance(x, dict):
-    for k in x:
-      # Variables mentioned in 'combine' expression may be resolved via tables
-      # of the 'combine' expression. So they are not to be included in the
-      # parent query.
-      if k != 'combine' or dive_in_combines:
-        r.extend(AllMentionedVariables(x[k], dive_in_combines))
-  return set(r)
+  # Variables mentioned in 'combine' expression may be resolved via tables
+  # of the 'combine' expression. So they are not to be included in the
+  # parent query.
+  skip_keys = () if dive_in_combines else ('combine',)
+  return {node['variable']['var_name']
+          for node in rule_index.DictNodes(x, skip_keys)
+          if 'variable' in node}
 
 
 def ReplaceVariable(old_var, new_expr, s):
@@ -123,6 +119,69 @@ def ReplaceVariable(old_var, new_expr, s):
         ReplaceVariable(old_var, new_expr, k)
 
 
+class VariableOccurrences(object):
+  """Index of positions of variables in a rule structure.
+
+  Position is a container, dictionary or list, with a key, where the
+  container holds the variable under the key. Substitution of a variable
+  updates the index, so it does not need to walk the whole rule.
+  """
+
+  def __init__(self, roots):
+    # Variable name to a map from position id to position.
+    self.positions = collections.defaultdict(dict)
+    # Number of replacements done, and the number when each variable was
+    # last replaced.
+    self.replacement_count = 0
+    self.replaced_at = {}
+    # Indexed containers, kept for their ids to stay unique.
+    self.containers = {}
+    for root in roots:
+      self.Add(root)
+
+  def AddPosition(self, container, key):
+    var_name = container[key]['variable']['var_name']
+    self.positions[var_name][(id(container), key)] = (container, key)
+
+  def Add(self, x):
+    """Indexes variables within x, skipping containers indexed earlier."""
+    stack = [x]
+    while stack:
+      container = stack.pop()
+      if id(container) in self.containers:
+        continue
+      self.containers[id(container)] = container
+      if isinstance(container, dict):
+        items = container.items()
+      else:
+        items = enumerate(container)
+      for k, v in items:
+        if isinstance(v, dict):
+          if 'variable' in v:
+            self.AddPosition(container, k)
+          stack.append(v)
+        elif isinstance(v, list):
+          stack.append(v)
+
+  def ChangedSince(self, var_names, replacement_count):
+    """Whether any of the variables was replaced since the count."""
+    return any(self.replaced_at.get(v, -1) >= replacement_count
+               for v in var_names)
+
+  def Replace(self, old_var, new_expr):
+    """Replaces variable old_var with new_expr, as ReplaceVariable does."""
+    self.replaced_at[old_var] = self.replacement_count
+    self.replacement_count += 1
+    for container, k in self.positions.pop(old_var, {}).values():
+      v = container[k]
+      if (isinstance(v, dict) and 'variable' in v and
+          v['variable']['var_name'] == old_var):
+        container[k] = new_expr
+        if 'variable' in new_expr:
+          self.AddPosition(container, k)
+    self.Add(new_expr)
+
+
 class NamesAllocator(object):
   """Allocator of unique names for tables and variables.
 
@@ -205,6 +264,8 @@ class RuleStructure(object):
     self.synonym_log = {}
     self.full_rule_text = None
     self.distinct_denoted = None
+    # VariableOccurrences, while variables are being elliminated.
+    self.variable_occurrences = None
 
   def SelectAsRecord(self):
     def StrIntKey(x):
@@ -293,15 +354,43 @@ class RuleStructure(object):
                                                  not u_left.startswith('x_'))))
       l.extend(self.synonym_log.get(u_left, []))
       self.synonym_log[u_right['variable']['var_name']] = l
+    if self.variable_occurrences:
+      self.variable_occurrences.Replace(u_left, u_right)
+      return
     ReplaceVariable(u_left, u_right, self.unnestings)
     ReplaceVariable(u_left, u_right, self.select)
     ReplaceVariable(u_left, u_right, self.vars_unification)
     ReplaceVariable(u_left, u_right, self.constraints)
-    
-  # TODO: Parameter unfold_recods just patches some bug. Careful review is needed.
-  def ElliminateInternalVariables(self, assert_full_ellimination=False, unfold_records=True):
+
+  def ElliminateInternalVariables(self, assert_full_ellimination=False,
+                                  unfold_records=True):
     """Elliminates internal variables via substitution."""
+    self.variable_occurrences = VariableOccurrences(
+        [self.unnestings, self.select, self.vars_unification,
+         self.constraints])
+    try:
+      self.ElliminateInternalVariablesWithIndex(assert_full_ellimination,
+                                                unfold_records)
+    finally:
+      self.variable_occurrences = None
+
+  # TODO: Parameter unfold_recods just patches some bug. Careful review is needed.
+  def ElliminateInternalVariablesWithIndex(self, assert_full_ellimination,
+                                           unfold_records):
     variables = self.InternalVariables()
+    # Substitutions do not change variables extracted from tables.
+    extracted_variables = self.ExtractedVariables()
+    occurrences = self.variable_occurrences
+    # Failed checks of unifications, with the variables that the checks
+    # depended on. Check is repeated only after one of them was replaced.
+    failed_checks = {}
+    def CheckFailedBefore(u, k, check):
+      failed = failed_checks.get((id(u), k, check))
+      return (failed is not None and failed[0] is u and failed[1] is u[k] and
+              not occurrences.ChangedSince(failed[2], failed[3]))
+    def RememberFailedCheck(u, k, check, depends_on):
+      failed_checks[(id(u), k, check)] = (
+          u, u[k], depends_on, occurrences.replacement_count)
     while True:
       done = True
       self.vars_unification = [
@@ -311,20 +400,25 @@ class RuleStructure(object):
         for k, r in [['left', 'right'], ['right', 'left']]:
           if u[k] == u[r]:
             continue
+          if not (isinstance(u[k], dict) and
+                  'variable' in u[k] and
+                  u[k]['variable']['var_name'] in variables):
+            continue
+          if CheckFailedBefore(u, k, 'variable'):
+            continue
           ur_variables = AllMentionedVariables(u[r])
           ur_variables_incl_combines = AllMentionedVariables(
               u[r], dive_in_combines=True)
-          if (isinstance(u[k], dict) and
-              'variable' in u[k] and
-              u[k]['variable']['var_name'] in variables and
-              u[k]['variable']['var_name'] not in ur_variables_incl_combines and
+          if (u[k]['variable']['var_name'] not in ur_variables_incl_combines and
               (
-                  ur_variables <= self.ExtractedVariables() or
+                  ur_variables <= extracted_variables or
                   not str(u[k]['variable']['var_name']).startswith('x_'))):
             u_left = u[k]['variable']['var_name']
             u_right = u[r]
             self.ReplaceVariableEverywhere(u_left, u_right)
             done = False
+          else:
+            RememberFailedCheck(u, k, 'variable', ur_variables_incl_combines)
         # Assignments to variables in record fields.
         if unfold_records:  # Confirm that unwraping works and make this unconditional.
           # Unwrapping goes wild sometimes. Letting it go right to left only.
@@ -332,12 +426,16 @@ class RuleStructure(object):
           for k, r in [['left', 'right'], ['right', 'left']]:
             if u[k] == u[r]:
               continue
+            if not (isinstance(u[k], dict) and 'record' in u[k]):
+              continue
+            if CheckFailedBefore(u, k, 'record'):
+              continue
             ur_variables = AllMentionedVariables(u[r])
             ur_variables_incl_combines = AllMentionedVariables(
                 u[r], dive_in_combines=True)
-            if (isinstance(u[k], dict) and
-                'record' in u[k] and
-                ur_variables <= self.ExtractedVariables()):
+            if not ur_variables <= extracted_variables:
+              RememberFailedCheck(u, k, 'record', ur_variables_incl_combines)
+            else:
               def AssignToRecord(target, source):
                 global done
                 for fv in target['record']['field_value']:
@@ -475,6 +573,37 @@ class RuleStructure(object):
           }
       })
 
+  def EqualityKeys(self):
+    """Returns (predicate, field) pairs compared for equality in constraints.
+
+    These are the columns that are looked up when the tables of the rule are
+    joined or filtered by a value.
+    """
+    def TableAndField(e):
+      if 'variable' not in e:
+        return None
+      table_field = self.inv_vars_map.get(e['variable']['var_name'])
+      if not table_field or table_field[0] not in self.tables:
+        return None
+      field = table_field[1]
+      if isinstance(field, str) and (field == '*' or
+                                     ExceptExpression.Recognize(field)):
+        return None
+      return table_field
+
+    result = []
+    for c in self.constraints:
+      if c['call']['predicate_name'] != '==':
+        continue
+      left, right = [fv['value']['expression']
+                     for fv in c['call']['record']['field_value']]
+      for a, b in [(left, right), (right, left)]:
+        a_key = TableAndField(a)
+        b_key = TableAndField(b)
+        if a_key and ('literal' in b or (b_key and b_key[0] != a_key[0])):
+          result.append((self.tables[a_key[0]], a_key[1]))
+    return result
+
   def AsSql(self, subquery_encoder=None, flag_values=None):
     """Outputing SQL representing this structure."""
     # pylint: disable=g-long-lambda
@@ -747,7 +876,7 @@ def InlinePredicateValuesRecursively(r, names_allocator, conjuncts):
       if not names_allocator.FunctionExists(r['call']['predicate_name']):
         aux_var = names_allocator.AllocateVar('inline')
         r_predicate = {}
-        r_predicate['predicate'] = copy.deepcopy(r['call'])
+        r_predicate['predicate'] = rule_copy.Copy(r['call'])
         r_predicate['predicate']['record']['field_value'].append({
             'field': 'logica_value',
             'value': {'expression': {'variable': {'var_name': aux_var}}}
@@ -830,7 +959,7 @@ def DisambiguateCombineVariables(rule, names_allocator):
 
 def ExtractRuleStructure(rule, names_allocator=None, external_vocabulary=None):
   """Extracts RuleStructure from rule."""
-  rule = copy.deepcopy(rule)
+  rule = rule_copy.Copy(rule)
   # Not disambiguating if this rule is extracting structure of the combine
   # itself, as variables of this combine were already disambiguated from
   # parent rule.
@@ -19,6 +19,7 @@
 
 import collections
 import copy
+import hashlib
 import re
 import sys
 import traceback
@@ -29,6 +30,9 @@ import json
 
 if '.' not in __package__:
   from common import color
+  from common import profiler
+  from common import rule_copy
+  from common import script_markers
   from compiler import dialects
   from compiler import expr_translate
   from compiler import functors
@@ -37,6 +41,9 @@ if '.' not in __package__:
   from type_inference.research import infer
 else:
   from ..common import color
+  from ..common import profiler
+  from ..common import rule_copy
+  from ..common import script_markers
   from ..compiler import dialects
   from ..compiler import expr_translate
   from ..compiler import functors
@@ -46,14 +53,33 @@ else:
 
 PredicateInfo = collections.namedtuple('PredicateInfo',
                                        ['embeddable'])
-Ground = collections.namedtuple('Ground',
-                                ['table_name', 'overwrite'])
+Ground = collections.namedtuple(
+    'Ground', ['table_name', 'overwrite', 'incremental', 'checksum'])
 
 xrange = range
 
 def FormatSql(s): return s + ';'
 
 
+def FingerprintTable(table_name):
+  """Table storing fingerprints of incrementally grounded tables."""
+  if '.' in table_name:
+    return table_name.rsplit('.', 1)[0] + '.logica_ground_fingerprints'
+  return 'logica_ground_fingerprints'
+
+
+# Maps library program text to its parsed rules.
+parsed_library_programs = {}
+
+
+def ParsedLibraryProgram(library_program):
+  """Parses dialect library once per process, returning a copy of rules."""
+  if library_program not in parsed_library_programs:
+    parsed_library_programs[library_program] = parse.ParseFile(
+        library_program)['rule']
+  return rule_copy.Copy(parsed_library_programs[library_program])
+
+
 class Logica(object):
   """Predicate execution accumulated data.
 
@@ -77,6 +103,15 @@ class Logica(object):
     self.with_compilation_done_for_parent = collections.defaultdict(set)
     self.dependency_edges = []
     self.data_dependency_edges = []
+    # Maps predicate and external vocabulary to SQL compiled for it and to
+    # the dependencies which compilation registered for its parent table.
+    self.predicate_sql_memo = {}
+    # Maps a predicate to its fields that rules compare for equality.
+    self.equality_keys = collections.defaultdict(list)
+    # Maps a grounded layer of a recursion to SQL checking that it equals
+    # the previous layer, layers to skip then and SQL copying it to the last
+    # layer instead of computing it.
+    self.fixpoint_layers = {}
     self.table_to_export_map = {}
     self.main_predicate_sql = None
     self.preamble = ''
@@ -131,7 +166,7 @@ class Annotations(object):
       '@Limit', '@OrderBy', '@Ground', '@Flag', '@DefineFlag',
       '@NoInject', '@Make', '@CompileAsTvf', '@With', '@NoWith',
       '@CompileAsUdf', '@ResetFlagValue', '@Dataset', '@AttachDatabase',
-      '@Engine', '@Recursive'
+      '@Engine', '@Recursive', '@DataVersion', '@Index', '@WithRecursive'
   ]
 
   def __init__(self, rules, user_flags):
@@ -300,7 +335,51 @@ class Annotations(object):
     annotation = self.annotations['@Ground'][predicate_name]
     table_name = annotation.get('1', self.Dataset() + '.' + predicate_name)
     overwrite = annotation.get('overwrite', True)
-    return Ground(table_name=table_name, overwrite=overwrite)
+    incremental = annotation.get('incremental', False)
+    checksum = annotation.get('checksum', False)
+    return Ground(table_name=table_name, overwrite=overwrite,
+                  incremental=incremental, checksum=checksum)
+
+  def DataVersion(self, predicate_name):
+    """Returns version column of a data table, if declared.
+
+    Tables with a dot in the name are annotated by a string, e.g.
+    @DataVersion("db.events", "updated_at").
+    """
+    if predicate_name not in self.annotations['@DataVersion']:
+      return None
+    annotation = self.annotations['@DataVersion'][predicate_name]
+    if '1' not in annotation:
+      AnnotationError('@DataVersion must have a single argument.',
+                      annotation)
+    return annotation['1']
+
+  def Indexes(self, predicate_name):
+    """Returns columns to index and whether to index joined columns too.
+
+    E.g. @Index(T, "a", ["b", "c"], auto: false) requests an index on column
+    a and an index on columns b, c, and no indexes chosen by the compiler.
+    """
+    if predicate_name not in self.annotations['@Index']:
+      return [], True
+    annotation = self.annotations['@Index'][predicate_name]
+    indexes = []
+    for k, v in annotation.items():
+      if k == '__rule_text':
+        continue
+      if k == 'auto':
+        if not isinstance(v, bool):
+          AnnotationError('Argument auto of @Index must be a boolean.',
+                          annotation)
+        continue
+      if not k.isdigit():
+        AnnotationError('Unknown argument of @Index: %s.' % k, annotation)
+      columns = v if isinstance(v, list) else [v]
+      if not columns or not all(isinstance(c, str) for c in columns):
+        AnnotationError('@Index takes column names or lists of column '
+                        'names.', annotation)
+      indexes.append((int(k), columns))
+    return [c for _, c in sorted(indexes)], annotation.get('auto', True)
 
   def ForceWith(self, predicate_name):
     """Return true if the predicate has been explicitly marked @With."""
@@ -357,7 +436,7 @@ class Annotations(object):
     for annotation_name in self.annotations:
       if annotation_name in {'@Limit', '@OrderBy',
                              '@NoInject', '@CompileAsTvf', '@With', '@NoWith',
-                             '@CompileAsUdf'}:
+                             '@CompileAsUdf', '@Index'}:
         for annotated_predicate in self.annotations[annotation_name]:
           if annotated_predicate not in all_predicates:
             rule_text = self.annotations[annotation_name][annotated_predicate][
@@ -518,8 +597,8 @@ class LogicaProgram(object):
     extended_rules = self.RunMakes(rules)  # Populates self.functors.
 
     # Extending rules with the library of the dialect.
-    library_rules = parse.ParseFile(
-        dialects.Get(self.annotations.Engine()).LibraryProgram())['rule']
+    library_rules = ParsedLibraryProgram(
+        dialects.Get(self.annotations.Engine()).LibraryProgram())
     extended_rules.extend(library_rules)
 
     for rule in extended_rules:
@@ -561,8 +640,34 @@ class LogicaProgram(object):
   
   def UnfoldRecursion(self, rules):
     annotations = Annotations(rules, {})
+    depth_map = annotations.annotations.get('@Recursive', {})
+    iterative_predicates = set()
+    fixpoint_predicates = set()
+    if annotations.Engine() in ['sqlite', 'psql']:
+      iterative_predicates = {p for p, a in depth_map.items()
+                              if a.get('iterative')}
+      fixpoint_predicates = {p for p, a in depth_map.items()
+                             if a.get('stop_on_fixpoint')}
+    # Number of recursive SELECTs a recursive WITH may have.
+    recursive_with_steps = {'sqlite': sys.maxsize, 'psql': 1}.get(
+        annotations.Engine(), 0)
     f = functors.Functors(rules)
-    return f.UnfoldRecursions(annotations.annotations.get('@Recursive', {}))
+    with profiler.Phase('UnfoldRecursions'):
+      # PostgreSQL requires the terms of a recursive WITH to have the same
+      # column types, which unfolded recursion does not, so recursive WITH
+      # is requested by with_recursive: true there.
+      rules = f.UnfoldRecursions(
+          depth_map, iterative_predicates, recursive_with_steps,
+          fixpoint_predicates,
+          recursive_with_opt_in=(annotations.Engine() == 'psql'))
+    # Maps iteratively computed predicate to the maximal number of rounds.
+    self.iterative_recursions = f.iterative_recursions
+    # Maps predicate with grounded layers to its depth.
+    self.fixpoint_recursions = f.fixpoint_recursions
+    return rules
+
+  def IterativelyComputedTables(self):
+    return {p + '_fixpoint' for p in self.iterative_recursions}
 
   def BuildUdfs(self):
     """Build UDF definitions."""
@@ -592,11 +697,12 @@ class LogicaProgram(object):
       TypeInferenceError if there are any type errors.
     """
     rules = [r for _, r in self.rules]
-    typing_engine = infer.TypesInferenceEngine(rules)
-    typing_engine.InferTypes()
-    self.typing_engine = typing_engine
-    type_error_checker = infer.TypeErrorChecker(rules)
-    type_error_checker.CheckForError(mode='raise')
+    with profiler.Phase('TypeInference'):
+      typing_engine = infer.TypesInferenceEngine(rules, infer.process_cache)
+      typing_engine.InferTypes()
+      self.typing_engine = typing_engine
+      type_error_checker = infer.TypeErrorChecker(rules)
+      type_error_checker.CheckForError(mode='raise')
     self.predicate_signatures = typing_engine.predicate_signature
     self.required_type_definitions.update(typing_engine.collector.definitions)
     return typing_engine.typing_preamble
@@ -606,7 +712,9 @@ class LogicaProgram(object):
     if '@Make' not in self.annotations.annotations:
       return rules
     self.functors = functors.Functors(rules)
-    self.functors.MakeAll(list(self.annotations.annotations['@Make'].items()))
+    with profiler.Phase('MakeAll'):
+      self.functors.MakeAll(
+          list(self.annotations.annotations['@Make'].items()))
     return self.functors.extended_rules
 
   @classmethod
@@ -641,7 +749,45 @@ class LogicaProgram(object):
         yield r
 
   def PredicateSql(self, name, allocator=None, external_vocabulary=None):
-    """Producing SQL for a predicate."""
+    """Producing SQL for a predicate, reusing SQL compiled earlier.
+
+    When SQL is reused, the dependencies that its compilation registered for
+    the parent table are registered for the current parent.
+    """
+    execution = self.execution
+    if execution is None or execution.compiling_udf:
+      # Functions are compiled repeatedly until their definitions settle.
+      return self.CompilePredicateSql(name, allocator, external_vocabulary)
+    key = (name, repr(external_vocabulary))
+    parent = execution.workflow_predicates_stack[-1]
+    if key not in execution.predicate_sql_memo:
+      num_edges = len(execution.dependency_edges)
+      num_data_edges = len(execution.data_dependency_edges)
+      with_dependencies = list(execution.table_to_with_dependencies[parent])
+      sql = self.CompilePredicateSql(name, allocator, external_vocabulary)
+      execution.predicate_sql_memo[key] = (
+          sql,
+          [e for e, p in execution.dependency_edges[num_edges:]
+           if p == parent],
+          [e for e, p in execution.data_dependency_edges[num_data_edges:]
+           if p == parent],
+          [t for t in execution.table_to_with_dependencies[parent]
+           if t not in with_dependencies])
+      return sql
+    sql, edges, data_edges, withs = execution.predicate_sql_memo[key]
+    execution.dependency_edges.extend((e, parent) for e in edges)
+    execution.data_dependency_edges.extend((e, parent) for e in data_edges)
+    for t in withs:
+      if t not in execution.table_to_with_dependencies[parent]:
+        execution.table_to_with_dependencies[parent].append(t)
+      execution.with_compilation_done_for_parent[parent].add(t)
+    return sql
+
+  def CompilePredicateSql(self, name, allocator=None,
+                          external_vocabulary=None):
+    """Compiling SQL for a predicate."""
+    if name in self.annotations.annotations['@WithRecursive']:
+      return self.RecursiveWithSql(name, allocator, external_vocabulary)
     # Load proto if necessary.
     rules = list(self.GetPredicateRules(name))
     if len(rules) == 1:
@@ -844,6 +990,9 @@ class LogicaProgram(object):
         'Logica internal error: unexpected workflow stack: %s' %
         self.execution.workflow_predicates_stack)
 
+    self.AddIndexStatements()
+    self.AddFixpointLayers()
+
     # Wrap query in with
     with_signature = self.GenerateWithClauses(name)
     if with_signature:
@@ -886,6 +1035,280 @@ class LogicaProgram(object):
     else:
       return formatted_sql
 
+  def IndexStatements(self, table):
+    """Statements indexing the grounded table.
+
+    Unless disabled by @Index, columns that rules join or filter the table
+    by are indexed.
+    """
+    ground = self.annotations.Ground(table)
+    indexes, auto = self.annotations.Indexes(table)
+    if auto:
+      for field in self.execution.equality_keys[table]:
+        column = rule_translate.LogicaFieldToSqlField(field)
+        if [column] not in indexes:
+          indexes.append([column])
+    statements = [self.execution.dialect.IndexStatement(ground.table_name, c)
+                  for c in indexes]
+    if None in statements:
+      if self.annotations.Indexes(table)[0]:
+        AnnotationError(
+            '@Index is not supported by %s engine.' % self.annotations.Engine(),
+            self.annotations.annotations['@Index'][table])
+      return []
+    return statements
+
+  def AddIndexStatements(self):
+    """Appends index statements to exports of grounded tables."""
+    execution = self.execution
+    for table, export in list(execution.table_to_export_map.items()):
+      statements = self.IndexStatements(table)
+      if not statements:
+        continue
+      indexed_export = '\n'.join([export] + statements)
+      execution.table_to_export_map[table] = indexed_export
+      for statements_list in [execution.export_statements,
+                              execution.defines_and_exports]:
+        for i, statement in enumerate(statements_list):
+          if statement is export:
+            statements_list[i] = indexed_export
+
+  def AddFixpointLayers(self):
+    """Records how to stop computing layers of recursions at fixpoint.
+
+    Layer P_rK is compared with P_rK-1 once it is built. If they are equal
+    the rest of the layers are equal too, so they are skipped and P, which
+    is the last layer, is copied from P_rK. When P is the main predicate its
+    query is the step after the layer P_rD-1, so P_rD-1 is copied instead.
+    """
+    execution = self.execution
+    drop = 'DROP TABLE IF EXISTS %s' + (
+        execution.dialect.MaybeCascadingDeletionWord() + ';')
+    for predicate, depth in self.fixpoint_recursions.items():
+      is_main = predicate == execution.main_predicate
+      if predicate not in execution.table_to_export_map and not is_main:
+        continue
+      last = '%s_r%d' % (predicate, depth - 1) if is_main else predicate
+      last_table = self.annotations.Ground(last).table_name
+      for k in range(1, depth - 1 if is_main else depth):
+        layer = '%s_r%d' % (predicate, k)
+        table = self.annotations.Ground(layer).table_name
+        previous = self.annotations.Ground(
+            '%s_r%d' % (predicate, k - 1)).table_name
+        check_sql = (
+            'SELECT CASE WHEN (SELECT COUNT(*) FROM {table}) = '
+            '(SELECT COUNT(*) FROM {previous}) AND NOT EXISTS '
+            '(SELECT * FROM {table} EXCEPT SELECT * FROM {previous}) '
+            'THEN 1 ELSE 0 END AS logica_converged').format(
+                table=table, previous=previous)
+        copy_sql = '\n'.join(
+            [drop % last_table,
+             'CREATE TABLE %s AS SELECT * FROM %s;' % (last_table, table)] +
+            self.IndexStatements(last))
+        execution.fixpoint_layers[layer] = {
+            'check_sql': check_sql,
+            'skip': ['%s_r%d' % (predicate, i) for i in range(k + 1, depth)],
+            'last': predicate,
+            'copy_sql': copy_sql}
+
+  def RecursiveWithSql(self, name, allocator, external_vocabulary):
+    """Recursive WITH computing a linear recursion.
+
+    Base rules of the recursion give the initial rows, then each step rule
+    derives rows from the rows derived before, until no new rows appear.
+    """
+    annotation = self.annotations.annotations['@WithRecursive'][name]
+    base = annotation['base']['predicate_name']
+    step = annotation['step']['predicate_name']
+    table = annotation['table']
+    base_rule = next(self.GetPredicateRules(base))
+    columns = [rule_translate.LogicaFieldToSqlField(fv['field'])
+               for fv in base_rule['head']['record']['field_value']]
+    distinct = 'distinct_denoted' in next(self.GetPredicateRules(name))
+    self.table_aliases[table] = table
+    terms = [self.PredicateSql(base, allocator, external_vocabulary)]
+    for rule in self.GetPredicateRules(step):
+      sql = self.SingleRuleSql(rule, allocator, external_vocabulary)
+      if not sql.startswith('/* nil */'):
+        terms.append(sql)
+    union = '\nUNION\n' if distinct else '\nUNION ALL\n'
+    return (
+        'SELECT * FROM (\n'
+        'WITH RECURSIVE {table}({columns}) AS (\n{terms}\n)\n'
+        'SELECT {distinct}{output_columns} FROM {table}\n'
+        ') AS {table}_result{order_by}{limit}').format(
+            table=table,
+            columns=', '.join(columns),
+            terms=Indent2(union.join(terms)),
+            distinct='DISTINCT ' if distinct else '',
+            output_columns=', '.join(c for c in columns
+                                     if c != 'logica_depth'),
+            order_by=self.annotations.OrderByClause(name),
+            limit=self.annotations.LimitClause(name))
+
+  def IterativeRecursionSql(self, name, ground, allocator,
+                            external_vocabulary):
+    """Semi-naive evaluation script of a fixpoint table of a recursion.
+
+    The table is initialized with the base case of the recursion. Then each
+    round derives rows from the rows that were added by the previous round,
+    which are kept in the delta table. Rounds stop once the delta is empty,
+    or when the depth of the recursion is reached, unless it is -1.
+    On SQLite the loop is run by the runner, based on the header of the
+    script, on PostgreSQL it is a PL/pgSQL loop.
+    """
+    predicate = name[:-len('_fixpoint')]
+    rounds = self.iterative_recursions[predicate]
+    table = ground.table_name
+    delta = table + '_delta'
+    new_delta = table + '_new_delta'
+    self.table_aliases[name + '_delta'] = delta
+    self.table_aliases[name + '_full'] = table
+    def CompiledSql(p):
+      sql = self.PredicateSql(p, allocator, external_vocabulary)
+      with_signature = self.GenerateWithClauses(name)
+      if with_signature:
+        sql = '{}\n{}'.format(with_signature, sql)
+      return sql
+    init_sql = CompiledSql(name)
+    step_sql = CompiledSql(name + '_step')
+    drop = 'DROP TABLE IF EXISTS %s' + (
+        self.execution.dialect.MaybeCascadingDeletionWord() + ';')
+    init_statements = [
+        drop % table,
+        'CREATE TABLE {table} AS {init_sql}'.format(
+            table=table, init_sql=FormatSql(init_sql)),
+        drop % delta,
+        'CREATE TABLE %s AS SELECT * FROM %s;' % (delta, table),
+        drop % new_delta,
+        'CREATE TABLE %s AS SELECT * FROM %s LIMIT 0;' % (new_delta, table)]
+    round_statements = [
+        'DELETE FROM %s;' % new_delta,
+        'INSERT INTO {new_delta} SELECT * FROM (\n{step_sql}\n) '
+        'AS logica_step EXCEPT SELECT * FROM {table};'.format(
+            new_delta=new_delta, step_sql=Indent2(step_sql), table=table),
+        'INSERT INTO %s SELECT * FROM %s;' % (table, new_delta),
+        'DELETE FROM %s;' % delta,
+        'INSERT INTO %s SELECT * FROM %s;' % (delta, new_delta)]
+    finish_statements = [drop % new_delta, drop % delta]
+    if self.annotations.Engine() == 'sqlite':
+      header = json.dumps({'delta': delta,
+                           'rounds': rounds,
+                           'round': '\n'.join(round_statements),
+                           'finish': '\n'.join(finish_statements)})
+      return '\n'.join([script_markers.ITERATIVE_RECURSION_MARKER + header] +
+                       init_statements)
+    loop = ('FOR logica_round IN 1..%d LOOP' % rounds if rounds >= 0 else
+            'LOOP')
+    return '\n'.join(
+        init_statements +
+        ['DO $logica$',
+         'BEGIN',
+         '  %s' % loop,
+         '    EXIT WHEN NOT EXISTS (SELECT 1 FROM %s);' % delta] +
+        [Indent2(Indent2(s)) for s in round_statements] +
+        ['  END LOOP;',
+         'END $logica$;'] +
+        finish_statements)
+
+  def UpstreamTables(self, table):
+    """Returns tables that the grounded table reads.
+
+    Non-incremental grounded tables are rebuilt on each run, so their inputs
+    are included as well.
+    """
+    edges = (self.execution.dependency_edges +
+             self.execution.data_dependency_edges)
+    result = []
+    targets = [table]
+    while targets:
+      target = targets.pop(0)
+      for source, edge_target in edges:
+        if edge_target != target or source in result or source == table:
+          continue
+        result.append(source)
+        ground = self.annotations.Ground(source)
+        if ground and not ground.incremental:
+          targets.append(source)
+    return result
+
+  def IncrementalGroundSql(self, table, ground, export_statement):
+    """Wraps export of a grounded table to skip it if nothing changed.
+
+    Fingerprint of the table consists of a hash of its SQL and of the state
+    of the upstream tables. State of a data table is its row count and the
+    maximum of the column declared by @DataVersion, or on SQLite of its
+    rowid, which grows as rows are appended. Rows updated in place are
+    noticed via a @DataVersion column, e.g. an updated_at timestamp, or on
+    SQLite with checksum: true, which makes the runner hash all rows of data
+    tables without @DataVersion. State of an incrementally grounded table is
+    its own fingerprint. Fingerprints are stored in logica_ground_fingerprints
+    table next to the grounded table.
+    """
+    engine = self.annotations.Engine()
+    if engine not in ['sqlite', 'psql']:
+      raise rule_translate.RuleCompileException(
+          'Incremental @Ground is only supported for SQLite and PostgreSQL.',
+          self.annotations.annotations['@Ground'][table]['__rule_text'])
+    if ground.checksum and engine != 'sqlite':
+      raise rule_translate.RuleCompileException(
+          'Checksum of upstream tables is only supported for SQLite.',
+          self.annotations.annotations['@Ground'][table]['__rule_text'])
+    parts = ["'%s'" % hashlib.sha256(export_statement.encode()).hexdigest()]
+    checksum_tables = []
+    for source in self.UpstreamTables(table):
+      source_ground = self.annotations.Ground(source)
+      if source_ground and source_ground.incremental:
+        parts.append(
+            "COALESCE((SELECT fingerprint FROM {0} "
+            "WHERE table_name = '{1}'), '')".format(
+                FingerprintTable(source_ground.table_name),
+                source_ground.table_name))
+        continue
+      if source_ground:
+        source_table = source_ground.table_name
+      else:
+        source_table = SubqueryTranslator.UnquoteParenthesised(source)
+      version = self.annotations.DataVersion(source)
+      if not version and not source_ground:
+        if ground.checksum:
+          checksum_tables.append(source_table)
+        if engine == 'sqlite' and re.fullmatch(r'[\w.]+', source_table):
+          version = 'rowid'
+      version_sql = (
+          "COALESCE(CAST(MAX(%s) AS TEXT), '')" % version if version else "''")
+      parts.append(
+          "(SELECT CAST(COUNT(*) AS TEXT) || ':' || {0} "
+          "FROM {1} AS logica_upstream)".format(version_sql, source_table))
+    fingerprint = " || '/' || ".join(parts)
+    fingerprint_table = FingerprintTable(ground.table_name)
+    if engine == 'sqlite':
+      header = json.dumps({'table': ground.table_name,
+                           'fingerprint_table': fingerprint_table,
+                           'fingerprint': fingerprint,
+                           'checksum_tables': checksum_tables})
+      return (script_markers.INCREMENTAL_GROUND_MARKER + header + '\n' +
+              export_statement)
+    return '\n'.join([
+        'CREATE TABLE IF NOT EXISTS %s (' % fingerprint_table,
+        '  table_name TEXT PRIMARY KEY, fingerprint TEXT);',
+        'DO $logica$',
+        'DECLARE logica_fingerprint TEXT;',
+        'BEGIN',
+        '  SELECT %s INTO logica_fingerprint;' % fingerprint,
+        "  IF to_regclass('{0}') IS NULL OR NOT EXISTS (".format(
+            ground.table_name),
+        '      SELECT 1 FROM %s' % fingerprint_table,
+        "      WHERE table_name = '%s' AND" % ground.table_name,
+        '            fingerprint = logica_fingerprint) THEN',
+        export_statement,
+        '    INSERT INTO %s VALUES (\'%s\', logica_fingerprint)' % (
+            fingerprint_table, ground.table_name),
+        '    ON CONFLICT (table_name) DO UPDATE',
+        '    SET fingerprint = EXCLUDED.fingerprint;',
+        '  END IF;',
+        'END $logica$;'])
+
   def UseFlagsAsParameters(self, sql):
     """Running flag substitution in a loop to the fixed point."""
     # We do it in a loop to deal with flags that refer to other flags.
@@ -996,13 +1419,22 @@ class LogicaProgram(object):
     # TODO(2023 July): Was this always redundant?
     # s.ElliminateInternalVariables(assert_full_ellimination=False)
 
-    self.RunInjections(s, allocator)
-    s.ElliminateInternalVariables(assert_full_ellimination=True)
+    predicate = s.this_predicate_name
+    with profiler.Phase('RunInjections', predicate):
+      self.RunInjections(s, allocator)
+    with profiler.Phase('ElliminateInternalVariables', predicate):
+      s.ElliminateInternalVariables(assert_full_ellimination=True)
     s.UnificationsToConstraints()
-    type_inference = infer.TypeInferenceForStructure(s, self.predicate_signatures)
-    type_inference.PerformInference()
-    error_checker = infer.TypeErrorChecker([type_inference.quazy_rule])
-    error_checker.CheckForError('raise')
+    if self.execution:
+      for table, field in s.EqualityKeys():
+        if field not in self.execution.equality_keys[table]:
+          self.execution.equality_keys[table].append(field)
+    with profiler.Phase('TypeInference', predicate):
+      type_inference = infer.TypeInferenceForStructure(
+          s, self.predicate_signatures)
+      type_inference.PerformInference()
+      error_checker = infer.TypeErrorChecker([type_inference.quazy_rule])
+      error_checker.CheckForError('raise')
     # New types may arrive here when we have an injetible predicate with variables
     # which specific record type depends on the inputs. 
     self.required_type_definitions.update(type_inference.collector.definitions)
@@ -1021,7 +1453,9 @@ class LogicaProgram(object):
         return '/* nil */ SELECT 42'
 
     try:
-      sql = s.AsSql(self.MakeSubqueryTranslator(allocator), self.flag_values)
+      with profiler.Phase('AsSql', predicate):
+        sql = s.AsSql(self.MakeSubqueryTranslator(allocator),
+                      self.flag_values)
     except RuntimeError as runtime_error:
       if (str(runtime_error).startswith('maximum recursion')):
         raise rule_translate.RuleCompileException(
@@ -1075,7 +1509,15 @@ class SubqueryTranslator(object):
     define_statement = '-- Interacting with table %s' % table_name
     self.execution.AddDefine(define_statement)
     export_statement = None
-    if table in self.program.defined_predicates:
+    if table in self.program.IterativelyComputedTables():
+      self.execution.workflow_predicates_stack.append(table)
+      export_statement = self.program.IterativeRecursionSql(
+          table, ground, self.allocator, external_vocabulary)
+      self.execution.workflow_predicates_stack.pop()
+      export_statement = self.program.UseFlagsAsParameters(export_statement)
+      self.execution.table_to_export_map[table] = export_statement
+      self.execution.export_statements.append(export_statement)
+    elif table in self.program.defined_predicates:
       self.execution.workflow_predicates_stack.append(table)
       dependency_sql = self.program.PredicateSql(
           table, self.allocator, external_vocabulary)
@@ -1096,6 +1538,9 @@ class SubqueryTranslator(object):
           'CREATE TABLE {name} AS {dependency_sql}'.format(
               name=ground.table_name,
               dependency_sql=FormatSql(dependency_sql)))
+      if ground.incremental:
+        export_statement = self.program.IncrementalGroundSql(
+            table, ground, export_statement)
 
       export_statement = self.program.UseFlagsAsParameters(export_statement)
       # It's cheap to store a string multiple times in Python, as it's stored
@@ -86,6 +86,11 @@ def RunAll(test_presto=False, test_trino=False):
   RunTest("sqlite_recursion")
   RunTest("sqlite_rec_depth")
   RunTest("sqlite_rec_functor")
+  RunTest("sqlite_rec_iterative_test")
+  RunTest("sqlite_rec_fixpoint_test")
+  RunTest("sqlite_incremental_ground_test")
+  RunTest("sqlite_index_test")
+  RunTest("sqlite_recursive_with_test")
   RunTest("sqlite_pagerank")
   RunTest("sqlite_composite_test")
   RunTest("sqlite_reachability")
@@ -104,6 +109,7 @@ def RunAll(test_presto=False, test_trino=False):
   RunTest("psql_structs_ground_test")
   RunTest("psql_simple_structs_test")
   RunTest("psql_recursion_test")
+  RunTest("psql_recursive_with_test")
   RunTest("psql_test")
   RunTest("psql_arg_min_test")
   RunTest("psql_arg_min_max_k_test")
@@ -32,16 +32,24 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
+import csv
 import getopt
+import io
+import itertools
 import json
 import os
 import subprocess
 import sys
+import threading
 
 # We are doing this 'if' to allow usage of the code as package and as a
 # script.
 if __name__ == '__main__' and not __package__:
   from common import color
+  from common import profiler
+  from common import program_cache
+  from common import psql_logica
+  from common import sqlite3_ingest
   from common import sqlite3_logica
   from compiler import functors
   from compiler import rule_translate
@@ -51,6 +59,10 @@ if __name__ == '__main__' and not __package__:
   from type_inference import type_retrieval_service_discovery
 else:
   from .common import color
+  from .common import profiler
+  from .common import program_cache
+  from .common import psql_logica
+  from .common import sqlite3_ingest
   from .common import sqlite3_logica
   from .compiler import functors
   from .compiler import rule_translate
@@ -118,6 +130,150 @@ def GetTrinoParameters(a):
   return boolean_params + params
 
 
+def CompilePredicate(parsed_rules, predicate, user_flags):
+  """Compiles predicate, returning SQL and the settings to run it."""
+  logic_program = universe.LogicaProgram(parsed_rules, user_flags=user_flags)
+  formatted_sql = logic_program.FormattedPredicateSql(predicate)
+  engine = logic_program.annotations.Engine()
+  return {
+      'formatted_sql': formatted_sql,
+      'preamble': logic_program.execution.preamble,
+      'defines_and_exports': logic_program.execution.defines_and_exports,
+      'main_predicate_sql': logic_program.execution.main_predicate_sql,
+      'udf_definitions': logic_program.execution.NeededUdfDefinitions(),
+      'engine': engine,
+      'engine_settings': logic_program.annotations.annotations[
+          '@Engine'].get(engine, {})
+  }
+
+
+def EngineCommand(compiled, output_format):
+  """Command running SQL from stdin with 'pretty' or 'csv' output."""
+  # We should split and move this logic to dialects.
+  engine = compiled['engine']
+  csv_output = output_format == 'csv'
+  if engine == 'bigquery':
+    return ['bq', 'query',
+            '--use_legacy_sql=false',
+            '--format=%s' % output_format]
+  if engine == 'psql':
+    return ['psql', '--quiet'] + (['--csv'] if csv_output else [])
+  if engine == 'trino':
+    a = compiled['engine_settings']
+    params = GetTrinoParameters(a)
+    return (['trino'] + params +
+            (['--output-format=CSV_HEADER_UNQUOTED']
+             if csv_output else
+             ['--output-format=ALIGNED']))
+  if engine == 'presto':
+    a = compiled['engine_settings']
+    catalog = a.get('catalog', 'memory')
+    server = a.get('server', 'localhost:8080')
+    return (['presto',
+             '--catalog=%s' % catalog,
+             '--server=%s' % server,
+             '--file=/dev/stdin'] +
+            (['--output-format=CSV_HEADER_UNQUOTED']
+             if csv_output else
+             ['--output-format=ALIGNED']))
+  assert False, 'Unknown engine: %s' % engine
+
+
+def StreamEngineOutput(compiled, output_format):
+  """Runs predicate via engine command, streaming 'csv' or 'jsonl' rows.
+
+  CSV output of the command goes directly to stdout. For JSONL the CSV is
+  read from the pipe and converted in batches, so values are strings as
+  the engine prints them in CSV, PostgreSQL is run by StreamPsqlJsonl
+  instead. Exits with the status of the command if it failed.
+  """
+  if compiled['engine'] == 'psql' and output_format == 'jsonl':
+    StreamPsqlJsonl(compiled)
+    return
+  sql = compiled['formatted_sql'].encode()
+  command = EngineCommand(compiled, 'csv')
+  sys.stdout.flush()
+  if output_format == 'csv':
+    p = subprocess.Popen(command, stdin=subprocess.PIPE)
+    p.communicate(sql)
+  else:
+    p = subprocess.Popen(command, stdin=subprocess.PIPE,
+                         stdout=subprocess.PIPE)
+    def WriteInput():
+      # Writing from a thread, so that the output pipe doesn't fill up while
+      # the engine is waiting for the rest of the input.
+      p.stdin.write(sql)
+      p.stdin.close()
+    input_writer = threading.Thread(target=WriteInput)
+    input_writer.start()
+    rows = csv.reader(io.TextIOWrapper(p.stdout, newline=''))
+    header = next(rows, None)
+    if header is not None:
+      write_rows = sqlite3_logica.RowsWriter(header, 'jsonl', sys.stdout)
+      while True:
+        batch = list(itertools.islice(rows, sqlite3_logica.STREAM_BATCH_SIZE))
+        if not batch:
+          break
+        write_rows(batch)
+    input_writer.join()
+    p.wait()
+  if p.returncode:
+    sys.exit(p.returncode)
+
+
+def StreamPsqlJsonl(compiled):
+  """Runs predicate on PostgreSQL, streaming rows as JSON objects.
+
+  Rows are read with psycopg2 in batches, so that numbers, nulls, arrays
+  and records keep their types, as in SQLite output. Connection is
+  configured by PG* environment variables, as for psql command.
+  """
+  import psycopg2
+  connection = psycopg2.connect('')
+  connection.autocommit = True
+  try:
+    psql_logica.PostgresExecute(
+        '\n\n'.join([compiled['preamble']] + compiled['udf_definitions'] +
+                     compiled['defines_and_exports']), connection)
+    stream = psql_logica.ResultStream(
+        psql_logica.PostgresQuery(compiled['main_predicate_sql'], connection),
+        sqlite3_logica.STREAM_BATCH_SIZE)
+    write_rows = sqlite3_logica.RowsWriter(stream.header, 'jsonl', sys.stdout)
+    for columns in stream.ColumnBatches():
+      write_rows(zip(*columns))
+  finally:
+    connection.close()
+
+
+def Ingest(parsed_rules, predicate, argv):
+  """Loads a data file into the table of the predicate."""
+  if not argv:
+    print('Data file to ingest is required.', file=sys.stderr)
+    sys.exit(1)
+  path = argv[0]
+  index_prefix = '--index='
+  index_columns = [c for a in argv[1:] if a.startswith(index_prefix)
+                   for c in a[len(index_prefix):].split(',') if c] or None
+  user_flags = ReadUserFlags(
+      parsed_rules, [a for a in argv[1:] if not a.startswith(index_prefix)])
+  try:
+    logic_program = universe.LogicaProgram(parsed_rules,
+                                           user_flags=user_flags)
+    num_rows = sqlite3_ingest.IngestPredicate(
+        logic_program, predicate, path, index_columns=index_columns)
+  except rule_translate.RuleCompileException as rule_compilation_exception:
+    rule_compilation_exception.ShowMessage()
+    sys.exit(1)
+  except sqlite3_ingest.IngestError as ingest_error:
+    print(color.Format('[ {error}Error{end} ] {msg}',
+                       {'msg': str(ingest_error)}), file=sys.stderr)
+    sys.exit(1)
+  print('Loaded %d rows into %s.' % (
+      num_rows, logic_program.annotations.Ground(predicate).table_name),
+        file=sys.stderr)
+  return 0
+
+
 def main(argv):
   if len(argv) <= 1 or argv[1] == 'help':
     print('Usage:')
@@ -126,6 +282,23 @@ def main(argv):
     print('    print: prints the StandardSQL query for the predicate.')
     print('    run: runs the StandardSQL query on BigQuery with pretty output.')
     print('    run_to_csv: runs the query on BigQuery with csv output.')
+    print('    run_to_jsonl: runs the query with output of a JSON object per '
+          'row.')
+    print('    profile: compiles the predicate, printing JSON report of time '
+          'spent in compilation phases and of the change of the number of '
+          'live memory blocks, which counts only blocks a phase kept, not '
+          'all it allocated. With --trace_allocations the report also has '
+          'the peak bytes each phase allocated, traced by tracemalloc.')
+    print('')
+    print('  logica <l file> ingest <predicate name> <data file> '
+          '[--index=<columns>] [flags]')
+    print('    Loads CSV, JSONL or Parquet file into the SQLite table of the '
+          '@Ground predicate, indexing given comma separated columns or '
+          'columns of its @Index annotation.')
+    print('')
+    print('  logica serve [socket path]')
+    print('    Starts a server running commands sent by '
+          'tools/logica_client.py.')
 
     print('')
     print('')
@@ -134,8 +307,19 @@ def main(argv):
           'GoodIdea(snack: "carrots")\'')
     return 1
 
+  if argv[1] == 'serve':
+    if __name__ == '__main__' and not __package__:
+      from tools import logica_server
+    else:
+      from .tools import logica_server
+    # Parsed programs and compiled predicates are kept in memory.
+    program_cache.process_cache = program_cache.MemoryProgramCache(
+        program_cache.DEFAULT_SIZE_MB * 1024 * 1024)
+    infer.process_cache = infer.InferenceCache()
+    return logica_server.Serve(main, argv[2] if len(argv) > 2 else None)
+
   if len(argv) == 3 and argv[2] in ['parse', 'infer_types', 'show_signatures']:
-    pass  # compile needs just 2 actual arguments.
+    predicates = None  # compile needs just 2 actual arguments.
   else:
     if len(argv) < 4:
       print('Not enough arguments. Run \'logica help\' for help.',
@@ -150,8 +334,9 @@ def main(argv):
 
   command = argv[2]
 
-  commands = ['parse', 'print', 'run', 'run_to_csv', 'run_in_terminal',
-              'infer_types', 'show_signatures', 'build_schema']
+  commands = ['parse', 'print', 'run', 'run_to_csv', 'run_to_jsonl',
+              'run_in_terminal', 'profile',
+              'infer_types', 'show_signatures', 'build_schema', 'ingest']
 
   if command not in commands:
     print(color.Format('Unknown command {warning}{command}{end}. '
@@ -172,11 +357,31 @@ def main(argv):
     print(artistic_table)
     return
 
+  if command == 'profile':
+    # Compilation is measured, so cache is not used.
+    trace_flag = '--trace_allocations'
+    trace_allocations = trace_flag in argv[4:]
+    argv = argv[:4] + [a for a in argv[4:] if a != trace_flag]
+    with profiler.Profiling(trace_allocations) as profile:
+      result = RunProgram(filename, command, predicates, argv, cache=None)
+    print(profile.AsJson())
+    return result
+  # Cache is used when LOGICA_CACHE_DIR is set.
+  return RunProgram(filename, command, predicates, argv,
+                    cache=program_cache.GetCache())
+
+
+def RunProgram(filename, command, predicates, argv, cache):
+  """Runs the command on the program of the file."""
   program_text = open(filename).read()
 
   try:
-    parsed_rules = parse.ParseFile(program_text,
-                                   import_root=GetImportRoot())['rule']
+    if cache:
+      parsed = cache.ParseFile(program_text, import_root=GetImportRoot())
+    else:
+      with profiler.Phase('Parse'):
+        parsed = parse.ParseFile(program_text, import_root=GetImportRoot())
+    parsed_rules = parsed['rule']
   except parse.ParsingException as parsing_exception:
     parsing_exception.ShowMessage()
     sys.exit(1)
@@ -207,6 +412,9 @@ def main(argv):
 
   predicates_list = predicates.split(',')
 
+  if command == 'ingest':
+    return Ingest(parsed_rules, predicates, argv[4:])
+
   user_flags = ReadUserFlags(parsed_rules, argv[4:])
 
   if command == 'build_schema':
@@ -218,13 +426,19 @@ def main(argv):
     return 0
 
   for predicate in predicates_list:
+    def Compile():
+      with profiler.Phase('CompilePredicate', predicate):
+        return CompilePredicate(parsed_rules, predicate, user_flags)
     try:
-      logic_program = universe.LogicaProgram(
-          parsed_rules, user_flags=user_flags)
-      formatted_sql = logic_program.FormattedPredicateSql(predicate)
-      preamble = logic_program.execution.preamble
-      defines_and_exports = logic_program.execution.defines_and_exports
-      main_predicate_sql = logic_program.execution.main_predicate_sql
+      if cache:
+        compiled = cache.CompiledPredicate(parsed, user_flags, predicate,
+                                           Compile)
+      else:
+        compiled = Compile()
+      formatted_sql = compiled['formatted_sql']
+      preamble = compiled['preamble']
+      defines_and_exports = compiled['defines_and_exports']
+      main_predicate_sql = compiled['main_predicate_sql']
     except rule_translate.RuleCompileException as rule_compilation_exception:
       rule_compilation_exception.ShowMessage()
       sys.exit(1)
@@ -239,57 +453,30 @@ def main(argv):
     if command == 'print':
       print(formatted_sql)
 
-    engine = logic_program.annotations.Engine()
+    engine = compiled['engine']
 
-    if command == 'run' or command == 'run_to_csv':
-      # We should split and move this logic to dialects.
-      if engine == 'bigquery':
-        output_format = 'csv' if command == 'run_to_csv' else 'pretty'
-        p = subprocess.Popen(['bq', 'query',
-                              '--use_legacy_sql=false',
-                              '--format=%s' % output_format],
-                             stdin=subprocess.PIPE, stdout=subprocess.PIPE)
-        o, _ = p.communicate(formatted_sql.encode())
-      elif engine == 'sqlite':
-        # TODO: Make multi-statement scripts work.
-        format = ('artistictable' if command == 'run' else 'csv')
+    if command == 'run':
+      if engine == 'sqlite':
         statements_to_execute = (
           [preamble] + defines_and_exports + [main_predicate_sql])
         o = sqlite3_logica.RunSqlScript(statements_to_execute,
-                                        format).encode()
-      elif engine == 'psql':
-        p = subprocess.Popen(['psql', '--quiet'] +
-                             (['--csv'] if command == 'run_to_csv' else []),
+                                        'artistictable').encode()
+      else:
+        p = subprocess.Popen(EngineCommand(compiled, 'pretty'),
                              stdin=subprocess.PIPE, stdout=subprocess.PIPE)
-        commands = []
-        o, _ = p.communicate(
-            '\n'.join(commands + [formatted_sql]).encode())
-      elif engine == 'trino':
-        a = logic_program.annotations.annotations['@Engine']['trino']
-        params = GetTrinoParameters(a)
-        p = subprocess.Popen(['trino'] + params +
-                             (['--output-format=CSV_HEADER_UNQUOTED']
-                              if command == 'run_to_csv' else
-                              ['--output-format=ALIGNED']),
-                              stdin=subprocess.PIPE, stdout=subprocess.PIPE)
         o, _ = p.communicate(formatted_sql.encode())
-      elif engine == 'presto':
-        a = logic_program.annotations.annotations['@Engine']['presto']
-        catalog = a.get('catalog', 'memory')
-        server = a.get('server', 'localhost:8080')
-        p = subprocess.Popen(['presto',
-                              '--catalog=%s' % catalog,
-                              '--server=%s' % server,
-                              '--file=/dev/stdin'] +
-                             (['--output-format=CSV_HEADER_UNQUOTED']
-                              if command == 'run_to_csv' else
-                              ['--output-format=ALIGNED']),
-                              stdin=subprocess.PIPE, stdout=subprocess.PIPE)
-        o, _ = p.communicate(formatted_sql.encode())
-      else:
-        assert False, 'Unknown engine: %s' % engine
       print(o.decode())
 
+    if command == 'run_to_csv' or command == 'run_to_jsonl':
+      output_format = 'csv' if command == 'run_to_csv' else 'jsonl'
+      if engine == 'sqlite':
+        statements_to_execute = (
+          [preamble] + defines_and_exports + [main_predicate_sql])
+        sqlite3_logica.StreamSqlScript(statements_to_execute, output_format,
+                                       sys.stdout)
+      else:
+        StreamEngineOutput(compiled, output_format)
+
 
 def run_main():
   """Run main function with system arguments."""
@@ -20,7 +20,9 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
+import array
 import copy
+import functools
 import os
 import re
 import string
@@ -29,8 +31,12 @@ from typing import Dict, Iterator, List, Optional, Tuple
 
 if '.' not in __package__:
   from common import color
+  from common import profiler
+  from common import rule_copy
 else:
   from ..common import color
+  from ..common import profiler
+  from ..common import rule_copy
 
 CLOSE_TO_OPEN = {
     ')': '(',
@@ -69,6 +75,8 @@ class HeritageAwareString(str):
 
   def GetSlice(self, start, stop) -> 'HeritageAwareString':
     substring = HeritageAwareString(str(self)[start:stop])
+    if start < 0:
+      start = max(len(self) + start, 0)
     if stop > len(self):
       stop = len(self)
     if stop < 0:
@@ -229,6 +237,108 @@ def Traverse(s):
     yield (idx, state, 'OK')
 
 
+class LexicalIndex(object):
+  """Bracket structure of a string, computed with a single Traverse.
+
+  Parsing functions split and strip substrings of the same statement at every
+  level of descent. The index lets IsWhole and SplitRaw work on any substring
+  of the indexed string without traversing the substring again.
+  """
+
+  def __init__(self, s):
+    n = len(s)
+    # Bracket depth after the character, -1 if the character ends up in
+    # a string.
+    self.depth = array.array('i', [-1]) * n
+    # Position of the innermost bracket open before the character, or -1.
+    self.open_before = array.array('i', [-1]) * n
+    # Maps position of an opening bracket to position of its closing bracket.
+    self.closing = {}
+    # Marks characters continuing a multi-character token, i.e. """.
+    self.continuation = bytearray(n + 1)
+    # Index is not built for strings with comments or syntax errors, parsing
+    # falls back to Traverse then.
+    self.ok = True
+    stack = []
+    in_code = True
+    expected_idx = 0
+    for idx, state, status in Traverse(s):
+      if status != 'OK' or idx != expected_idx:
+        self.ok = False
+        return
+      expected_idx = idx + 1
+      if stack:
+        self.open_before[idx] = stack[-1]
+      now_in_code = not state or state[-1] in OPENING_PARENTHESIS
+      if in_code:
+        if s[idx] in OPENING_PARENTHESIS:
+          stack.append(idx)
+        elif s[idx] in CLOSING_PARENTHESIS:
+          self.closing[stack.pop()] = idx
+      if now_in_code:
+        self.depth[idx] = len(state)
+      elif state[-1] not in '"`3':
+        self.ok = False
+        return
+      if s[idx:(idx + 3)] == '"""' and (in_code or state[-1:] != '3'):
+        self.continuation[idx + 1] = 1
+        self.continuation[idx + 2] = 1
+      in_code = now_in_code
+    if expected_idx != n:
+      self.ok = False
+
+  def Covers(self, s):
+    """Whether the index applies to the substring s of the heritage."""
+    if not self.ok:
+      return False
+    if s.start > 0 and self.depth[s.start - 1] < 0:
+      return False
+    return not (self.continuation[s.start] or self.continuation[s.stop])
+
+  def IsWhole(self, s):
+    if s.start == s.stop:
+      return True
+    opening = self.open_before[s.start]
+    if opening < 0 or opening not in self.closing:
+      return True
+    return s.stop <= self.closing[opening]
+
+  def SplitRaw(self, s, separator):
+    """Top level parts of the string, same as SplitRaw."""
+    heritage = s.heritage
+    l = len(separator)
+    base_depth = self.depth[s.start - 1] if s.start > 0 else 0
+    parts = []
+    part_start = s.start
+    idx = heritage.find(separator, s.start, s.stop)
+    while idx >= 0:
+      if (self.depth[idx] == base_depth and (
+          s.stop == idx + l or heritage[idx + l] != '|') and (
+              idx == s.start or heritage[idx - 1] != '|')):
+        parts.append(s[(part_start - s.start):(idx - s.start)])
+        part_start = idx + l
+        idx = heritage.find(separator, idx + l, s.stop)
+      else:
+        idx = heritage.find(separator, idx + 1, s.stop)
+    parts.append(s[(part_start - s.start):])
+    return parts
+
+
+@functools.lru_cache(maxsize=64)
+def GetLexicalIndex(heritage):
+  return LexicalIndex(heritage)
+
+
+def IndexOf(s):
+  """Returns lexical index applicable to the string, if any."""
+  if not isinstance(s, HeritageAwareString):
+    return None
+  index = GetLexicalIndex(s.heritage)
+  if not index.Covers(s):
+    return None
+  return index
+
+
 def RemoveComments(s):
   chars = []
   for idx, unused_state, status in Traverse(s):
@@ -243,6 +353,9 @@ def RemoveComments(s):
 
 def IsWhole(s):
   """String is 'whole' if all parenthesis match."""
+  index = IndexOf(s)
+  if index:
+    return index.IsWhole(s)
   status = 'OK'
   for (_, _, status) in Traverse(s):
     pass
@@ -297,6 +410,10 @@ def SplitRaw(s, separator):
   Raises:
     ParsingException: When parenthesis don't match.
   """
+  index = IndexOf(s)
+  if (index and separator and index.IsWhole(s) and
+      not set(separator) & set(CLOSING_PARENTHESIS + OPENING_PARENTHESIS)):
+    return index.SplitRaw(s, separator)
   parts = []
   l = len(separator)
   traverse = Traverse(s)
@@ -1189,17 +1306,9 @@ def SplitImport(import_str):
   return ('.'.join(import_parts[:-1]), import_parts[-1], synonym)
 
 
-def ParseImport(file_import_str, parsed_imports, import_chain, import_root):
-  """Parses an import, returns extracted rules."""
+def ImportedFilePath(file_import_str, import_root):
+  """Finds the file of an import in the import root."""
   file_import_parts = file_import_str.split('.')
-  if file_import_str in parsed_imports:
-    if parsed_imports[file_import_str] is None:
-      raise ParsingException(
-          'Circular imports are not allowed: %s.' % '->'.join(import_chain +
-                                                             [file_import_str]),
-          HeritageAwareString(file_import_str))    
-    return None
-  parsed_imports[file_import_str] = None
   if isinstance(import_root, str):
     file_path = os.path.join(import_root, '/'.join(file_import_parts) + '.l')
     if not os.path.exists(file_path):
@@ -1221,7 +1330,20 @@ def ParseImport(file_import_str, parsed_imports, import_chain, import_root):
               considered_files),
           HeritageAwareString(
               'import ' + file_import_str + '.<PREDICATE>')[7:-11])
+  return file_path
+
 
+def ParseImport(file_import_str, parsed_imports, import_chain, import_root):
+  """Parses an import, returns extracted rules."""
+  if file_import_str in parsed_imports:
+    if parsed_imports[file_import_str] is None:
+      raise ParsingException(
+          'Circular imports are not allowed: %s.' % '->'.join(import_chain +
+                                                             [file_import_str]),
+          HeritageAwareString(file_import_str))    
+    return None
+  parsed_imports[file_import_str] = None
+  file_path = ImportedFilePath(file_import_str, import_root)
   with open(file_path) as f:
     file_content = f.read()
   parsed_file = ParseFile(file_content, file_import_str, parsed_imports,
@@ -1288,7 +1410,7 @@ class MultiBodyAggregation(object):
   @classmethod
   def Rewrite(cls, rules):
     """Enabling multi-body-aggregation via auxiliary predicates."""
-    rules = copy.deepcopy(rules)
+    rules = rule_copy.Copy(rules)
     new_rules = []
     defined_predicates_rules = DefinedPredicatesRules(rules)
     multi_body_aggregating_predicates = [
@@ -1356,7 +1478,7 @@ class MultiBodyAggregation(object):
   @classmethod
   def SplitAggregation(cls, rule):
     """Replacing aggregations with their arguments."""
-    rule = copy.deepcopy(rule)
+    rule = rule_copy.Copy(rule)
     if 'distinct_denoted' not in rule:
       raise ParsingException('Inconsistency in >>distinct<< denoting for '
                              'predicate >>%s<<.' %
@@ -1456,8 +1578,11 @@ class DisjunctiveNormalForm(object):
     dnf = cls.PropositionToDNF(proposition)
     result = []
     for conjuncts in dnf:
-      new_rule = copy.deepcopy(rule)
-      new_rule['body'] = {'conjunction': {'conjunct': copy.deepcopy(conjuncts)}}
+      # Body is replaced, so only the rest of the rule is copied.
+      new_rule = rule_copy.Copy(
+          {k: v for k, v in rule.items() if k != 'body'})
+      new_rule['body'] = {
+          'conjunction': {'conjunct': rule_copy.Copy(conjuncts)}}
       result.append(new_rule)
     return result
 
@@ -1523,7 +1648,7 @@ class AggergationsAsExpressions(object):
 
   @classmethod
   def Rewrite(cls, rules):
-    rules = copy.deepcopy(rules)
+    rules = rule_copy.Copy(rules)
     cls.RewriteInternal(rules)
     return rules
 
@@ -1532,7 +1657,8 @@ def ParseFile(s, this_file_name=None, parsed_imports=None, import_chain=None,
               import_root=None):
   """Parsing logica.Logica."""
   s = HeritageAwareString(RemoveComments(HeritageAwareString(s)))
-  parsed_imports = parsed_imports or {}
+  if parsed_imports is None:
+    parsed_imports = {}
   this_file_name = this_file_name or 'main'
   import_chain = import_chain or []
   import_chain = import_chain + [this_file_name]
@@ -1571,9 +1697,11 @@ def ParseFile(s, this_file_name=None, parsed_imports=None, import_chain=None,
     if rule:
       rules.append(rule)
   # Eliminate explicit disjunctions via DNF reduction.
-  rules = DisjunctiveNormalForm.Rewrite(rules)
+  with profiler.Phase('DisjunctiveNormalForm'):
+    rules = DisjunctiveNormalForm.Rewrite(rules)
   # Multibody aggregation uses concise aggregation structure.
-  rules = MultiBodyAggregation.Rewrite(rules)
+  with profiler.Phase('MultiBodyAggregation'):
+    rules = MultiBodyAggregation.Rewrite(rules)
   # Concise structure is no longer needed, rewriting into expressions.
   rules = AggergationsAsExpressions.Rewrite(rules)
 
@@ -0,0 +1,116 @@
+#!/usr/bin/python
+#
+# Copyright 2023 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Thin client of the Logica server, see tools/logica_server.py.
+
+Usage is same as of logica.py, the work is done by a running server:
+
+  python3 logica.py serve &
+  python3 tools/logica_client.py my_program.l print MyPredicate
+  python3 tools/logica_client.py --stop
+
+The client only uses the standard library, so that it starts fast.
+"""
+
+import json
+import os
+import socket
+import sys
+
+# Environment variables that affect the command and are sent to the server.
+FORWARDED_VARIABLES = ['LOGICAPATH']
+
+
+def DefaultSocketPath():
+  """Socket path from LOGICA_SOCKET or a per-user default."""
+  return os.environ.get('LOGICA_SOCKET',
+                        '/tmp/logica-%d.sock' % os.getuid())
+
+
+def SendMessage(connection, message):
+  connection.sendall(json.dumps(message).encode() + b'\n')
+
+
+def ReadMessages(connection):
+  """Yields newline terminated JSON messages until the connection closes."""
+  with connection.makefile('rb') as messages:
+    for line in messages:
+      yield json.loads(line.decode())
+
+
+def ReadMessage(connection):
+  """Reads a newline terminated JSON message, None if there is none."""
+  return next(ReadMessages(connection), None)
+
+
+def WriteOutput(message):
+  """Writes output chunk of a response to the standard output or error."""
+  if 'stdout' in message:
+    sys.stdout.write(message['stdout'])
+    sys.stdout.flush()
+  if 'stderr' in message:
+    sys.stderr.write(message['stderr'])
+    sys.stderr.flush()
+
+
+def Request(request, socket_path=None, output=WriteOutput):
+  """Sends request to the server, returning the final message.
+
+  Output chunks sent before the final message are given to output as they
+  arrive, so that large output is not held in memory.
+  """
+  socket_path = socket_path or DefaultSocketPath()
+  # Programs are not sent to a server of another user.
+  if os.stat(socket_path).st_uid != os.getuid():
+    raise OSError('socket is owned by another user')
+  connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+  with connection:
+    connection.connect(socket_path)
+    SendMessage(connection, request)
+    for message in ReadMessages(connection):
+      if 'stdout' in message or 'stderr' in message:
+        output(message)
+        continue
+      return message
+  raise OSError('server closed connection without a response')
+
+
+def main(argv):
+  if argv[1:] == ['--stop']:
+    request = {'stop': True}
+  else:
+    request = {
+        'argv': ['logica'] + argv[1:],
+        'cwd': os.getcwd(),
+        'environment': {k: os.environ[k] for k in FORWARDED_VARIABLES
+                        if k in os.environ}
+    }
+    if len(argv) > 1 and argv[1] == '-':
+      request['stdin'] = sys.stdin.read()
+  try:
+    response = Request(request)
+  except OSError as e:
+    print('Could not connect to Logica server at %s: %s\n'
+          'Start it with: logica serve' % (DefaultSocketPath(), e),
+          file=sys.stderr)
+    return 1
+  if 'stopped' in response:
+    return 0
+  return response['exit_code']
+
+
+if __name__ == '__main__':
+  sys.exit(main(sys.argv))
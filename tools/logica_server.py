@@ -0,0 +1,212 @@
+#!/usr/bin/python
+#
+# Copyright 2023 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Long-lived Logica server, avoiding startup cost of each command.
+
+Server runs logica.py commands sent by tools/logica_client.py over a Unix
+socket. Each request is a single line of JSON:
+  {"argv": [...], "cwd": "...", "environment": {...}, "stdin": "..."}
+and the response is a line of JSON per chunk of output, as it is written:
+  {"stdout": "..."} or {"stderr": "..."}
+followed by a line with the status of the command:
+  {"exit_code": 0}
+Request {"stop": true} stops the server.
+
+Compiler modules are imported once, and parsed programs and compiled
+predicates are kept in program_cache.process_cache, and inferred types in
+infer.process_cache. Requests are handled one at a time, as commands change
+working directory and write to the standard output.
+"""
+
+import codecs
+import os
+import socket
+import stat
+import sys
+import tempfile
+import threading
+import traceback
+
+if '.' not in __package__:
+  from tools import logica_client
+else:
+  from ..tools import logica_client
+
+
+# Maximal number of bytes of output sent in a message.
+CHUNK_SIZE = 65536
+
+
+class OutputForwarder(object):
+  """Sends output written to a file descriptor as messages."""
+
+  def __init__(self, send):
+    self.send = send
+    self.lock = threading.Lock()
+    self.disconnected = False
+    self.threads = []
+
+  def Send(self, message):
+    with self.lock:
+      if self.disconnected:
+        return
+      try:
+        self.send(message)
+      except OSError:
+        # Output is still read, so that the command does not block.
+        self.disconnected = True
+
+  def Forward(self, fd, name):
+    """Redirects the file descriptor to a pipe forwarding the output."""
+    read_fd, write_fd = os.pipe()
+    os.dup2(write_fd, fd)
+    os.close(write_fd)
+    thread = threading.Thread(target=self.Read, args=(read_fd, name))
+    thread.start()
+    self.threads.append(thread)
+
+  def Read(self, read_fd, name):
+    decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+    with os.fdopen(read_fd, 'rb', buffering=0) as pipe:
+      while True:
+        chunk = pipe.read(CHUNK_SIZE)
+        text = decoder.decode(chunk, final=not chunk)
+        if text:
+          self.Send({name: text})
+        if not chunk:
+          break
+
+  def Join(self):
+    for thread in self.threads:
+      thread.join()
+
+
+def RunCommand(request, main, send):
+  """Runs main on request arguments, sending output as it is written.
+
+  Returns exit code, which is the value returned by main or the code it
+  exits with.
+  """
+  argv = list(request['argv'])
+  stdin_file = None
+  if request.get('stdin') is not None:
+    stdin_file = tempfile.NamedTemporaryFile('w', suffix='.l', delete=False)
+    with stdin_file:
+      stdin_file.write(request['stdin'])
+    argv[1] = stdin_file.name
+  saved_cwd = os.getcwd()
+  saved_environment = dict(os.environ)
+  saved_fds = [os.dup(1), os.dup(2)]
+  exit_code = 0
+  forwarder = OutputForwarder(send)
+  sys.stdout.flush()
+  sys.stderr.flush()
+  # Redirecting file descriptors to also forward output of subprocesses.
+  forwarder.Forward(1, 'stdout')
+  forwarder.Forward(2, 'stderr')
+  try:
+    os.chdir(request['cwd'])
+    os.environ.update(request.get('environment', {}))
+    result = main(argv)
+    if isinstance(result, int):
+      exit_code = result
+  except SystemExit as e:
+    if isinstance(e.code, int):
+      exit_code = e.code
+    elif e.code is not None:
+      print(e.code, file=sys.stderr)
+      exit_code = 1
+  except Exception:
+    traceback.print_exc()
+    exit_code = 1
+  finally:
+    sys.stdout.flush()
+    sys.stderr.flush()
+    # Restoring the descriptors closes the pipes, ending the forwarding.
+    os.dup2(saved_fds[0], 1)
+    os.dup2(saved_fds[1], 2)
+    for fd in saved_fds:
+      os.close(fd)
+    forwarder.Join()
+    os.chdir(saved_cwd)
+    os.environ.clear()
+    os.environ.update(saved_environment)
+    if stdin_file:
+      os.remove(stdin_file.name)
+  return exit_code
+
+
+def PrepareSocketPath(socket_path):
+  """Removes socket left by a stopped server, returns error if path is busy."""
+  if not os.path.lexists(socket_path):
+    return None
+  if not stat.S_ISSOCK(os.lstat(socket_path).st_mode):
+    return '%s exists and is not a socket.' % socket_path
+  probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+  with probe:
+    try:
+      probe.connect(socket_path)
+    except ConnectionRefusedError:
+      os.remove(socket_path)
+      return None
+  return 'Logica server is already running on %s.' % socket_path
+
+
+def Serve(main, socket_path=None):
+  """Serves requests until stopped, running them with main.
+
+  Socket is accessible only by the user running the server, as requests
+  run arbitrary programs on behalf of the user. Returns exit code.
+  """
+  socket_path = socket_path or logica_client.DefaultSocketPath()
+  error = PrepareSocketPath(socket_path)
+  if error:
+    print(error, file=sys.stderr)
+    return 1
+  server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+  # Socket is created with permissions 0600, without a moment when it's
+  # open to others.
+  saved_umask = os.umask(0o177)
+  try:
+    server.bind(socket_path)
+  finally:
+    os.umask(saved_umask)
+  server.listen()
+  print('Logica server is listening on %s.' % socket_path, file=sys.stderr)
+  try:
+    while True:
+      connection, _ = server.accept()
+      with connection:
+        try:
+          request = logica_client.ReadMessage(connection)
+          if request is None:
+            continue
+          if request.get('stop'):
+            logica_client.SendMessage(connection, {'stopped': True})
+            break
+          exit_code = RunCommand(
+              request, main,
+              lambda message: logica_client.SendMessage(connection, message))
+          logica_client.SendMessage(connection, {'exit_code': exit_code})
+        except (OSError, ValueError) as e:
+          # Client went away or sent a malformed request.
+          print('Failed to serve request: %s' % e, file=sys.stderr)
+  except KeyboardInterrupt:
+    pass
+  finally:
+    server.close()
+    os.remove(socket_path)
+  return 0
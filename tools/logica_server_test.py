@@ -0,0 +1,111 @@
+#!/usr/bin/python
+#
+# Copyright 2023 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Unitests for logica_server.py."""
+
+import os
+import shutil
+import stat
+import sys
+import tempfile
+import threading
+import time
+import unittest
+
+from tools import logica_client
+from tools import logica_server
+
+
+def Main(argv):
+  """Stands for logica.main, echoing the program it was given.
+
+  Output is written to the file descriptors, as test runners replace
+  sys.stdout.
+  """
+  if argv[2] == 'fail':
+    os.write(2, b'Failed.\n')
+    sys.exit(3)
+  if argv[2] == 'error':
+    os.write(2, b'Error.\n')
+    return 1
+  if argv[2] == 'large':
+    for _ in range(4):
+      os.write(1, 'é'.encode() * logica_server.CHUNK_SIZE)
+    return 0
+  with open(argv[1]) as program:
+    os.write(1, ('%s in %s\n' % (program.read(), os.getcwd())).encode())
+
+
+class ServerTest(unittest.TestCase):
+  def setUp(self):
+    self.directory = tempfile.mkdtemp()
+    self.socket_path = os.path.join(self.directory, 'logica.sock')
+    self.server = threading.Thread(
+        target=logica_server.Serve, args=(Main, self.socket_path))
+    self.server.start()
+    while not os.path.exists(self.socket_path):
+      time.sleep(0.01)
+
+  def tearDown(self):
+    logica_client.Request({'stop': True}, self.socket_path)
+    self.server.join()
+    shutil.rmtree(self.directory)
+
+  def Request(self, argv, **request):
+    """Returns the final message and the messages of output."""
+    output = []
+    response = logica_client.Request(
+        dict(argv=['logica'] + argv, cwd=self.directory, **request),
+        self.socket_path, output.append)
+    return response, output
+
+  def Output(self, output, name):
+    return ''.join(m.get(name, '') for m in output)
+
+  def test_RoundTrip(self):
+    response, output = self.Request(['-', 'print', 'Test'], stdin='Test(1)')
+    self.assertEqual(response, {'exit_code': 0})
+    self.assertEqual(self.Output(output, 'stdout'),
+                     'Test(1) in %s\n' % os.path.realpath(self.directory))
+    self.assertEqual(self.Output(output, 'stderr'), '')
+    response, output = self.Request(['-', 'fail', 'Test'], stdin='')
+    self.assertEqual(response, {'exit_code': 3})
+    self.assertEqual(output, [{'stderr': 'Failed.\n'}])
+
+  def test_ReturnedExitCode(self):
+    response, output = self.Request(['-', 'error', 'Test'], stdin='')
+    self.assertEqual(response, {'exit_code': 1})
+    self.assertEqual(output, [{'stderr': 'Error.\n'}])
+
+  def test_OutputIsStreamedInChunks(self):
+    response, output = self.Request(['-', 'large', 'Test'], stdin='')
+    self.assertEqual(response, {'exit_code': 0})
+    self.assertGreater(len(output), 1)
+    self.assertEqual(self.Output(output, 'stdout'),
+                     'é' * (4 * logica_server.CHUNK_SIZE))
+
+  def test_SocketIsPrivate(self):
+    mode = stat.S_IMODE(os.stat(self.socket_path).st_mode)
+    self.assertEqual(mode & 0o077, 0)
+
+  def test_LiveSocketIsNotReplaced(self):
+    self.assertEqual(logica_server.Serve(Main, self.socket_path), 1)
+    self.assertEqual(self.Request(['-', 'print', 'Test'],
+                                  stdin='Test(2)')[0], {'exit_code': 0})
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -63,13 +63,18 @@ class SqlRunner(object):
     self.bq_project = project
   
   # TODO: Sqlite runner should not be accepting an engine.
-  def __call__(self, sql, engine, is_final):
+  def __call__(self, sql, engine, is_final, stream=False):
     return RunSQL(sql, engine, self.connection, is_final,
-                  self.bq_credentials, self.bq_project)
+                  self.bq_credentials, self.bq_project, stream=stream)
 
 
 def RunSQL(sql, engine, connection=None, is_final=False,
-           bq_credentials=None, bq_project=None):
+           bq_credentials=None, bq_project=None, stream=False):
+  """Runs SQL, returning header and rows of final predicates.
+
+  With stream rows of PostgreSQL and SQLite results are an iterator, which
+  fetches them from the database as they are read.
+  """
   if engine == 'bigquery':
     from google.cloud import bigquery
     client = bigquery.Client(credentials=bq_credentials,
@@ -81,10 +86,11 @@ def RunSQL(sql, engine, connection=None, is_final=False,
     return list(df.columns), [list(r) for _, r in df.iterrows()]
   elif engine == 'psql':
     if is_final:
-      cursor = psql_logica.PostgresExecute(sql, connection)
-      rows = [list(map(psql_logica.DigestPsqlType, row))
-              for row in cursor.fetchall()]
-      return [d[0] for d in cursor.description], rows
+      cursor = psql_logica.PostgresQuery(sql, connection)
+      if stream:
+        result = psql_logica.ResultStream(cursor)
+        return result.header, result.Rows()
+      return psql_logica.FetchRows(cursor)
     else:
       psql_logica.PostgresExecute(sql, connection)
   elif engine == 'sqlite':
@@ -92,10 +98,12 @@ def RunSQL(sql, engine, connection=None, is_final=False,
       if is_final:
         cursor = connection.execute(sql)
         header = [d[0] for d in cursor.description]
+        if stream:
+          return header, cursor
         rows = cursor.fetchall()
         return header, rows
       else:
-        connection.executescript(sql)
+        sqlite3_logica.ExecuteScript(connection, sql)
     except Exception as e:
       print("\n--- SQL ---")
       print(sql)
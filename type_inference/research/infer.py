@@ -14,6 +14,7 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import collections
 import hashlib
 import json
 import sys
@@ -22,13 +23,26 @@ if '.' not in __package__:
   from type_inference.research import reference_algebra
   from type_inference.research import types_of_builtins
   from common import color
+  from common import rule_copy
+  from common import rule_index
 else:
   from ..research import reference_algebra
   from ..research import types_of_builtins
   try:
     from ...common import color
+    from ...common import rule_copy
+    from ...common import rule_index
   except:
     from common import color
+    from common import rule_copy
+    from common import rule_index
+
+# Maximal number of predicates kept by InferenceCache.
+INFERENCE_CACHE_SIZE = 20000
+
+# Cache used by LogicaProgram type inference, if set. Long-lived processes,
+# e.g. notebooks, set it to re-infer only predicates that changed.
+process_cache = None
 
 
 class ContextualizedError:
@@ -110,6 +124,10 @@ def ExpressionsIterator(node):
     yield node['inclusion']['list']
 
 
+# Walk does not enter types.
+SKIP_KEYS = ('type',)
+
+
 def Walk(node, act):
   """Walking over a dictionary of lists, acting on each element."""
   if isinstance(node, list):
@@ -149,9 +167,75 @@ def ActRecallingTypes(node):
       remembered_type
     )
 
+# Keys of rules that do not affect types.
+NON_STRUCTURAL_KEYS = frozenset(
+    ['type', 'remembered_type', 'expression_heritage', 'full_text'])
+
+
+def RuleFingerprint(rule):
+  """Fingerprint of the rule structure, ignoring text positions and types."""
+  def Strip(node):
+    if isinstance(node, dict):
+      return {k: Strip(v) for k, v in node.items()
+              if k not in NON_STRUCTURAL_KEYS}
+    if isinstance(node, list):
+      return [Strip(v) for v in node]
+    return node
+  return hashlib.sha256(
+      json.dumps(Strip(rule), default=str).encode()).hexdigest()
+
+
+def IndexedTypes(rule):
+  """Returns types of the rule as pairs of node index in Walk and type."""
+  nodes = rule_index.DictNodes(rule, SKIP_KEYS)
+  return [(i, node['type']) for i, node in enumerate(nodes)
+          if 'type' in node]
+
+
+def SetIndexedTypes(rule, indexed_types):
+  """Sets types of structurally identical rule, see IndexedTypes."""
+  nodes = rule_index.DictNodes(rule, SKIP_KEYS)
+  for i, t in indexed_types:
+    nodes[i]['type'] = t
+
+
+class InferenceCache:
+  """Inferred types of predicates, reused by TypesInferenceEngine.
+
+  Entries are keyed by rules of the predicate together with keys of
+  predicates that it depends on, so editing a predicate invalidates it and
+  everything that uses it. Least recently used entries are evicted.
+  """
+
+  def __init__(self, max_predicates=INFERENCE_CACHE_SIZE):
+    self.max_predicates = max_predicates
+    self.entries = collections.OrderedDict()
+
+  def Get(self, key):
+    """Returns copy of types of rules and of signature, or None."""
+    if key not in self.entries:
+      return None
+    self.entries.move_to_end(key)
+    return self.Copy(*self.entries[key])
+
+  def Put(self, key, rules_types, signature):
+    self.entries[key] = self.Copy(rules_types, signature)
+    self.entries.move_to_end(key)
+    while len(self.entries) > self.max_predicates:
+      self.entries.popitem(last=False)
+
+  @classmethod
+  def Copy(cls, rules_types, signature):
+    copier = reference_algebra.TypeStructureCopier()
+    return (rule_copy.Copy(rules_types),
+            {f: copier.CopyConcreteOrReferenceType(t)
+             for f, t in signature.items()})
+
+
 class TypesInferenceEngine:
-  def __init__(self, parsed_rules):
+  def __init__(self, parsed_rules, cache=None):
     self.parsed_rules = parsed_rules
+    self.cache = cache
     self.predicate_argumets_types = {}
     self.dependencies = BuildDependencies(self.parsed_rules)
     self.complexities = BuildComplexities(self.dependencies)
@@ -198,18 +282,82 @@ class TypesInferenceEngine:
         value_type)
 
 
+  def PredicateKeys(self):
+    """Returns keys of predicates for the cache.
+
+    Key covers rules of the predicate and, via their keys, rules of all
+    predicates it depends on. Predicates on dependency cycles get None and
+    are always inferred.
+    """
+    fingerprints = collections.defaultdict(list)
+    for rule in self.parsed_rules:
+      predicate_name = rule['head']['predicate_name']
+      if predicate_name[0] != '@':
+        fingerprints[predicate_name].append(RuleFingerprint(rule))
+    keys = {}
+    in_progress = set()
+    def GetKey(p):
+      if p not in fingerprints:  # Built-in or a table.
+        return p
+      if p in in_progress:
+        return None
+      if p not in keys:
+        in_progress.add(p)
+        dependency_keys = [GetKey(d) for d in sorted(self.dependencies[p])]
+        in_progress.remove(p)
+        if None in dependency_keys:
+          keys[p] = None
+        else:
+          keys[p] = Fingerprint(
+              json.dumps([p, fingerprints[p], dependency_keys]))
+      return keys[p]
+    for p in fingerprints:
+      GetKey(p)
+    return keys
+
   def InferTypes(self):
+    keys = self.PredicateKeys() if self.cache else {}
+    reused = {}
+    for p, key in keys.items():
+      if key is not None:
+        cached = self.cache.Get(key)
+        if cached is not None:
+          reused[p] = cached
+
+    rules_of_predicate = collections.defaultdict(list)
+    inferences = []
     for rule in self.parsed_rules:
-      if rule['head']['predicate_name'][0] == '@':
+      predicate_name = rule['head']['predicate_name']
+      if predicate_name[0] == '@':
+        continue
+      rules_of_predicate[predicate_name].append(rule)
+      if predicate_name in reused:
+        # Signature is placed in the order of inference, as it would be.
+        if predicate_name not in self.predicate_signature:
+          self.predicate_signature[predicate_name] = reused[predicate_name][1]
         continue
       t = TypeInferenceForRule(rule, self.predicate_signature)
       t.PerformInference()
       self.UpdateTypes(rule)
+      inferences.append(t)
 
-    for rule in self.parsed_rules:
-      Walk(rule, ConcretizeTypes)
+    for t in inferences:
+      t.ConcretizeTypes()
+    for p, (rules_types, _) in reused.items():
+      for rule, indexed_types in zip(rules_of_predicate[p], rules_types):
+        SetIndexedTypes(rule, indexed_types)
     self.CollectTypes()
 
+    for p, rules in rules_of_predicate.items():
+      if keys.get(p) is None or p in reused:
+        continue
+      rules_types = [IndexedTypes(rule) for rule in rules]
+      # Types with errors carry error messages with locations in the text.
+      if not any(isinstance(t['the_type'], reference_algebra.BadType)
+                 for indexed_types in rules_types
+                 for _, t in indexed_types):
+        self.cache.Put(keys[p], rules_types, self.predicate_signature[p])
+
   def ShowPredicateTypes(self):
     result_lines = []
     for predicate_name, signature in self.predicate_signature.items():
@@ -260,6 +408,7 @@ class TypeInferenceForRule:
     self.type_id_counter = 0
     self.found_error = None
     self.types_of_builtins = types_of_builtins
+    self.index = rule_index.NodeIndex(rule, SKIP_KEYS)
 
   def PerformInference(self):
     self.InitTypes()
@@ -281,10 +430,12 @@ class TypeInferenceForRule:
 
   def InitTypes(self):
     WalkInitializingVariables(self.rule, self.GetTypeId)
-    Walk(self.rule, self.ActInitializingTypes)
+    for node in self.index.nodes:
+      self.ActInitializingTypes(node)
 
   def MindPodLiterals(self):
-    Walk(self.rule, ActMindingPodLiterals)
+    for node in self.index.nodes:
+      ActMindingPodLiterals(node)
 
   def ActMindingBuiltinFieldTypes(self, node):
     def InstillTypes(predicate_name,
@@ -380,7 +531,8 @@ class TypeInferenceForRule:
 
 
   def MindBuiltinFieldTypes(self):
-    Walk(self.rule, self.ActMindingBuiltinFieldTypes)
+    for node in self.index.nodes:
+      self.ActMindingBuiltinFieldTypes(node)
 
   def ActUnifying(self, node):
     if 'unification' in node:
@@ -458,14 +610,22 @@ class TypeInferenceForRule:
       )
 
   def IterateInference(self):
-    Walk(self.rule, self.ActMindingTypingPredicateLiterals)
-    Walk(self.rule, self.ActMindingRecordLiterals)
-    Walk(self.rule, self.ActUnifying)
-    Walk(self.rule, self.ActUnderstandingSubscription)
-    Walk(self.rule, self.ActMindingListLiterals)
-    Walk(self.rule, self.ActMindingInclusion)
-    Walk(self.rule, self.ActMindingCombine)
-    Walk(self.rule, self.ActMindingImplications)
+    passes = [
+        ('literal', self.ActMindingTypingPredicateLiterals),
+        ('record', self.ActMindingRecordLiterals),
+        ('unification', self.ActUnifying),
+        ('subscript', self.ActUnderstandingSubscription),
+        ('literal', self.ActMindingListLiterals),
+        ('inclusion', self.ActMindingInclusion),
+        ('combine', self.ActMindingCombine),
+        ('implication', self.ActMindingImplications)]
+    for key, act in passes:
+      for node in self.index.With(key):
+        act(node)
+
+  def ConcretizeTypes(self):
+    for node in self.index.nodes:
+      ConcretizeTypes(node)
 
 def RenderPredicateSignature(predicate_name, signature):
   def FieldValue(f, v):
@@ -497,13 +657,15 @@ class TypeInferenceForStructure:
   def PerformInference(self):
     quazy_rule = self.BuildQuazyRule()
     self.quazy_rule = quazy_rule
-    Walk(quazy_rule, ActRememberingTypes)
-    Walk(quazy_rule, ActClearingTypes)
     inferencer = TypeInferenceForRule(quazy_rule, self.signatures)
+    for node in inferencer.index.nodes:
+      ActRememberingTypes(node)
+      ActClearingTypes(node)
     inferencer.PerformInference()
-    Walk(quazy_rule, ActRecallingTypes)
+    for node in inferencer.index.nodes:
+      ActRecallingTypes(node)
 
-    Walk(quazy_rule, ConcretizeTypes)
+    inferencer.ConcretizeTypes()
     collector = TypeCollector([quazy_rule])
     collector.CollectTypes()
     self.collector = collector
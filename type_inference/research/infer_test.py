@@ -0,0 +1,72 @@
+#!/usr/bin/python
+#
+# Copyright 2023 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Unitests for infer.py."""
+
+import json
+import unittest
+
+from parser_py import parse
+from type_inference.research import infer
+
+
+PROGRAM = '''
+A(x: 1, y: "a");
+B(x:, y:) :- A(x:, y:);
+C(z: x + 1) :- A(x:);
+D(w: [z]) :- C(z:), z > %d;
+'''
+
+
+class InferenceCacheTest(unittest.TestCase):
+  def Infer(self, program, cache):
+    rules = parse.ParseFile(program)['rule']
+    engine = infer.TypesInferenceEngine(rules, cache)
+    inferred = []
+    original = infer.TypeInferenceForRule.PerformInference
+    def PerformInference(t):
+      inferred.append(t.rule['head']['predicate_name'])
+      original(t)
+    infer.TypeInferenceForRule.PerformInference = PerformInference
+    try:
+      engine.InferTypes()
+    finally:
+      infer.TypeInferenceForRule.PerformInference = original
+    return (json.dumps(rules, sort_keys=True, default=str),
+            engine.ShowPredicateTypes(), sorted(inferred))
+
+  def test_OnlyChangedPredicatesAreInferred(self):
+    cache = infer.InferenceCache()
+    first = self.Infer(PROGRAM % 0, cache)
+    self.assertEqual(first[2], ['A', 'B', 'C', 'D'])
+    again = self.Infer(PROGRAM % 0, cache)
+    self.assertEqual(again[:2], first[:2])
+    self.assertEqual(again[2], [])
+    edited = self.Infer(PROGRAM % 1, cache)
+    self.assertEqual(edited[:2], self.Infer(PROGRAM % 1, None)[:2])
+    self.assertEqual(edited[2], ['D'])
+
+  def test_DependentsAreInvalidated(self):
+    cache = infer.InferenceCache()
+    self.Infer(PROGRAM % 0, cache)
+    changed = PROGRAM.replace('"a"', '2') % 0
+    edited = self.Infer(changed, cache)
+    self.assertEqual(edited[:2], self.Infer(changed, None)[:2])
+    self.assertEqual(edited[2], ['A', 'B', 'C', 'D'])
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -83,17 +83,33 @@ class BadType(tuple):
     return str(self)
 
 class TypeReference:
+  """Node of a disjoint set forest of types.
+
+  Root reference of a set holds the type as its target, other references
+  point towards the root. Find compresses paths and Link unites roots by
+  rank, so type lookups stay cheap on long unification chains.
+  """
+  __slots__ = ('target', 'rank')
+
   def __init__(self, target):
     self.target = target
+    self.rank = 0
   
   def WeMustGoDeeper(self):
     return isinstance(self.target, TypeReference)
 
+  def Find(self):
+    """Returns root reference, pointing all references on the path to it."""
+    root = self
+    while isinstance(root.target, TypeReference):
+      root = root.target
+    node = self
+    while node.target is not root and node is not root:
+      node.target, node = root, node.target
+    return root
+
   def Target(self):
-    result = self
-    while result.WeMustGoDeeper():
-      result = result.target
-    return result.target
+    return self.Find().target
 
   def TargetTypeClassName(self):
     target = self.Target()
@@ -115,9 +131,7 @@ class TypeReference:
     return str(self)
   
   def CloseRecord(self):
-    a = self
-    while a.WeMustGoDeeper():
-      a = a.target
+    a = self.Find()
     if isinstance(a.target, BadType):
       return
     assert isinstance(a.target, dict), a.target
@@ -219,19 +233,21 @@ def Incompatible(a, b):
   return BadType((a, b))
 
 
+def Link(a, b):
+  """Unites sets of root references a and b, keeping the type of b."""
+  if a.rank > b.rank:
+    a.target, b.target = b.target, a
+    return
+  a.target = b
+  if a.rank == b.rank:
+    b.rank += 1
+
+
 def Unify(a, b):
   """Unifies type reference a with type reference b."""
-  original_a = a
-  original_b = b
-  while a.WeMustGoDeeper():
-    a = a.target
-  while b.WeMustGoDeeper():
-    b = b.target
-  if original_a != a:
-    original_a.target = a
-  if original_b != b:
-    original_b.target = b
-  if id(a) == id(b):
+  a = a.Find()
+  b = b.Find()
+  if a is b:
     return
   assert isinstance(a, TypeReference)
   assert isinstance(b, TypeReference)
@@ -246,7 +262,7 @@ def Unify(a, b):
     concrete_a, concrete_b = concrete_b, concrete_a
 
   if concrete_a == 'Any':
-    a.target = b
+    Link(a, b)
     return
   
   if concrete_a == 'Singular':
@@ -255,7 +271,7 @@ def Unify(a, b):
           Incompatible(a.target, b.target),
           Incompatible(b.target, a.target))
       return
-    a.target = b
+    Link(a, b)
     return
 
   if concrete_a in ('Num', 'Str', 'Bool'):
@@ -273,6 +289,8 @@ def Unify(a, b):
       a_element = TypeReference.To(a_element)
       b_element = TypeReference.To(b_element)
       Unify(a_element, b_element)
+      a = a.Find()
+      b = b.Find()
       # TODO: Make this correct.
       if a_element.TargetTypeClassName() == 'BadType':
         a.target, b.target = (
@@ -329,8 +347,12 @@ def UnifyFriendlyRecords(a, b, record_type):
       a.target = Incompatible(a, b)
       b.target = Incompatible(b, a)
     result[f] = x
-  a.target = TypeReference(record_type(result))
-  b.target = a.target
+  # Unification of fields may have linked a or b into a larger set.
+  a = a.Find()
+  b = b.Find()
+  a.target = record_type(result)
+  if b is not a:
+    Link(b, a)
 
 
 def UnifyListElement(a_list, b_element):
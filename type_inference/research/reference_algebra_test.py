@@ -0,0 +1,63 @@
+#!/usr/bin/python
+#
+# Copyright 2023 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Unitests for reference_algebra.py."""
+
+import unittest
+
+from type_inference.research import reference_algebra
+
+
+class UnifyTest(unittest.TestCase):
+  def test_ChainIsCompressed(self):
+    references = [reference_algebra.TypeReference('Any')
+                  for _ in range(1000)]
+    for a, b in zip(references, references[1:]):
+      reference_algebra.Unify(a, b)
+    reference_algebra.Unify(references[0],
+                            reference_algebra.TypeReference('Num'))
+    root = references[0].Find()
+    self.assertLessEqual(root.rank, 10)
+    for r in references:
+      self.assertEqual(reference_algebra.ConcreteType(r), 'Num')
+      self.assertIs(r.Find(), root)
+      self.assertTrue(r is root or r.target is root)
+
+  def test_TypeIsKeptWhenLinkingByRank(self):
+    x = reference_algebra.TypeReference('Any')
+    y = reference_algebra.TypeReference('Any')
+    reference_algebra.Unify(x, y)
+    s = reference_algebra.TypeReference('Str')
+    reference_algebra.Unify(s, x)
+    self.assertEqual(reference_algebra.ConcreteType(s), 'Str')
+    self.assertEqual(reference_algebra.ConcreteType(y), 'Str')
+    reference_algebra.Unify(y, reference_algebra.TypeReference('Num'))
+    self.assertTrue(x.IsBadType())
+    self.assertTrue(s.IsBadType())
+
+  def test_RecordFields(self):
+    r = reference_algebra.TypeReference('Any')
+    f = reference_algebra.TypeReference('Any')
+    reference_algebra.UnifyRecordField(r, 'a', f)
+    reference_algebra.UnifyRecordField(
+        r, 'a', reference_algebra.TypeReference('Num'))
+    self.assertEqual(reference_algebra.VeryConcreteType(r),
+                     reference_algebra.OpenRecord({'a': 'Num'}))
+    self.assertEqual(reference_algebra.ConcreteType(f), 'Num')
+
+
+if __name__ == '__main__':
+  unittest.main()